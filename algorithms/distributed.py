@@ -0,0 +1,382 @@
+import queue
+import threading
+import typing
+from multiprocessing.connection import Client, Connection, Listener
+
+import gymnasium as gym
+import numpy as np
+from stable_baselines3.common.logger import configure
+from stable_baselines3.common.off_policy_algorithm import OffPolicyAlgorithm
+from stable_baselines3.common.policies import BasePolicy
+
+"""
+Workers and coordinator exchange pickled messages over multiprocessing connections on TCP, authenticated with authkey:
+- coordinator -> worker: ("weights", version, state_dict, exploration_rate) and ("stop", None, None, None)
+- worker -> coordinator: ("transitions", version, transitions, episodes), where every transition is
+  (observation, next_observation, action, reward, done, truncated) and every episode is (total reward, length)
+"""
+
+
+def _get_state_dict(policy: BasePolicy) -> dict:
+    return {key: value.detach().cpu() for key, value in policy.state_dict().items()}
+
+
+class RolloutCoordinator:
+    """
+    Central coordinator of the rollout workers: accepts the connections of the workers, collects the transitions
+    they stream and broadcasts the weights of the policy. A worker that connects receives the last weights broadcast.
+    The transitions are kept in a bounded queue, when it is full the workers block, so the workers can not run ahead
+    of the learner by more than max_queue_size messages.
+
+    Attributes:
+        policy (BasePolicy): the policy of the learner, its initial weights are sent to the workers
+        host (string): host the coordinator listens on, e.g. "0.0.0.0" to accept workers from other machines
+        port (integer): port the coordinator listens on, 0 for a free port (see address)
+        authkey (bytes): key shared with the workers
+        max_queue_size (integer): maximum number of messages of transitions waiting to be consumed
+    """
+
+    def __init__(
+        self,
+        policy: BasePolicy,
+        host: str = "127.0.0.1",
+        port: int = 6000,
+        authkey: bytes = b"suber",
+        max_queue_size: int = 64,
+    ):
+        self.authkey = authkey
+        self._listener = Listener((host, port), authkey=authkey)
+        self.address = self._listener.address
+        self.version = 0
+        self.episodes: typing.List[typing.Tuple[float, int]] = []
+        self._weights = ("weights", self.version, _get_state_dict(policy), 0.0)
+        self._transitions = queue.Queue(max_queue_size)
+        # transitions received but not returned yet by get_transitions, because of max_transitions
+        self._pending: typing.List[tuple] = []
+        self._conns: typing.List[Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self._accept_thread.start()
+
+    @property
+    def num_workers(self) -> int:
+        with self._lock:
+            return len(self._conns)
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    return
+                try:
+                    conn.send(self._weights)
+                except OSError:
+                    continue
+                self._conns.append(conn)
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _receive(self, conn: Connection):
+        """
+        Moves the transitions received from a worker to the queue, until the worker disconnects
+        """
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == "transitions":
+                    self._transitions.put(message[1:])
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                if conn in self._conns:
+                    self._conns.remove(conn)
+            conn.close()
+
+    def broadcast(self, policy: BasePolicy, exploration_rate: float = 0.0):
+        """
+        Sends the weights of policy to all the workers, the workers that connect later receive them on connection
+
+        Args:
+            policy (BasePolicy): the policy of the learner
+            exploration_rate (float): probability that the workers take a random action (e.g. the epsilon of DQN)
+        """
+        with self._lock:
+            self.version += 1
+            self._weights = (
+                "weights",
+                self.version,
+                _get_state_dict(policy),
+                exploration_rate,
+            )
+            for conn in list(self._conns):
+                try:
+                    conn.send(self._weights)
+                except OSError:
+                    self._conns.remove(conn)
+
+    def get_transitions(
+        self,
+        min_transitions: int = 1,
+        timeout: float = None,
+        max_transitions: int = None,
+    ) -> typing.List[tuple]:
+        """
+        Waits for at least min_transitions transitions and returns all the transitions received so far,
+        at most max_transitions: the other transitions are kept and returned first by the next call
+
+        Args:
+            min_transitions (integer): minimum number of transitions returned
+            timeout (float, optional): seconds waited for each message of the workers, queue.Empty is raised on timeout
+            max_transitions (integer, optional): maximum number of transitions returned, by default all
+
+        Return:
+            list of (observation, next_observation, action, reward, done, truncated)
+        """
+        transitions, self._pending = self._pending, []
+        while (
+            len(transitions) < min_transitions or not self._transitions.empty()
+        ) and (max_transitions is None or len(transitions) < max_transitions):
+            if len(transitions) < min_transitions:
+                _, message_transitions, episodes = self._transitions.get(
+                    timeout=timeout
+                )
+            else:
+                _, message_transitions, episodes = self._transitions.get_nowait()
+            transitions.extend(message_transitions)
+            self.episodes.extend(episodes)
+        if max_transitions is not None and len(transitions) > max_transitions:
+            self._pending = transitions[max_transitions:]
+            del transitions[max_transitions:]
+        return transitions
+
+    def learn(
+        self,
+        model: OffPolicyAlgorithm,
+        total_timesteps: int,
+        broadcast_interval: int = 1000,
+        timeout: float = None,
+    ) -> OffPolicyAlgorithm:
+        """
+        Trains an off-policy algorithm (e.g. DQN) on the transitions of the workers: the transitions are added to the
+        replay buffer of model, model is trained as in OffPolicyAlgorithm.learn (train_freq, gradient_steps and
+        learning_starts are counted in transitions received) and its weights are broadcast every broadcast_interval
+        transitions. The environment of model is not used.
+
+        Args:
+            model (OffPolicyAlgorithm): the learner, with a replay buffer for a single environment
+            total_timesteps (integer): number of transitions to train on
+            broadcast_interval (integer): number of transitions between two broadcasts of the weights
+            timeout (float, optional): seconds waited for the workers, see get_transitions
+
+        Return:
+            model
+        """
+        if getattr(model, "_logger", None) is None:
+            model.set_logger(configure(folder=None, format_strings=[]))
+        train_freq = model.train_freq.frequency
+        gradient_steps = model.gradient_steps if model.gradient_steps > 0 else 1
+        last_train, last_broadcast = model.num_timesteps, model.num_timesteps
+        end = model.num_timesteps + total_timesteps
+        self.broadcast(model.policy, getattr(model, "exploration_rate", 0.0))
+
+        while model.num_timesteps < end:
+            # the transitions after end are kept by the coordinator for the next call
+            for transition in self.get_transitions(
+                timeout=timeout, max_transitions=end - model.num_timesteps
+            ):
+                self._add_transition(model, transition)
+                model.num_timesteps += 1
+                model._current_progress_remaining = max(
+                    0.0,
+                    1.0
+                    - (model.num_timesteps - end + total_timesteps)
+                    / float(total_timesteps),
+                )
+                model._on_step()
+
+                if model.num_timesteps > model.learning_starts:
+                    if model.num_timesteps - last_train >= train_freq:
+                        model.train(
+                            gradient_steps=gradient_steps, batch_size=model.batch_size
+                        )
+                        last_train = model.num_timesteps
+                else:
+                    last_train = model.num_timesteps
+                if model.num_timesteps - last_broadcast >= broadcast_interval:
+                    self.broadcast(
+                        model.policy, getattr(model, "exploration_rate", 0.0)
+                    )
+                    last_broadcast = model.num_timesteps
+        return model
+
+    @staticmethod
+    def _add_transition(model: OffPolicyAlgorithm, transition: tuple):
+        observation, next_observation, action, reward, done, truncated = transition
+
+        def batch(x):
+            if isinstance(x, dict):
+                return {key: np.expand_dims(value, 0) for key, value in x.items()}
+            return np.expand_dims(x, 0)
+
+        model.replay_buffer.add(
+            batch(observation),
+            batch(next_observation),
+            batch(np.asarray(action)),
+            np.array([reward], dtype=np.float32),
+            np.array([done]),
+            [{"TimeLimit.truncated": truncated}],
+        )
+
+    def close(self):
+        """
+        Stops the workers and closes the connections
+        """
+        with self._lock:
+            self._closed = True
+            for conn in self._conns:
+                try:
+                    conn.send(("stop", None, None, None))
+                except OSError:
+                    pass
+        # wakes up the thread waiting for connections
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        self._accept_thread.join()
+        self._listener.close()
+
+
+class RolloutWorker:
+    """
+    Rollout worker, possibly on another machine: runs the environment (e.g. Simulatio4RecSys with its local LLM)
+    with its copy of the policy and streams the transitions to a RolloutCoordinator. The weights broadcast
+    by the coordinator are loaded between two messages.
+
+    Attributes:
+        address (tuple (host, port)): address of the coordinator
+        env (gym.Env): the environment, with the same observation and action spaces as the learner
+        policy (BasePolicy): policy with the same architecture as the policy of the learner
+        authkey (bytes): key shared with the coordinator
+        steps_per_message (integer): number of transitions sent in every message
+        deterministic (bool): if True the policy takes deterministic actions, apart from the exploration rate
+        seed (integer, optional): seed of the exploration
+    """
+
+    def __init__(
+        self,
+        address: typing.Tuple[str, int],
+        env: gym.Env,
+        policy: BasePolicy,
+        authkey: bytes = b"suber",
+        steps_per_message: int = 16,
+        deterministic: bool = False,
+        seed: int = None,
+    ):
+        self.env = env
+        self.policy = policy
+        self.steps_per_message = steps_per_message
+        self.deterministic = deterministic
+        self.version = None
+        self.exploration_rate = 0.0
+        self._rng = np.random.default_rng(seed)
+        self._conn = Client(address, authkey=authkey)
+        self._stopped = False
+        """
+        The messages of the coordinator are read by a thread as soon as they arrive, so that a broadcast never waits
+        for the worker to finish sending its transitions, only the last weights received are kept
+        """
+        self._weights_lock = threading.Lock()
+        self._weights = self._conn.recv()
+        self._load_weights()
+        self._listen_thread = threading.Thread(target=self._listen, daemon=True)
+        self._listen_thread.start()
+
+    def _listen(self):
+        try:
+            while True:
+                message = self._conn.recv()
+                with self._weights_lock:
+                    self._weights = message
+                if message[0] == "stop":
+                    return
+        except (EOFError, OSError):
+            with self._weights_lock:
+                self._weights = ("stop", None, None, None)
+
+    def _load_weights(self):
+        """
+        Loads the last weights received from the coordinator
+        """
+        with self._weights_lock:
+            weights, self._weights = self._weights, None
+        if weights is None:
+            return
+        kind, version, state_dict, exploration_rate = weights
+        if kind == "stop":
+            self._stopped = True
+            return
+        self.policy.load_state_dict(state_dict)
+        self.version = version
+        self.exploration_rate = exploration_rate
+
+    def _predict(self, observation):
+        if self._rng.random() < self.exploration_rate:
+            return self.env.action_space.sample()
+        action, _ = self.policy.predict(observation, deterministic=self.deterministic)
+        # a single discrete action is returned as a 0-dimensional array
+        return action.item() if action.ndim == 0 else action
+
+    def run(self, max_steps: int = None, seed: int = None) -> int:
+        """
+        Runs the environment until the coordinator stops the worker or disconnects, or for max_steps steps
+
+        Return:
+            the number of steps
+        """
+        observation, _ = self.env.reset(seed=seed)
+        num_steps = 0
+        episode_reward, episode_length = 0.0, 0
+        try:
+            while not self._stopped and (max_steps is None or num_steps < max_steps):
+                transitions, episodes = [], []
+                for _ in range(self.steps_per_message):
+                    action = self._predict(observation)
+                    next_observation, reward, terminated, truncated, _ = self.env.step(
+                        action
+                    )
+                    done = terminated or truncated
+                    transitions.append(
+                        (
+                            observation,
+                            next_observation,
+                            action,
+                            float(reward),
+                            done,
+                            truncated and not terminated,
+                        )
+                    )
+                    episode_reward += float(reward)
+                    episode_length += 1
+                    num_steps += 1
+                    if done:
+                        episodes.append((episode_reward, episode_length))
+                        episode_reward, episode_length = 0.0, 0
+                        next_observation, _ = self.env.reset()
+                    observation = next_observation
+                    if max_steps is not None and num_steps >= max_steps:
+                        break
+                self._conn.send(("transitions", self.version, transitions, episodes))
+                self._load_weights()
+        except (EOFError, OSError):
+            pass
+        return num_steps
+
+    def close(self):
+        self._conn.close()
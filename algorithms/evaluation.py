@@ -0,0 +1,116 @@
+import json
+import multiprocessing
+import os
+import typing
+
+import numpy as np
+
+from environment.render_sink import get_render_log_parts, merge_render_logs
+
+
+def get_shards(
+    num_episodes: int, num_shards: int
+) -> typing.List[typing.Tuple[int, int]]:
+    """
+    Splits the evaluation users into contiguous shards, in evaluation mode episode i is played by user i
+
+    Args:
+        num_episodes (integer): number of episodes (users) to evaluate
+        num_shards (integer): number of shards
+
+    Return:
+        list of (first user id, number of episodes) of every non empty shard
+    """
+    sizes = np.full(num_shards, num_episodes // num_shards)
+    sizes[: num_episodes % num_shards] += 1
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return [(int(start), int(size)) for start, size in zip(starts, sizes) if size > 0]
+
+
+def get_shard_path(path: str, shard: int) -> str:
+    """
+    Path of the render log of a shard, e.g. render.csv -> render.shard0.csv
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard{shard}{extension}"
+
+
+def evaluate_sharded(
+    evaluate_shard: typing.Callable[
+        [int, int, typing.Optional[str]], typing.Tuple[typing.List, typing.List]
+    ],
+    num_episodes: int,
+    num_workers: int = 1,
+    logs_path: str = None,
+    report_path: str = None,
+) -> dict:
+    """
+    Evaluates a policy over the users 0, ..., num_episodes - 1, the users are sharded across num_workers processes.
+    Every worker runs evaluate_shard(first_user_id, num_episodes, render_path), which must create its own environment
+    in evaluation mode starting from first_user_id, evaluate the policy for num_episodes episodes rendering to
+    render_path and return the rewards and the lengths of the episodes (as evaluate_policy with return_episode_rewards=True).
+    evaluate_shard must be picklable (e.g. a module level function or a functools.partial of one), the workers are
+    started with spawn so that every worker can initialize CUDA.
+
+    The render logs of the shards are merged, in order of user, into logs_path and deleted.
+
+    Args:
+        evaluate_shard (callable): evaluates a shard
+        num_episodes (integer): number of episodes (users) to evaluate
+        num_workers (integer): number of worker processes, with 1 the evaluation runs in the current process
+        logs_path (string, optional): path of the merged render log
+        report_path (string, optional): path of the JSON file where the report is written
+
+    Return:
+        report (dictionary): mean and standard deviation of the rewards, mean length of the episodes,
+        rewards and lengths of all the episodes and the summary of every shard
+    """
+    shards = get_shards(num_episodes, num_workers)
+    shards_paths = [
+        get_shard_path(logs_path, i) if logs_path is not None else None
+        for i in range(len(shards))
+    ]
+    shards_args = [
+        (first_user_id, shard_episodes, path)
+        for (first_user_id, shard_episodes), path in zip(shards, shards_paths)
+    ]
+
+    if len(shards) == 1:
+        results = [evaluate_shard(*shards_args[0])]
+    else:
+        with multiprocessing.get_context("spawn").Pool(len(shards)) as pool:
+            results = pool.starmap(evaluate_shard, shards_args)
+
+    if logs_path is not None:
+        merge_render_logs(
+            [path for path in shards_paths if os.path.exists(path)], logs_path
+        )
+        for path in shards_paths:
+            for part_path in get_render_log_parts(path):
+                os.remove(part_path)
+
+    episode_rewards = [float(r) for rewards, _ in results for r in rewards]
+    episode_lengths = [int(l) for _, lengths in results for l in lengths]
+    report = {
+        "num_episodes": len(episode_rewards),
+        "mean_reward": float(np.mean(episode_rewards)),
+        "std_reward": float(np.std(episode_rewards)),
+        "mean_length": float(np.mean(episode_lengths)),
+        "shards": [
+            {
+                "first_user_id": first_user_id,
+                "num_episodes": len(rewards),
+                "mean_reward": float(np.mean(rewards)),
+                "std_reward": float(np.std(rewards)),
+            }
+            for (first_user_id, _), (rewards, _) in zip(shards, results)
+        ],
+        "episode_rewards": episode_rewards,
+        "episode_lengths": episode_lengths,
+    }
+
+    if report_path is not None:
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=4)
+    return report
@@ -1,5 +1,6 @@
 import argparse
 import os
+from functools import partial
 from stable_baselines3.common.callbacks import (
     CallbackList,
     CheckpointCallback,
@@ -26,6 +27,7 @@ import wandb
 import gymnasium as gym
 
 # Our
+from algorithms.evaluation import evaluate_sharded
 from algorithms.wrappers import StableBaselineWrapperNum
 from environment.movies.configs import (
     get_enviroment_from_args,
@@ -42,6 +44,9 @@ def parse_args():
     parser.add_argument("--embedding-dim", type=int, default=32)
     parser.add_argument("--path", type=str)
     parser.add_argument("--logs-path", type=str, default="./tmp/render/render.csv")
+    parser.add_argument("--report-path", type=str, default=None)
+    parser.add_argument("--eval-episodes", type=int, default=600)
+    parser.add_argument("--eval-workers", type=int, default=1)
     args = parser.parse_args()
     return args
 
@@ -269,12 +274,14 @@ class DQNPolicy(BasePolicy):
 
 
 class ExtractPass(BaseFeaturesExtractor):
-    def __init__(self, observation_space: gym.Space) -> None:
+    def __init__(
+        self, observation_space: gym.Space, num_users: int, num_items: int
+    ) -> None:
         super().__init__(observation_space, get_flattened_obs_dim(observation_space))
         self.flatten = nn.Flatten()
 
-        self.user_embedding = nn.Embedding(train_env.num_users, 32)
-        self._features_dim = 32 + train_env.num_items
+        self.user_embedding = nn.Embedding(num_users, 32)
+        self._features_dim = 32 + num_items
 
     def forward(self, observations: torch.Tensor) -> torch.Tensor:
         observations["user_id"] = observations["user_id"].int()
@@ -291,25 +298,31 @@ class ExtractPass(BaseFeaturesExtractor):
         return obs
 
 
-if __name__ == "__main__":
-    args = parse_args()
+def evaluate_shard(args, first_user_id, num_episodes, render_path):
+    """
+    Evaluates the policy on the users first_user_id, ..., first_user_id + num_episodes - 1,
+    it runs in its own process when the evaluation is sharded (see algorithms.evaluation)
+    """
     llm = load_LLM(args.llm_model)
 
     train_env = get_enviroment_from_args(llm, args)
 
-    os.makedirs(os.path.dirname(args.logs_path), exist_ok=True)
     test_env = get_enviroment_from_args(
         llm,
         args,
         seed=args.seed + 600,
         render_mode="csv",
-        render_path=args.logs_path,
+        render_path=render_path,
         eval_mode=True,
+        eval_first_user_id=first_user_id,
     )
 
     # Create the custom actor-critic policy
     policy_kwargs = dict(
         features_extractor_class=ExtractPass,
+        features_extractor_kwargs=dict(
+            num_users=train_env.num_users, num_items=train_env.num_items
+        ),
     )
 
     train_env = StableBaselineWrapperNum(train_env)
@@ -326,4 +339,29 @@ if __name__ == "__main__":
 
     model.policy.load_state_dict(torch.load(args.path, map_location=args.model_device))
 
-    evaluate_policy(model, test_env, render=True, n_eval_episodes=600)
+    episode_rewards, episode_lengths = evaluate_policy(
+        model,
+        test_env,
+        render=True,
+        n_eval_episodes=num_episodes,
+        return_episode_rewards=True,
+    )
+    test_env.close()
+    return episode_rewards, episode_lengths
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    os.makedirs(os.path.dirname(args.logs_path), exist_ok=True)
+    report = evaluate_sharded(
+        partial(evaluate_shard, args),
+        num_episodes=args.eval_episodes,
+        num_workers=args.eval_workers,
+        logs_path=args.logs_path,
+        report_path=args.report_path,
+    )
+    print(
+        f"Mean reward: {report['mean_reward']:.4f} +/- {report['std_reward']:.4f}"
+        f" over {report['num_episodes']} episodes"
+    )
@@ -1,5 +1,6 @@
 import argparse
 import os
+from functools import partial
 from stable_baselines3.common.callbacks import (
     CallbackList,
     CheckpointCallback,
@@ -26,6 +27,7 @@ import wandb
 import gymnasium as gym
 
 # Our
+from algorithms.evaluation import evaluate_sharded
 from algorithms.wrappers import StableBaselineWrapperNum
 from environment.movies.configs import (
     get_enviroment_from_args,
@@ -42,6 +44,9 @@ def parse_args():
     parser.add_argument("--embedding-dim", type=int, default=32)
     parser.add_argument("--path", type=str)
     parser.add_argument("--logs-path", type=str, default="./tmp/render/render.csv")
+    parser.add_argument("--report-path", type=str, default=None)
+    parser.add_argument("--eval-episodes", type=int, default=600)
+    parser.add_argument("--eval-workers", type=int, default=1)
     args = parser.parse_args()
     return args
 
@@ -53,9 +58,9 @@ class Net(nn.Module):
         obs_space: gym.spaces.Space,
         num_users: int,
         num_items: int,
+        embedding_dim: int,
     ):
         super().__init__()
-        embedding_dim = args.embedding_dim
         self.latent_dim_pi = embedding_dim * 2
         self.latent_dim_vf = embedding_dim * 2
 
@@ -140,9 +145,16 @@ class CustomActorCriticPolicy(ActorCriticPolicy):
         observation_space: spaces.Space,
         action_space: spaces.Space,
         lr_schedule: Callable[[float], float],
+        num_users: int,
+        num_items: int,
+        embedding_dim: int,
         *args,
         **kwargs,
     ):
+        # The sizes of the embeddings are needed by _build_mlp_extractor, called by the base class
+        self.num_users = num_users
+        self.num_items = num_items
+        self.embedding_dim = embedding_dim
         # Disable orthogonal initialization
         kwargs["ortho_init"] = True
         super().__init__(
@@ -160,8 +172,9 @@ class CustomActorCriticPolicy(ActorCriticPolicy):
     def _build_mlp_extractor(self) -> None:
         self.mlp_extractor = Net(
             self.observation_space,
-            train_env.num_users,
-            train_env.num_items,
+            self.num_users,
+            self.num_items,
+            self.embedding_dim,
         )
 
 
@@ -175,25 +188,31 @@ class ExtractPass(BaseFeaturesExtractor):
         return observations
 
 
-if __name__ == "__main__":
-    args = parse_args()
+def evaluate_shard(args, first_user_id, num_episodes, render_path):
+    """
+    Evaluates the policy on the users first_user_id, ..., first_user_id + num_episodes - 1,
+    it runs in its own process when the evaluation is sharded (see algorithms.evaluation)
+    """
     llm = load_LLM(args.llm_model)
 
     train_env = get_enviroment_from_args(llm, args)
 
-    os.makedirs(os.path.dirname(args.logs_path), exist_ok=True)
     test_env = get_enviroment_from_args(
         llm,
         args,
         seed=args.seed + 600,
         render_mode="csv",
-        render_path=args.logs_path,
+        render_path=render_path,
         eval_mode=True,
+        eval_first_user_id=first_user_id,
     )
 
     # Create the custom actor-critic policy
     policy_kwargs = dict(
         features_extractor_class=ExtractPass,
+        num_users=train_env.num_users,
+        num_items=train_env.num_items,
+        embedding_dim=args.embedding_dim,
     )
 
     train_env = StableBaselineWrapperNum(train_env)
@@ -218,4 +237,29 @@ if __name__ == "__main__":
 
     model.policy.load_state_dict(torch.load(args.path, map_location=args.model_device))
 
-    evaluate_policy(model, test_env, render=True, n_eval_episodes=600)
+    episode_rewards, episode_lengths = evaluate_policy(
+        model,
+        test_env,
+        render=True,
+        n_eval_episodes=num_episodes,
+        return_episode_rewards=True,
+    )
+    test_env.close()
+    return episode_rewards, episode_lengths
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    os.makedirs(os.path.dirname(args.logs_path), exist_ok=True)
+    report = evaluate_sharded(
+        partial(evaluate_shard, args),
+        num_episodes=args.eval_episodes,
+        num_workers=args.eval_workers,
+        logs_path=args.logs_path,
+        report_path=args.report_path,
+    )
+    print(
+        f"Mean reward: {report['mean_reward']:.4f} +/- {report['std_reward']:.4f}"
+        f" over {report['num_episodes']} episodes"
+    )
@@ -186,8 +186,11 @@ if __name__ == "__main__":
 
     train_env = StableBaselineWrapperNum(train_env)
     test_env = Monitor(StableBaselineWrapperNum(test_env))
-    check_env(train_env)
-    check_env(test_env)
+    # The environments are checked without querying the LLM, their state is restored afterwards
+    with train_env.unwrapped.validation_mode():
+        check_env(train_env)
+    with test_env.unwrapped.validation_mode():
+        check_env(test_env)
 
     # Initialize wandb
     run = wandb.init(
@@ -0,0 +1,242 @@
+import multiprocessing as mp
+import typing
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import gymnasium as gym
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import SubprocVecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+"""
+The shared memory block contains, one after the other, the observations of all the environments (one array per key of
+the observation space, with the environment index as first axis), the terminal observations with the same layout,
+the rewards and the dones. Every array is aligned to 8 bytes.
+"""
+_ALIGNMENT = 8
+
+
+def _get_observation_spaces(
+    observation_space: spaces.Space,
+) -> typing.Dict[typing.Optional[str], spaces.Box]:
+    if isinstance(observation_space, spaces.Box):
+        return {None: observation_space}
+    if isinstance(observation_space, spaces.Dict) and all(
+        isinstance(space, spaces.Box) for space in observation_space.spaces.values()
+    ):
+        return dict(observation_space.spaces)
+    raise ValueError(
+        "SharedMemoryVecEnv supports Box observation spaces or Dict of Box spaces,"
+        f" got {observation_space}"
+    )
+
+
+def _get_buffers_layout(
+    observation_space: spaces.Space, num_envs: int
+) -> typing.Tuple[typing.List[tuple], int]:
+    """
+    Returns the (name, key, shape, dtype, offset) of every array in the shared memory block and the size of the block
+    """
+    layout, size = [], 0
+
+    def add(name, key, shape, dtype):
+        nonlocal size
+        dtype = np.dtype(dtype)
+        layout.append((name, key, shape, dtype, size))
+        size += int(np.prod(shape)) * dtype.itemsize
+        size += -size % _ALIGNMENT
+
+    observation_spaces = _get_observation_spaces(observation_space)
+    for name in ("observations", "terminal_observations"):
+        for key, space in observation_spaces.items():
+            add(name, key, (num_envs,) + space.shape, space.dtype)
+    add("rewards", None, (num_envs,), np.float64)
+    add("dones", None, (num_envs,), np.bool_)
+    return layout, max(size, 1)
+
+
+def _get_buffers(
+    shared_memory: SharedMemory, layout: typing.List[tuple]
+) -> typing.Dict[str, typing.Dict[typing.Optional[str], np.ndarray]]:
+    buffers = {}
+    for name, key, shape, dtype, offset in layout:
+        buffers.setdefault(name, {})[key] = np.ndarray(
+            shape, dtype=dtype, buffer=shared_memory.buf, offset=offset
+        )
+    return buffers
+
+
+def _write_observation(
+    arrays: typing.Dict[typing.Optional[str], np.ndarray], index: int, observation
+):
+    for key, array in arrays.items():
+        array[index] = observation if key is None else observation[key]
+
+
+def _worker(
+    remote: mp.connection.Connection,
+    parent_remote: mp.connection.Connection,
+    env_fn_wrapper: CloudpickleWrapper,
+    index: int,
+):
+    """
+    Worker of SharedMemoryVecEnv: serves the commands of SubprocVecEnv, but step and reset write the observation,
+    the reward and the done into the shared memory block and send only the infos through the pipe
+    """
+    # Import here to avoid a circular import
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    shared_memory, buffers = None, None
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                observation, reward, terminated, truncated, info = env.step(data)
+                done = terminated or truncated
+                info["TimeLimit.truncated"] = truncated and not terminated
+                reset_info = {}
+                if done:
+                    _write_observation(
+                        buffers["terminal_observations"], index, observation
+                    )
+                    observation, reset_info = env.reset()
+                _write_observation(buffers["observations"], index, observation)
+                buffers["rewards"][None][index] = reward
+                buffers["dones"][None][index] = done
+                remote.send((info, reset_info))
+            elif cmd == "reset":
+                observation, reset_info = env.reset(seed=data)
+                _write_observation(buffers["observations"], index, observation)
+                remote.send(reset_info)
+            elif cmd == "attach":
+                name, layout = data
+                shared_memory = SharedMemory(name=name)
+                buffers = _get_buffers(shared_memory, layout)
+                remote.send(None)
+            elif cmd == "render":
+                remote.send(env.render())
+            elif cmd == "close":
+                env.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "env_method":
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(getattr(env, data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+    except EOFError:
+        pass
+    finally:
+        buffers = None
+        if shared_memory is not None:
+            shared_memory.close()
+
+
+class SharedMemoryVecEnv(SubprocVecEnv):
+    """
+    SubprocVecEnv whose workers write the observations, the rewards and the dones directly into a preallocated
+    shared memory block, only the infos and the actions go through the pipes. With StableBaselineWrapperNum the observation
+    is a dense vector of num_items ratings, that SubprocVecEnv would pickle through a pipe for every environment
+    at every step.
+
+    The observations returned by step and reset are copies, the block is overwritten by the next step.
+    The observation space must be a Box or a Dict of Box spaces.
+
+    Attributes:
+        env_fns (list of callables): functions that create the environments
+        start_method (string, optional): start method of the workers, see SubprocVecEnv
+    """
+
+    def __init__(
+        self,
+        env_fns: typing.List[typing.Callable[[], gym.Env]],
+        start_method: typing.Optional[str] = None,
+    ):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        if start_method is None:
+            forkserver_available = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = mp.get_context(start_method)
+        # The workers must share the resource tracker of the shared memory block, otherwise forked workers would
+        # start their own one, that would unlink the block when the worker exits
+        resource_tracker.ensure_running()
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for index, (work_remote, remote, env_fn) in enumerate(
+            zip(self.work_remotes, self.remotes, env_fns)
+        ):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), index)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+
+        self._layout, size = _get_buffers_layout(observation_space, n_envs)
+        self._shared_memory = SharedMemory(create=True, size=size)
+        self._buffers = _get_buffers(self._shared_memory, self._layout)
+        for remote in self.remotes:
+            remote.send(("attach", (self._shared_memory.name, self._layout)))
+        for remote in self.remotes:
+            remote.recv()
+
+        super(SubprocVecEnv, self).__init__(n_envs, observation_space, action_space)
+
+    def _read_observations(self, name: str, indices=slice(None)):
+        arrays = self._buffers[name]
+        if None in arrays:
+            return arrays[None][indices].copy()
+        return OrderedDict(
+            (key, array[indices].copy()) for key, array in arrays.items()
+        )
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        infos, self.reset_infos = zip(*results)
+        dones = self._buffers["dones"][None].copy()
+        for index in np.flatnonzero(dones):
+            infos[index]["terminal_observation"] = self._read_observations(
+                "terminal_observations", index
+            )
+        return (
+            self._read_observations("observations"),
+            self._buffers["rewards"][None].copy(),
+            dones,
+            infos,
+        )
+
+    def reset(self):
+        for env_idx, remote in enumerate(self.remotes):
+            remote.send(("reset", self._seeds[env_idx]))
+        self.reset_infos = tuple(remote.recv() for remote in self.remotes)
+        # Seeds are only used once
+        self._reset_seeds()
+        return self._read_observations("observations")
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self._buffers = None
+        self._shared_memory.close()
+        self._shared_memory.unlink()
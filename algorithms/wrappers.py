@@ -1,3 +1,5 @@
+import typing
+
 import gymnasium as gym
 import numpy as np
 from gymnasium import spaces
@@ -30,8 +32,13 @@ class StableBaselineWrapper(gym.ObservationWrapper):
 
         film_feature = np.zeros(self.env.num_items, dtype=np.int_)
 
-        for film, rating in items_interact:
-            film_feature[film] = rating
+        if "items_interact_len" in observation:
+            # Lean observation: the valid rows of the buffer can be written at once
+            items_interact = items_interact[: observation["items_interact_len"]]
+            film_feature[items_interact[:, 0]] = items_interact[:, 1]
+        else:
+            for film, rating in items_interact:
+                film_feature[film] = rating
 
         return {"user_id": user_feature, "items_interact": film_feature}
 
@@ -60,10 +67,167 @@ class StableBaselineWrapperNum(gym.ObservationWrapper):
 
         film_feature = np.zeros(self.env.num_items, dtype=np.int_)
 
-        for film, rating in items_interact:
-            film_feature[film] = rating
+        if "items_interact_len" in observation:
+            # Lean observation: the valid rows of the buffer can be written at once
+            items_interact = items_interact[: observation["items_interact_len"]]
+            film_feature[items_interact[:, 0]] = items_interact[:, 1]
+        else:
+            for film, rating in items_interact:
+                film_feature[film] = rating
 
         return {
             "user_id": np.array([id], dtype=np.int_),
             "items_interact": film_feature,
         }
+
+
+def _split_clusters(
+    clusters: typing.List[typing.List[int]], max_cluster_size: int
+) -> typing.List[typing.List[int]]:
+    # the clusters larger than max_cluster_size are split in chunks, so that no dimension of the action grows linearly
+    return [
+        cluster[i : i + max_cluster_size]
+        for cluster in clusters
+        for i in range(0, len(cluster), max_cluster_size)
+    ]
+
+
+def get_metadata_clusters(
+    env: gym.Env, field: str = "genres", max_cluster_size: int = None
+) -> typing.List[typing.List[int]]:
+    """
+    Groups the actions of the environment by the first value of a metadata field of the items
+    (e.g. the first genre of a movie, or the first category of a book)
+
+    Args:
+        env (gym.Env): Simulatio4RecSys, possibly wrapped
+        field (string): the field of the items, either a string or a list of strings
+        max_cluster_size (integer, optional): larger clusters are split, defaults to the square root of num_items
+
+    Return:
+        list of clusters, each a list of actions
+    """
+    env = env.unwrapped
+    if max_cluster_size is None:
+        max_cluster_size = int(np.ceil(np.sqrt(env.num_items)))
+    items = env.items_loader.load_items_from_ids(env.item_ids)
+    clusters = {}
+    for action, item in enumerate(items):
+        value = getattr(item, field, None)
+        if isinstance(value, (list, tuple)):
+            value = value[0] if len(value) > 0 else None
+        clusters.setdefault(value, []).append(action)
+    return _split_clusters(list(clusters.values()), max_cluster_size)
+
+
+def get_embedding_clusters(
+    env: gym.Env,
+    field: str = "overview_embedding",
+    num_clusters: int = None,
+    max_cluster_size: int = None,
+    num_iterations: int = 20,
+    seed: int = 0,
+) -> typing.List[typing.List[int]]:
+    """
+    Groups the actions of the environment by k-means on an embedding of the items
+
+    Args:
+        env (gym.Env): Simulatio4RecSys, possibly wrapped
+        field (string): the field of the items containing the embedding
+        num_clusters (integer, optional): number of clusters of k-means, defaults to the square root of num_items
+        max_cluster_size (integer, optional): larger clusters are split, defaults to the square root of num_items
+        num_iterations (integer): iterations of k-means
+        seed (integer): seed of the initialization of k-means
+
+    Return:
+        list of clusters, each a list of actions
+    """
+    env = env.unwrapped
+    sqrt_num_items = int(np.ceil(np.sqrt(env.num_items)))
+    if num_clusters is None:
+        num_clusters = sqrt_num_items
+    if max_cluster_size is None:
+        max_cluster_size = sqrt_num_items
+    items = env.items_loader.load_items_from_ids(env.item_ids)
+    x = np.array([getattr(item, field) for item in items], dtype=np.float32)
+
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=min(num_clusters, len(x)), replace=False)]
+    for _ in range(num_iterations):
+        distances = (
+            (x**2).sum(axis=1, keepdims=True)
+            - 2 * x @ centroids.T
+            + (centroids**2).sum(axis=1)
+        )
+        assignment = distances.argmin(axis=1)
+        for k in range(len(centroids)):
+            members = x[assignment == k]
+            if len(members) > 0:
+                centroids[k] = members.mean(axis=0)
+    clusters = [np.flatnonzero(assignment == k).tolist() for k in range(len(centroids))]
+    return _split_clusters([c for c in clusters if c], max_cluster_size)
+
+
+class HierarchicalActionWrapper(gym.ActionWrapper):
+    """
+    Factorizes the choice of an item into the choice of a cluster of items followed by the choice of an item
+    within the cluster, so that with about sqrt(num_items) clusters of about sqrt(num_items) items the output of the policy
+    grows with the square root of the catalog instead of linearly.
+    The action is MultiDiscrete([num_clusters, max_cluster_size]), repeated for every item of the slate. In a cluster of
+    n < max_cluster_size items the index i is rescaled to the item i * n // max_cluster_size, so that every action is valid
+    and the indexes are spread evenly over the items of the cluster (each item gets max_cluster_size // n or one more
+    consecutive indexes), instead of favouring the first items of the cluster.
+
+    Attributes:
+        env (gym.Env): Simulatio4RecSys, possibly wrapped, with Discrete or slate MultiDiscrete actions
+        clusters (list of lists of integers): the actions of the environment in every cluster, see get_metadata_clusters
+            and get_embedding_clusters
+    """
+
+    def __init__(self, env: gym.Env, clusters: typing.List[typing.List[int]]):
+        super().__init__(env)
+        if any(len(cluster) == 0 for cluster in clusters):
+            raise ValueError("The clusters must not be empty")
+        self.clusters = clusters
+        num_clusters = len(clusters)
+        max_cluster_size = max(len(cluster) for cluster in clusters)
+
+        self._actions = np.array(
+            [
+                [
+                    cluster[i * len(cluster) // max_cluster_size]
+                    for i in range(max_cluster_size)
+                ]
+                for cluster in clusters
+            ],
+            dtype=np.int64,
+        )
+        self._hierarchical_actions = {}
+        for k, cluster_actions in enumerate(self._actions):
+            for i, action in enumerate(cluster_actions):
+                self._hierarchical_actions.setdefault(int(action), (k, i))
+
+        if isinstance(env.action_space, spaces.Discrete):
+            self._slate_size = None
+            self.action_space = spaces.MultiDiscrete([num_clusters, max_cluster_size])
+        else:
+            self._slate_size = len(env.action_space.nvec)
+            self.action_space = spaces.MultiDiscrete(
+                [num_clusters, max_cluster_size] * self._slate_size
+            )
+
+    def action(self, action):
+        action = np.asarray(action).reshape(-1, 2)
+        actions = self._actions[action[:, 0], action[:, 1]]
+        if self._slate_size is None:
+            return int(actions[0])
+        return actions
+
+    def reverse_action(self, action):
+        """
+        Returns the (cluster, item within the cluster) of an action of the environment, e.g. to imitate a logged policy
+        """
+        actions = np.atleast_1d(action)
+        return np.array(
+            [self._hierarchical_actions[int(a)] for a in actions], dtype=np.int64
+        ).reshape(-1)
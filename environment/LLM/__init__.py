@@ -1,4 +1,5 @@
-from .rater import LLMRater
+from .llm import llm_lock, seeded_generation, seeded_request
+from .rater import AsyncLLMRater, LLMRater, NoOpLLMRater, RatingQuery
 
 INITIAL = [
     "TheBloke/Llama-2-7b-Chat-GPTQ",  # use via exllama, on 8gb gpu
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import List, Tuple
 import torch
 from .llm import LLM
 from exllama.model import ExLlama, ExLlamaCache, ExLlamaConfig
@@ -35,6 +35,9 @@ class LLMExllama(LLM):
         )  # create tokenizer from tokenizer model file
 
         self.cache = ExLlamaCache(self.model)  # create cache for inference
+        # batched requests use a separate cache with one sequence per prompt, and a generator per rating scale on it
+        self.batch_cache = None
+        self.batch_generators = {}
 
         # Only digits are allowed in the rating
         only_numbers_0_9 = [self.tokenizer.eos_token_id]
@@ -179,6 +182,115 @@ class LLMExllama(LLM):
                 prompt, max_new_tokens=300
             )
 
+    def request_rating_0_9_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.generator_rating_0_9,
+            self.request_rating_0_9,
+            system_prompt,
+            dialogs,
+            max_new_tokens=1,
+        )
+
+    def request_rating_1_5_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.generator_rating_1_5,
+            self.request_rating_1_5,
+            system_prompt,
+            dialogs,
+            max_new_tokens=1,
+        )
+
+    def request_rating_1_10_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.generator_rating_1_10,
+            self.request_rating_1_10,
+            system_prompt,
+            dialogs,
+            max_new_tokens=2,
+        )
+
+    def request_rating_text_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.generator_rating_text,
+            self.request_rating_text,
+            system_prompt,
+            dialogs,
+            max_new_tokens=1,
+        )
+
+    def request_explanation_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.generator_explanation,
+            self.request_explanation,
+            system_prompt,
+            dialogs,
+            max_new_tokens=300,
+        )
+
+    def _request_batch(
+        self, generator, request, system_prompt, dialogs, max_new_tokens
+    ) -> List[Tuple[str, str]]:
+        """
+        Generates the answers of all the dialogs together, a single dialog is sent with request to reuse the cached prefix
+        """
+        if len(dialogs) <= 1:
+            return [request(system_prompt, dialog) for dialog in dialogs]
+        prompts = [self.encode(system_prompt, dialog) for dialog in dialogs]
+        return list(
+            zip(prompts, self.generate_batch_simple(generator, prompts, max_new_tokens))
+        )
+
+    def generate_batch_simple(
+        self, generator: ExLlamaGenerator, prompts, max_new_tokens=128
+    ):
+        """
+        Batched version of generate_reuse_simple: the prompts are padded on the left and generated together, with the
+        settings and the disallowed tokens of generator. Returns the text generated for every prompt.
+        """
+        batch_size = len(prompts)
+        if self.batch_cache is None or self.batch_cache.batch_size != batch_size:
+            self.batch_cache = ExLlamaCache(self.model, batch_size=batch_size)
+            self.batch_generators = {}
+        batch_generator = self.batch_generators.get(id(generator))
+        if batch_generator is None:
+            batch_generator = ExLlamaGenerator(
+                self.model, self.tokenizer, self.batch_cache
+            )
+            batch_generator.settings = generator.settings
+            batch_generator.disallow_tokens(generator.disallowed_tokens)
+            self.batch_generators[id(generator)] = batch_generator
+
+        batch_generator.end_beam_search()
+        ids, mask = self.tokenizer.encode(
+            prompts, return_mask=True, max_seq_len=self.model.config.max_seq_len
+        )
+        batch_generator.gen_begin(ids, mask=mask)
+
+        max_new_tokens = min(
+            max_new_tokens, self.model.config.max_seq_len - ids.shape[1]
+        )
+
+        eos = torch.zeros((ids.shape[0],), dtype=torch.bool)
+        for i in range(max_new_tokens):
+            token = batch_generator.gen_single_token(mask=mask)
+            eos |= token[:, 0].cpu() == self.tokenizer.eos_token_id
+            if eos.all():
+                break
+
+        texts = []
+        for sequence in batch_generator.sequence[:, ids.shape[1] :].tolist():
+            # the sequences that ended early keep generating, their text stops at the first eos
+            if self.tokenizer.eos_token_id in sequence:
+                sequence = sequence[: sequence.index(self.tokenizer.eos_token_id)]
+            texts.append(self.tokenizer.decode(torch.tensor(sequence)))
+        return texts
+
     def generate_reuse_simple(
         self, generator: ExLlamaGenerator, prompt, max_new_tokens=128
     ):
@@ -1,5 +1,10 @@
+import asyncio
+import contextlib
+import threading
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import List, Tuple
+
+import torch
 
 """
 Dialog example
@@ -12,8 +17,40 @@ Dialog example
 """
 
 
+def llm_lock(llm):
+    """
+    Lock of the LLM (LLM.lock), every request to a shared model holds it, since neither the model nor the global
+    torch random generator are thread safe. Return a no-op context manager if the model has no lock (e.g. NoOpLLMRater)
+    """
+    lock = getattr(llm, "lock", None)
+    return lock if lock is not None else contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def seeded_generation(seed: int):
+    """
+    Seeds the torch random generators used by the local models to sample the answers, and restores them on exit
+    so that the generations do not influence each other. The generator of the GPU is forked only if there is one.
+    """
+    devices = ["cuda:0"] if torch.cuda.is_available() else []
+    with torch.random.fork_rng(devices):
+        torch.manual_seed(seed)
+        yield
+
+
+@contextlib.contextmanager
+def seeded_request(llm, seed: int):
+    """
+    Context of a request to llm seeded with seed: holds the lock of the model (see llm_lock) and seeds the generators
+    (see seeded_generation)
+    """
+    with llm_lock(llm), seeded_generation(seed):
+        yield
+
+
 class LLM(ABC):
     def __init__(self, name):
+        self.lock = threading.Lock()
         if "vicuna" in name:
             self.conversation_template_name = "vicuna"
         elif "Llama" in name and ("Chat" in name or "chat" in name):
@@ -37,6 +74,75 @@ class LLM(ABC):
     def request_explanation(self, system_prompt, dialog) -> Tuple[str, str]:
         pass
 
+    def request_rating_0_9_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        """
+        Batched version of request_rating_0_9, models that support batched generation should override
+        the batched methods, by default the dialogs are processed one after the other.
+        """
+        return [self.request_rating_0_9(system_prompt, dialog) for dialog in dialogs]
+
+    def request_rating_1_10_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return [self.request_rating_1_10(system_prompt, dialog) for dialog in dialogs]
+
+    def request_rating_1_5_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return [self.request_rating_1_5(system_prompt, dialog) for dialog in dialogs]
+
+    def request_rating_text_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return [self.request_rating_text(system_prompt, dialog) for dialog in dialogs]
+
+    def request_explanation_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return [self.request_explanation(system_prompt, dialog) for dialog in dialogs]
+
+    async def arequest_rating_0_9(self, system_prompt, dialog, seed=None):
+        """
+        Asynchronous version of request_rating_0_9, models with a non-blocking client should override
+        the asynchronous methods, by default the request is run in a worker thread.
+        """
+        return await self._arequest(
+            self.request_rating_0_9, system_prompt, dialog, seed
+        )
+
+    async def arequest_rating_1_10(self, system_prompt, dialog, seed=None):
+        return await self._arequest(
+            self.request_rating_1_10, system_prompt, dialog, seed
+        )
+
+    async def arequest_rating_1_5(self, system_prompt, dialog, seed=None):
+        return await self._arequest(
+            self.request_rating_1_5, system_prompt, dialog, seed
+        )
+
+    async def arequest_rating_text(self, system_prompt, dialog, seed=None):
+        return await self._arequest(
+            self.request_rating_text, system_prompt, dialog, seed
+        )
+
+    async def arequest_explanation(self, system_prompt, dialog, seed=None):
+        return await self._arequest(
+            self.request_explanation, system_prompt, dialog, seed
+        )
+
+    async def _arequest(self, request, system_prompt, dialog, seed):
+        """
+        Runs a blocking request in a worker thread, so that the event loop stays free while the model generates.
+        Local models are not thread safe, the requests are therefore executed one at a time.
+        """
+
+        def run():
+            with self.lock:
+                if seed is None:
+                    return request(system_prompt, dialog)
+                with seeded_generation(seed):
+                    return request(system_prompt, dialog)
+
+        return await asyncio.to_thread(run)
+
     def encode(self, system_prompt, dialog):
         if self.conversation_template_name == "vicuna":
             return self.encode_vicuna(system_prompt, dialog)
@@ -1,5 +1,6 @@
+import asyncio
 from time import sleep
-from typing import Tuple
+from typing import List, Tuple
 from .llm import LLM
 import openai
 
@@ -144,7 +145,7 @@ class OpenAIModelAPI(LLM):
         return input_text, res
 
     def request_rating_text(self, system_prompt, dialog) -> Tuple[str, str]:
-        pass
+        return self._gather([self.arequest_rating_text(system_prompt, dialog)])[0]
 
     def request_explanation(self, system_prompt, dialog) -> Tuple[str, str]:
         if system_prompt is None:
@@ -184,3 +185,118 @@ class OpenAIModelAPI(LLM):
                 break
         res = out["choices"][0]["message"]["content"]
         return input_text, res
+
+    def request_rating_0_9_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return self._gather(
+            [self.arequest_rating_0_9(system_prompt, dialog) for dialog in dialogs]
+        )
+
+    def request_rating_1_5_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return self._gather(
+            [self.arequest_rating_1_5(system_prompt, dialog) for dialog in dialogs]
+        )
+
+    def request_rating_1_10_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._gather(
+            [self.arequest_rating_1_10(system_prompt, dialog) for dialog in dialogs]
+        )
+
+    def request_rating_text_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._gather(
+            [self.arequest_rating_text(system_prompt, dialog) for dialog in dialogs]
+        )
+
+    def request_explanation_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._gather(
+            [self.arequest_explanation(system_prompt, dialog) for dialog in dialogs]
+        )
+
+    @staticmethod
+    def _gather(requests) -> List[Tuple[str, str]]:
+        """
+        The chat completions API has no batched endpoint, the requests of a batch are therefore sent concurrently
+        on an event loop instead of one after the other. It must not be called from a running event loop.
+        """
+
+        async def gather():
+            return await asyncio.gather(*requests)
+
+        return list(asyncio.run(gather()))
+
+    async def arequest_rating_0_9(self, system_prompt, dialog, seed=None):
+        return await self._acreate(
+            system_prompt,
+            dialog,
+            retry_sleep=10,
+            max_tokens=1,
+            logit_bias=self.map_logits_bias_0_9,
+        )
+
+    async def arequest_rating_1_5(self, system_prompt, dialog, seed=None):
+        return await self._acreate(
+            system_prompt,
+            dialog,
+            retry_sleep=10,
+            max_tokens=1,
+            logit_bias=self.map_logits_bias_1_5,
+        )
+
+    async def arequest_rating_1_10(self, system_prompt, dialog, seed=None):
+        return await self._acreate(
+            system_prompt,
+            dialog,
+            retry_sleep=30,
+            max_tokens=1,
+            logit_bias=self.map_logits_bias_1_10,
+        )
+
+    async def arequest_rating_text(self, system_prompt, dialog, seed=None):
+        return await self._acreate(system_prompt, dialog, retry_sleep=10, max_tokens=1)
+
+    async def arequest_explanation(self, system_prompt, dialog, seed=None):
+        return await self._acreate(
+            system_prompt, dialog, retry_sleep=30, max_tokens=512
+        )
+
+    async def _acreate(self, system_prompt, dialog, retry_sleep, **kwargs):
+        """
+        Non-blocking request to the OpenAI API, on failure the request is retried after retry_sleep seconds
+        without blocking the other requests in flight.
+        """
+        if system_prompt is None:
+            system_prompt = "You are a helpful assistant."
+
+        request = []
+        input_text = ""
+        if system_prompt:
+            request.append({"role": "system", "content": system_prompt})
+            input_text += system_prompt
+        for d in dialog:
+            role = d["role"]
+            if role == "assistant_start":
+                role = "assistant"
+            input_text += "\n" + role + ": "
+            input_text += d["content"]
+            request.append({"role": role, "content": d["content"]})
+
+        while True:
+            try:
+                out = await openai.ChatCompletion.acreate(
+                    model=self.name, messages=request, **kwargs
+                )
+                break
+            except (
+                openai.error.RateLimitError,
+                openai.error.ServiceUnavailableError,
+                openai.error.APIError,
+                openai.error.Timeout,
+            ):
+                await asyncio.sleep(retry_sleep)
+        res = out["choices"][0]["message"]["content"]
+        return input_text, res
@@ -1,3 +1,4 @@
+import hashlib
 from abc import ABC, abstractmethod
 from typing import List, Tuple
 from environment.LLM.llm import LLM
@@ -8,6 +9,46 @@ from environment.users import User
 import numpy as np
 
 
+class RatingQuery:
+    """
+    Object used to store everything needed to build the prompt for a single rating,
+    it contains the user, the item to rate, the number of times the user has watched the item and the retrieved items with their interactions.
+    """
+
+    def __init__(
+        self,
+        user: User,
+        item: Movie,
+        num_interacted: int,
+        interactions: List[UserMovieInteraction],
+        retrieved_items: List[Movie],
+    ):
+        self.user = user
+        self.item = item
+        self.num_interacted = num_interacted
+        self.interactions = interactions
+        self.retrieved_items = retrieved_items
+
+
+def dialog_hash(system_prompt: str, dialog: List[dict]) -> int:
+    """
+    Hash of the prompt sent to the LLM, it identifies the prompt in the logs without storing it
+
+    Args:
+        system_prompt (str): the system prompt
+        dialog (list of dict): the messages of the dialog
+
+    Returns:
+        int: 64 bit hash of the prompt
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update((system_prompt or "").encode("utf-8"))
+    for message in dialog:
+        h.update(b"\0" + message["role"].encode("utf-8"))
+        h.update(b"\0" + message["content"].encode("utf-8"))
+    return int.from_bytes(h.digest(), "little")
+
+
 class LLMRater(ABC):
     """
     Abstract class that defines the interface for the prompting system.
@@ -69,45 +110,147 @@ class LLMRater(ABC):
             Tuple[int, str, str]: the rating, the explanation of the LLM and html of LLM interaction (if llm_query_explanation is True)
 
         """
+        return self.query_batch(
+            [RatingQuery(user, item, num_interacted, interactions, retrieved_items)]
+        )[0]
+
+    def query_batch(
+        self, queries: List[RatingQuery], rnd: np.random.RandomState = None
+    ) -> List[Tuple[int, str, str]]:
+        """
+        Queries the LLM for the rating of many (user, item) pairs at once, all the prompts are sent
+        to the LLM in a single batched request.
+
+        Args:
+            queries (list of RatingQuery): the queries to rate
+            rnd (np.random.RandomState, optional): generator of the random ratings (if random_rating is True), by default self.rnd
+
+        Returns:
+            List[Tuple[int, str, str]]: for every query the rating, the explanation of the LLM and html of LLM interaction
+        """
+        return self.query_batch_with_raw(queries, rnd)[0]
+
+    def query_batch_with_raw(
+        self, queries: List[RatingQuery], rnd: np.random.RandomState = None
+    ) -> Tuple[List[Tuple[int, str, str]], List[Tuple[int, str]]]:
+        """
+        Same as query_batch, but also returns for every query the hash of the prompt and the raw answer of the LLM,
+        before it is converted to a rating.
+
+        Args:
+            queries (list of RatingQuery): the queries to rate
+            rnd (np.random.RandomState, optional): generator of the random ratings, see query_batch
+
+        Returns:
+            the results of query_batch and, for every query, the hash of the prompt and the raw answer of the LLM
+        """
         few_shot_prompts = self._get_few_shot_prompts()
-        prompt = self._get_prompt(
-            user, item, num_interacted, interactions, retrieved_items
-        )
+        prompts = [
+            self._get_prompt(
+                q.user, q.item, q.num_interacted, q.interactions, q.retrieved_items
+            )
+            for q in queries
+        ]
+        dialogs = [few_shot_prompts + prompt for prompt in prompts]
 
         if self.request_scale == "0-9":
-            _, out = self.llm.request_rating_0_9(
-                self.system_prompt, few_shot_prompts + prompt
-            )
-            try:
-                rating = self.adjust_rating_out(float(out))
-            except Exception:
-                rating = float(0)
-            if self.random_rating:
-                rating = self.rnd.randint(1, 11)
+            outs = self.llm.request_rating_0_9_batch(self.system_prompt, dialogs)
         elif self.request_scale == "1-10":
-            _, out = self.llm.request_rating_1_10(
-                self.system_prompt, few_shot_prompts + prompt
-            )
-            try:
-                rating = self.adjust_rating_out(float(out))
-            except Exception:
-                rating = float(0)
-            if self.random_rating:
-                rating = self.rnd.randint(1, 11)
+            outs = self.llm.request_rating_1_10_batch(self.system_prompt, dialogs)
         elif self.request_scale == "1-5":
-            _, out = self.llm.request_rating_1_5(
-                self.system_prompt, few_shot_prompts + prompt
+            outs = self.llm.request_rating_1_5_batch(self.system_prompt, dialogs)
+        else:
+            outs = self.llm.request_rating_text_batch(self.system_prompt, dialogs)
+        ratings = [self.parse_rating(out, rnd) for _, out in outs]
+        raw = [
+            (dialog_hash(self.system_prompt, dialog), out)
+            for dialog, (_, out) in zip(dialogs, outs)
+        ]
+
+        if not self.llm_query_explanation:
+            return [(rating, "", "") for rating in ratings], raw
+
+        prompts_explanation = [
+            self._get_prompt_explanation(prompt, rating)
+            for prompt, rating in zip(prompts, ratings)
+        ]
+        outs_explanation = self.llm.request_explanation_batch(
+            self.system_prompt,
+            [few_shot_prompts + prompt for prompt in prompts_explanation],
+        )
+
+        return [
+            (
+                rating,
+                explanation,
+                self._get_explanation_interaction(
+                    prompt_explanation, prompt_txt, explanation
+                ),
+            )
+            for rating, prompt_explanation, (prompt_txt, explanation) in zip(
+                ratings, prompts_explanation, outs_explanation
             )
+        ], raw
+
+    def get_queries_hashes(self, queries: List[RatingQuery]) -> List[int]:
+        """
+        Hashes of the prompts that query_batch would send to the LLM for queries, without querying it
+
+        Args:
+            queries (list of RatingQuery): the queries
+
+        Returns:
+            List[int]: the hash of the prompt of every query (see dialog_hash)
+        """
+        few_shot_prompts = self._get_few_shot_prompts()
+        return [
+            dialog_hash(
+                self.system_prompt,
+                few_shot_prompts
+                + self._get_prompt(
+                    q.user, q.item, q.num_interacted, q.interactions, q.retrieved_items
+                ),
+            )
+            for q in queries
+        ]
+
+    def _get_explanation_interaction(self, prompt_explanation, prompt_txt, explanation):
+        """
+        Formats the question and the answer of the explanation request, if llm_render is True
+        the full LLM interaction is also printed
+        """
+        if self.llm_render:
+            print("-" * 80)
+            print(prompt_txt + explanation)
+        return (
+            "Question:\n"
+            + prompt_explanation[0]["content"]
+            + "\nAnswer:\n"
+            + prompt_explanation[1]["content"]
+            + explanation
+        )
+
+    def parse_rating(self, out: str, rnd: np.random.RandomState = None) -> float:
+        """
+        Converts the raw answer of the LLM to a rating, according to the scale of the prompt
+
+        Args:
+            out (str): the raw answer of the LLM
+            rnd (np.random.RandomState, optional): generator of the random ratings (if random_rating is True), by default self.rnd
+
+        Returns:
+            float: the rating
+        """
+        if rnd is None:
+            rnd = self.rnd
+        if self.request_scale in ["0-9", "1-10", "1-5"]:
             try:
                 rating = self.adjust_rating_out(float(out))
             except Exception:
                 rating = float(0)
             if self.random_rating:
-                rating = self.rnd.randint(1, 6)
+                rating = rnd.randint(1, 6 if self.request_scale == "1-5" else 11)
         else:
-            _, out = self.llm.request_rating_text(
-                self.system_prompt, few_shot_prompts + prompt
-            )
             try:
                 m = {
                     "one": 1,
@@ -125,27 +268,8 @@ class LLMRater(ABC):
             except ValueError:
                 rating = float("nan")
             if self.random_rating:
-                rating = self.rnd.randint(1, 11)
-
-        if self.llm_query_explanation:
-            prompt_explanation = self._get_prompt_explanation(prompt, rating)
-            prompt_txt, explanation = self.llm.request_explanation(
-                self.system_prompt, few_shot_prompts + prompt_explanation
-            )
-
-            if self.llm_render:
-                print("-" * 80)
-                print(prompt_txt + explanation)
-            out = (
-                "Question:\n"
-                + prompt_explanation[0]["content"]
-                + "\nAnswer:\n"
-                + prompt_explanation[1]["content"]
-                + explanation
-            )
-            return rating, explanation, out
-        else:
-            return rating, "", ""
+                rating = rnd.randint(1, 11)
+        return rating
 
     def number_to_rank(self, number):
         """
@@ -162,3 +286,135 @@ class LLMRater(ABC):
         else:
             suffix = {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
         return str(number) + suffix
+
+
+class AsyncLLMRater:
+    """
+    Asynchronous counterpart of LLMRater, it builds the prompts and parses the answers with the wrapped rater
+    but awaits the LLM instead of blocking, so that the requests of many sessions can be in flight at the same time.
+
+    Attributes:
+        rater (LLMRater): the rater used to build the prompts and parse the answers
+    """
+
+    def __init__(self, rater: LLMRater):
+        self.rater = rater
+        self.llm = rater.llm
+
+    async def aquery(
+        self,
+        user: User,
+        item: Movie,
+        num_interacted: int,
+        interactions: List[UserMovieInteraction],
+        retrieved_items: List[Movie],
+        seed: int = None,
+    ) -> Tuple[int, str, str]:
+        """
+        Awaits the LLM for the rating of the item, same as LLMRater.query.
+
+        Args:
+            user (User): the user
+            item (Movie): the item
+            num_interacted (int): the number of times the item has been watched
+            interactions (list of UserMovieInteraction): the previous interactions
+            retrieved_items (list of Movie): the retrieved items
+            seed (int, optional): seed used by local models to sample the answer
+
+        Returns:
+            Tuple[int, str, str]: the rating, the explanation of the LLM and html of LLM interaction (if llm_query_explanation is True)
+        """
+        return (
+            await self.aquery_with_raw(
+                user, item, num_interacted, interactions, retrieved_items, seed
+            )
+        )[0]
+
+    async def aquery_with_raw(
+        self,
+        user: User,
+        item: Movie,
+        num_interacted: int,
+        interactions: List[UserMovieInteraction],
+        retrieved_items: List[Movie],
+        seed: int = None,
+    ) -> Tuple[Tuple[int, str, str], Tuple[int, str]]:
+        """
+        Same as aquery, but also returns the hash of the prompt and the raw answer of the LLM (see LLMRater.query_batch_with_raw)
+        """
+        rater = self.rater
+        few_shot_prompts = rater._get_few_shot_prompts()
+        prompt = rater._get_prompt(
+            user, item, num_interacted, interactions, retrieved_items
+        )
+
+        if rater.request_scale == "0-9":
+            request = self.llm.arequest_rating_0_9
+        elif rater.request_scale == "1-10":
+            request = self.llm.arequest_rating_1_10
+        elif rater.request_scale == "1-5":
+            request = self.llm.arequest_rating_1_5
+        else:
+            request = self.llm.arequest_rating_text
+        dialog = few_shot_prompts + prompt
+        _, out = await request(rater.system_prompt, dialog, seed)
+        rating = rater.parse_rating(out)
+        raw = (dialog_hash(rater.system_prompt, dialog), out)
+
+        if not rater.llm_query_explanation:
+            return (rating, "", ""), raw
+
+        prompt_explanation = rater._get_prompt_explanation(prompt, rating)
+        prompt_txt, explanation = await self.llm.arequest_explanation(
+            rater.system_prompt, few_shot_prompts + prompt_explanation, seed
+        )
+        return (
+            rating,
+            explanation,
+            rater._get_explanation_interaction(
+                prompt_explanation, prompt_txt, explanation
+            ),
+        ), raw
+
+
+class NoOpLLMRater:
+    """
+    Rater that never queries the LLM: every item gets the same rating, with an empty explanation.
+    It has the interface of both LLMRater and AsyncLLMRater, and it is used to validate the environment without LLM generations.
+
+    Attributes:
+        rating (float): the rating given to every item
+    """
+
+    def __init__(self, rating: float = 5):
+        self.rating = rating
+        self.llm = None
+        self.rnd = np.random.RandomState(42)
+
+    def query(
+        self,
+        user: User,
+        item: Movie,
+        num_interacted: int,
+        interactions: List[UserMovieInteraction],
+        retrieved_items: List[Movie],
+    ) -> Tuple[int, str, str]:
+        return self.rating, "", ""
+
+    def query_batch(
+        self, queries: List[RatingQuery], rnd: np.random.RandomState = None
+    ) -> List[Tuple[int, str, str]]:
+        return [(self.rating, "", "") for _ in queries]
+
+    def query_batch_with_raw(
+        self, queries: List[RatingQuery], rnd: np.random.RandomState = None
+    ) -> Tuple[List[Tuple[int, str, str]], List[Tuple[int, str]]]:
+        return self.query_batch(queries), [(0, str(self.rating))] * len(queries)
+
+    async def aquery(self, *args, **kwargs) -> Tuple[int, str, str]:
+        return self.rating, "", ""
+
+    async def aquery_with_raw(
+        self, *args, **kwargs
+    ) -> Tuple[Tuple[int, str, str], Tuple[int, str]]:
+        return (self.rating, "", ""), (0, str(self.rating))
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import List, Tuple
 from auto_gptq import exllama_set_max_input_length
 import torch
 from transformers import (
@@ -124,3 +124,45 @@ class Transformers(LLM):
         prompt = self.encode(system_prompt, dialog)
         res = self.pipe_request_explanation(prompt, max_new_tokens=512)
         return prompt, res[0]["generated_text"][len(prompt) :]
+
+    def request_rating_0_9_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return self._request_batch(self.pipe_request_rating_0_9, system_prompt, dialogs)
+
+    def request_rating_1_5_batch(self, system_prompt, dialogs) -> List[Tuple[str, str]]:
+        return self._request_batch(self.pipe_request_rating_1_5, system_prompt, dialogs)
+
+    def request_rating_1_10_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.pipe_request_rating_1_10, system_prompt, dialogs
+        )
+
+    def request_rating_text_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.pipe_request_rating_text, system_prompt, dialogs
+        )
+
+    def request_explanation_batch(
+        self, system_prompt, dialogs
+    ) -> List[Tuple[str, str]]:
+        return self._request_batch(
+            self.pipe_request_explanation, system_prompt, dialogs
+        )
+
+    def _request_batch(self, pipe, system_prompt, dialogs):
+        """
+        Runs all the dialogs through the pipeline in a single batched forward pass
+        """
+        prompts = [self.encode(system_prompt, dialog) for dialog in dialogs]
+        # Decoder-only models need left padding to generate the next token of every prompt
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token_id = self.tokenizer.eos_token_id
+        res = pipe(prompts, batch_size=len(prompts))
+        return [
+            (prompt, r[0]["generated_text"][len(prompt) :])
+            for prompt, r in zip(prompts, res)
+        ]
@@ -1,2 +1,4 @@
 from .env import Simulatio4RecSys
 from .LLM import load_LLM
+from .vector_env import BatchedSimulatio4RecSys
+from .population import PopulationSimulator
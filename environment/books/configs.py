@@ -225,5 +225,6 @@ def get_enviroment_from_args(llm, args, seed=None, render_mode=None):
         reward_shaping=get_reward_shaping(args.reward_shaping, seed),
     )
     env.reset(seed=seed)
-    check_env(env)
+    with env.validation_mode():
+        check_env(env)
     return env
@@ -1,21 +1,70 @@
-import os
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import string
+import threading
+import time
+import typing
+import weakref
 from functools import reduce
 
 import gymnasium as gym
 import numpy as np
-import pandas as pd
-import torch
 from gymnasium import spaces
 
 from environment.item import ItemsLoader
 from environment.items_retrieval import ItemsRetrieval
 from environment.items_selection import ItemsSelector
-from environment.LLM import LLMRater
-from environment.memory import Memory
+from environment.LLM import (
+    AsyncLLMRater,
+    LLMRater,
+    NoOpLLMRater,
+    RatingQuery,
+    llm_lock,
+    seeded_generation,
+    seeded_request,
+)
+from environment.memory import Memory, UserMovieInteraction
+from environment.prefetch import RatingPrefetcher
+from environment.rating_fallback import RatingFallback, get_default_fallback
 from environment.reward_perturbator import RewardPerturbator
+from environment.render_sink import RenderSink
+from environment.replay import StepLog, StepRecorder
 from environment.reward_shaping import RewardShaping
-from environment.users import UsersLoader
+from environment.timing import StageTimer
+from environment.users import User, UsersLoader
+
+
+class EnvSnapshot:
+    """
+    Object returned by Simulatio4RecSys.snapshot, it contains everything needed to restore the environment.
+    It must be treated as read-only, since its content is shared with the environment.
+    """
+
+    def __init__(
+        self,
+        user,
+        items_interact_buffer,
+        items_interact_len,
+        memory,
+        llm_seed,
+        evaluation_previous_user_id,
+        evaluation_count,
+        rng_states,
+        rater_rnd_state,
+        replay_position,
+    ):
+        self.user = user
+        self.items_interact_buffer = items_interact_buffer
+        self.items_interact_len = items_interact_len
+        self.memory = memory
+        self.llm_seed = llm_seed
+        self.evaluation_previous_user_id = evaluation_previous_user_id
+        self.evaluation_count = evaluation_count
+        self.rng_states = rng_states
+        self.rater_rnd_state = rater_rnd_state
+        self.replay_position = replay_position
 
 
 class Simulatio4RecSys(gym.Env):
@@ -31,6 +80,21 @@ class Simulatio4RecSys(gym.Env):
         llm_rater: LLMRater,
         render_path: str = "./tmp/render/",
         evaluation: bool = False,
+        lean_observation: bool = False,
+        observation_text: bool = True,
+        max_items_interact: int = 256,
+        slate_size: int = 1,
+        timing: bool = False,
+        timing_info: bool = False,
+        recorder: StepRecorder = None,
+        replay: StepLog = None,
+        render_buffer_size: int = 4096,
+        evaluation_first_user_id: int = 0,
+        prefetcher: RatingPrefetcher = None,
+        step_deadline_ms: float = None,
+        rating_fallback: RatingFallback = None,
+        memory_factory: typing.Callable[[ItemsLoader], Memory] = Memory,
+        keep_memory: bool = False,
     ):
         """
         Initialize render mode, if render_mode == 'human', then at every step the console will print
@@ -39,6 +103,9 @@ class Simulatio4RecSys(gym.Env):
         self.render_mode = render_mode
         self.render_path = render_path
         self.metadata = {"render_modes": ["human", "csv"]}
+        self.render_buffer_size = render_buffer_size
+        self._render_sink = None
+        self._validating = False
 
         """
         Initialize the users list and
@@ -55,41 +122,77 @@ class Simulatio4RecSys(gym.Env):
         self.item_ids = self.items_loader.load_all_ids()
         self.num_items = len(self.item_ids)
 
+        """
+        The items interacted with are stored in a preallocated buffer of max_items_interact rows (item action, rating),
+        only the first items_interact_len rows are valid.
+        If lean_observation is True the observation contains the whole buffer (a zero-copy view that is overwritten by the
+        following steps, copy it if you need to keep it) together with its length, and the episode is truncated when the buffer is full.
+        Otherwise the buffer grows when full and the observation contains a copy of the valid rows.
+        """
+        self.lean_observation = lean_observation
+        self.observation_text = observation_text
+        self.max_items_interact = max_items_interact
+        self._items_interact_buffer = np.zeros(
+            (self.max_items_interact, 2), dtype=np.int32
+        )
+        self._items_interact_len = 0
+        # True if the buffer is shared with a snapshot, it is then copied before being modified
+        self._items_interact_shared = False
+
         """
         user_id (integer) between 0 and num_users
-        user_name (string)
+        user_name (string), only if observation_text is True
         user_gender ('M' or 'F'), represented by a discrete space of two elements
         user_age (integer) age of the user between 0 and 200
-        user_description (string ); max lenght 10e4
+        user_description (string ); max lenght 10e4, only if observation_text is True
         items_interact (list of tuple of integers), is a list of films ids seen and the rating assigned by the user (corresponding to user_id)
-
+            if lean_observation is True, it is an array of shape (max_items_interact, 2) and items_interact_len is the number of valid rows
         """
-        self.observation_space = spaces.Dict(
-            {
-                "user_id": spaces.Discrete(self.num_users),
-                "user_name": spaces.Text(
-                    max_length=100, min_length=1, charset=string.printable
-                ),
-                "user_gender": spaces.Discrete(2),
-                "user_age": spaces.Box(low=0, high=200, shape=(1,), dtype=np.int_),
-                "user_description": spaces.Text(
-                    max_length=10000, min_length=1, charset=string.printable
-                ),
-                "items_interact": spaces.Sequence(
-                    spaces.Box(
-                        low=np.array([0, 0]),
-                        high=np.array([self.num_items, 11]),
-                        shape=(2,),
-                        dtype=np.int_,
-                    )
-                ),
-            }
-        )
+        observation_space = {
+            "user_id": spaces.Discrete(self.num_users),
+            "user_name": spaces.Text(
+                max_length=100, min_length=1, charset=string.printable
+            ),
+            "user_gender": spaces.Discrete(2),
+            "user_age": spaces.Box(low=0, high=200, shape=(1,), dtype=np.int_),
+            "user_description": spaces.Text(
+                max_length=10000, min_length=1, charset=string.printable
+            ),
+        }
+        if not self.observation_text:
+            del observation_space["user_name"]
+            del observation_space["user_description"]
+        if self.lean_observation:
+            observation_space["items_interact"] = spaces.Box(
+                low=0,
+                high=np.tile([self.num_items, 11], (self.max_items_interact, 1)),
+                shape=(self.max_items_interact, 2),
+                dtype=np.int32,
+            )
+            observation_space["items_interact_len"] = spaces.Discrete(
+                self.max_items_interact + 1
+            )
+        else:
+            observation_space["items_interact"] = spaces.Sequence(
+                spaces.Box(
+                    low=np.array([0, 0]),
+                    high=np.array([self.num_items, 11]),
+                    shape=(2,),
+                    dtype=np.int_,
+                )
+            )
+        self.observation_space = spaces.Dict(observation_space)
 
         """
-        We have one action for each Movie in the dataset, one action correspond to recommend one item
+        We have one action for each Movie in the dataset, one action correspond to recommend one item.
+        If slate_size > 1, an action is a slate of slate_size items, all rated by the LLM, among which the items selector
+        picks the ones the user consumes.
         """
-        self.action_space = spaces.Discrete(self.num_items)
+        self.slate_size = slate_size
+        if self.slate_size == 1:
+            self.action_space = spaces.Discrete(self.num_items)
+        else:
+            self.action_space = spaces.MultiDiscrete([self.num_items] * self.slate_size)
 
         """
         The following dictionary mabs abstract action to films ids, such that each action correspond to recommending 
@@ -104,14 +207,20 @@ class Simulatio4RecSys(gym.Env):
             count += 1
 
         """
-        Initialize Memory
+        Initialize Memory, memory_factory(items_loader) returns an empty memory (Memory or another backend with the same
+        interface, e.g. ColumnarMemory). The memory is emptied at every reset (see clean_memory), with keep_memory
+        the histories of the users are kept across episodes instead, e.g. for a TieredMemory or a SharedColumnarMemory
+        that hold the histories of a whole population.
         """
-        self.memory = Memory(self.items_loader)
+        self.memory_factory = memory_factory
+        self.keep_memory = keep_memory
+        self.memory = self.memory_factory(self.items_loader)
 
         self.items_retrieval = items_retrieval
         self.items_selector = items_selector
         self.reward_perturbator = reward_perturbator
         self.rating_prompt = llm_rater
+        self.async_rating_prompt = AsyncLLMRater(llm_rater)
         self.llm_seed = 0
 
         """
@@ -120,19 +229,104 @@ class Simulatio4RecSys(gym.Env):
         self.reward_shaping = reward_shaping
 
         self.evaluation = evaluation
+        self.evaluation_first_user_id = evaluation_first_user_id
         self.evaluation_previous_user_id = None
         self.evaluation_count = 0
 
+        """
+        Timing of the stages of the step, if timing_info is True the timings of every step are added to info["timings"].
+        The percentiles over the last steps are available via timer.summary() and timer.dump(path).
+        """
+        self.timer = StageTimer(enabled=timing or timing_info)
+        self.timing_info = timing_info
+
+        """
+        Record and replay, the recorder writes the ratings of every step to a log. In replay mode the ratings are
+        taken from the log instead of querying the LLM, the environment must be driven by the same seeds and actions.
+        """
+        if recorder is not None and replay is not None:
+            raise ValueError("An environment cannot record and replay at the same time")
+        self.recorder = recorder
+        self.replay = replay
+
+        """
+        Speculative prefetch, the ratings of the candidate actions passed to prefetch are computed in background
+        and step uses them if the action taken is one of them. With step_deadline_ms the step waits for the ratings
+        being prefetched at most until its deadline, then falls back. close also closes the prefetcher.
+        """
+        self.prefetcher = prefetcher
+
+        """
+        If step_deadline_ms is not None and the LLM does not answer within it, the ratings are taken from rating_fallback
+        (by default the cached rating of the item for the user, or its vote average) and info["rating_fallback"] is True.
+        The answers of the LLM, also the late ones, are given to rating_fallback to fill its cache.
+        """
+        self.step_deadline_ms = step_deadline_ms
+        if step_deadline_ms is not None and rating_fallback is None:
+            rating_fallback = get_default_fallback()
+        self.rating_fallback = rating_fallback
+        # the late answers are given to rating_fallback by the worker thread while the steps read it
+        self._rating_fallback_lock = threading.Lock()
+        self._rating_fallback_used = False
+        self._deadline_executor = None
+        self._deadline_future = None
+
     def _get_obs(self):
         gender = 0 if self._user.gender == "M" else 1
-        return {
+        observation = {
             "user_id": self._user.id,
-            "user_name": self._user.name,
             "user_gender": gender,
             "user_age": np.array([self._user.age], dtype=np.int_),
-            "user_description": self._user.description,
-            "items_interact": self._items_interact,
         }
+        if self.observation_text:
+            observation["user_name"] = self._user.name
+            observation["user_description"] = self._user.description
+        if self.lean_observation:
+            observation["items_interact"] = self._items_interact_buffer
+            observation["items_interact_len"] = self._items_interact_len
+        else:
+            observation["items_interact"] = tuple(self._items_interact.astype(np.int_))
+        return observation
+
+    @property
+    def _items_interact(self):
+        """
+        View of the valid rows of the buffer, each row contains the action of an item and its rating
+        """
+        return self._items_interact_buffer[: self._items_interact_len]
+
+    @_items_interact.setter
+    def _items_interact(self, items_interact):
+        # A new buffer is allocated instead of clearing the old one, which may still be referenced by the last
+        # observation of the previous episode (e.g. info["final_observation"] of the vectorized environments)
+        self._items_interact_buffer = np.zeros_like(self._items_interact_buffer)
+        self._items_interact_shared = False
+        self._items_interact_len = 0
+        for action, rating in items_interact:
+            self._append_item_interact(action, rating)
+
+    def _append_item_interact(self, action: int, rating: float):
+        """
+        Adds an item to the buffer of items interacted with, the buffer doubles its size when full.
+        In lean_observation mode the buffer is never reallocated, the episode is truncated before it overflows.
+        """
+        if self._items_interact_len == len(self._items_interact_buffer):
+            if self.lean_observation:
+                raise ValueError(
+                    f"More than {self.max_items_interact} items interacted with in lean"
+                    " observation mode"
+                )
+            self._items_interact_buffer = np.concatenate(
+                [
+                    self._items_interact_buffer,
+                    np.zeros_like(self._items_interact_buffer),
+                ]
+            )
+        elif self._items_interact_shared:
+            self._items_interact_buffer = self._items_interact_buffer.copy()
+        self._items_interact_shared = False
+        self._items_interact_buffer[self._items_interact_len] = (action, rating)
+        self._items_interact_len += 1
 
     def reset(self, seed=None, options=None, user_id=None):
         """
@@ -140,7 +334,8 @@ class Simulatio4RecSys(gym.Env):
         the user selection is performed at random if the user_id input is None
         """
         super().reset(seed=seed)
-        self.clean_memory()
+        if not self.keep_memory:
+            self.clean_memory()
         if seed is not None:
             self.items_selector.seed(seed)
             self.reward_perturbator.seed(seed)
@@ -153,7 +348,7 @@ class Simulatio4RecSys(gym.Env):
             user_id = self.np_random.integers(low=0, high=self.num_users)
         elif self.evaluation:
             if self.evaluation_previous_user_id is None:
-                user_id = 0
+                user_id = self.evaluation_first_user_id
                 self.evaluation_count = 0
             else:
                 user_id = self.evaluation_previous_user_id + 1
@@ -167,63 +362,477 @@ class Simulatio4RecSys(gym.Env):
 
         return observation, info
 
-    def step(self, action: int):
+    def step(self, action):
         """
-        The step takes an action, which correspond to a film recommendation. We use the mapping
-        action_to_item to map an action to its corresponding film.
+        The step takes an action, which correspond to a film recommendation (or to a slate of slate_size recommendations).
+        We use the mapping action_to_item to map an action to its corresponding film.
         """
-        item_id = self.action_to_item[action]
+        self.timer.begin_step()
+        queries = self._get_rating_queries(action)
 
         """
-        Use the MoviesLoader to load curr_item, which is a Movie object crresponding to the id item_id 
+        Given the user, the recommended item and the retieved item we construct a prompt for the LLM to predict the rating that
+        the user would give to the recommended Movie. All the items of a slate are rated in a single batched request.
         """
-        curr_item = self.items_loader.load_items_from_ids(id_list=[item_id])
+        with self.timer.span("llm"):
+            results, raw = self._query_ratings(queries)
+
+        return self._apply_ratings(queries, results, raw)
+
+    async def areset(self, seed=None, options=None, user_id=None):
+        """
+        Asynchronous version of reset, reset does not query the LLM so it never waits.
+        """
+        return self.reset(seed=seed, options=options, user_id=user_id)
+
+    async def astep(self, action):
+        """
+        Asynchronous version of step: the LLM is awaited instead of blocking the process, so that the steps
+        of many environments can be awaited concurrently (e.g. with asyncio.gather).
+        A single environment must not be stepped concurrently, since every step depends on the previous one.
+        """
+        self.timer.begin_step()
+        queries = self._get_rating_queries(action)
+
+        if self.replay is not None:
+            with self.timer.span("llm"):
+                results, raw = self._query_ratings(queries)
+            return self._apply_ratings(queries, results, raw)
+
+        llm_seed = self.llm_seed
+        self.llm_seed += 1
+        # The time of the llm stage is the wall time until the answer is received
+        with self.timer.span("llm"):
+            outs = await asyncio.gather(
+                *[
+                    self.async_rating_prompt.aquery_with_raw(
+                        query.user,
+                        query.item,
+                        query.num_interacted,
+                        query.interactions,
+                        query.retrieved_items,
+                        seed=llm_seed,
+                    )
+                    for query in queries
+                ]
+            )
+        results = [result for result, _ in outs]
+        raw = [query_raw for _, query_raw in outs]
+
+        return self._apply_ratings(queries, results, raw)
+
+    def _query_ratings(self, queries: typing.List[RatingQuery]):
+        """
+        Rates the queries with the LLM, seeded with llm_seed, or in replay mode with the next step of the log.
+
+        Args:
+            queries (list of RatingQuery): the queries returned by _get_rating_queries
+
+        Return:
+            results (list of tuples): for every query the rating, the explanation and html of the LLM interaction
+            raw (list of tuples or None): for every query the hash of the prompt and the raw answer of the LLM, None if they are not needed
+        """
+        self._rating_fallback_used = False
+        prefetched, prefetch_late = None, False
+        deadline = None
+        if self.step_deadline_ms is not None:
+            deadline = time.perf_counter() + self.step_deadline_ms / 1000
+        if self.prefetcher is not None and self.replay is None:
+            # the ratings being prefetched are waited for at most until the deadline of the step
+            try:
+                prefetched = self.prefetcher.get(
+                    self.llm_seed,
+                    queries,
+                    timeout=None if deadline is None else self.step_deadline_ms / 1000,
+                )
+            except FutureTimeoutError:
+                prefetch_late = True
+
+        if self.replay is not None:
+            results, raw = self.replay.next_step(
+                self._user.id, queries, self.rating_prompt.get_queries_hashes(queries)
+            )
+        elif prefetched is not None:
+            results, raw = prefetched
+        elif prefetch_late:
+            results, raw = self._fallback_ratings(queries)
+        elif deadline is not None:
+            results, raw = self._request_ratings_with_deadline(
+                queries, self.llm_seed, max(0.0, deadline - time.perf_counter())
+            )
+        else:
+            results, raw = self._request_ratings(
+                queries, self.llm_seed, self.recorder is not None
+            )
+        self.llm_seed += 1
+        return results, raw
+
+    def _request_ratings(
+        self, queries: typing.List[RatingQuery], seed: int, with_raw: bool = True
+    ):
+        """
+        Queries the LLM for the ratings of queries with seed, the raw answers are returned only if with_raw is True
+        """
+        with seeded_request(self.rating_prompt.llm, seed):
+            if with_raw:
+                return self.rating_prompt.query_batch_with_raw(queries)
+            return self.rating_prompt.query_batch(queries), None
+
+    def _llm_lock(self):
+        """
+        Lock of the LLM, it serializes the requests of the environment with the ones of the prefetcher and of the asynchronous
+        steps, since neither the model nor the global torch random generator are thread safe
+        """
+        return llm_lock(self.rating_prompt.llm)
+
+    def _request_ratings_with_deadline(
+        self, queries: typing.List[RatingQuery], seed: int, timeout: float
+    ):
+        """
+        Queries the LLM in a worker thread and waits at most timeout seconds (what is left of step_deadline_ms),
+        after that the ratings are taken from rating_fallback. A late request keeps running and its answer is still
+        given to rating_fallback, while it is in flight the following steps do not query the LLM and fall back directly,
+        so at most one request is pending.
+        """
+        if self._deadline_future is None or self._deadline_future.done():
+            if self._deadline_executor is None:
+                self._deadline_executor = ThreadPoolExecutor(max_workers=1)
+            future = self._deadline_executor.submit(
+                self._request_ratings, queries, seed
+            )
+            self._deadline_future = future
+
+            rating_fallback = self.rating_fallback
+            rating_fallback_lock = self._rating_fallback_lock
+
+            def backfill(future):
+                if future.cancelled() or future.exception() is not None:
+                    return
+                with rating_fallback_lock:
+                    for query, (rating, _, _) in zip(queries, future.result()[0]):
+                        rating_fallback.update(query, rating)
+
+            future.add_done_callback(backfill)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                pass
+        return self._fallback_ratings(queries)
+
+    def _fallback_ratings(self, queries: typing.List[RatingQuery]):
+        """
+        Rates the queries with rating_fallback, when the LLM does not answer within step_deadline_ms
+        """
+        self._rating_fallback_used = True
+        results = []
+        with self._rating_fallback_lock:
+            for query in queries:
+                rating = self.rating_fallback.rate(query)
+                results.append((float(0) if rating is None else rating, "", ""))
+        return results, [(0, "")] * len(queries)
+
+    def prefetch(self, actions: typing.List):
+        """
+        Starts computing in background the ratings of the candidate actions for the next step (see RatingPrefetcher),
+        if the next step takes one of them it does not wait for the LLM. Does nothing if the environment has no prefetcher.
+
+        Args:
+            actions (list): the candidate actions, e.g. the top-k actions of the policy for the current observation
+        """
+        if self.prefetcher is None or self.replay is not None:
+            return
+        self.prefetcher.submit(
+            self.llm_seed, [self._get_rating_queries(action) for action in actions]
+        )
+
+    def _get_rating_queries(self, action) -> typing.List[RatingQuery]:
+        """
+        Builds everything the LLM needs to rate the items corresponding to action for the current user,
+        without modifying the state of the environment.
+
+        Args:
+            action (integer or array of integers): action that correspond to the recommended item, or to the slate of recommended items
+
+        Return:
+            queries (list of RatingQuery): for every recommended item the user, the item and the retrieved items with their interactions
+        """
+        actions = [action] if self.slate_size == 1 else list(action)
+        return self._build_rating_queries(self._user, actions, self.memory)
+
+    def _build_rating_queries(
+        self, user: User, actions: typing.List[int], memory: Memory
+    ) -> typing.List[RatingQuery]:
+        """
+        Builds the queries to rate the items corresponding to actions for user, given the past interactions stored in memory
+
+        Args:
+            user (User): the user
+            actions (list of integers): actions that correspond to the items to rate
+            memory (Memory): memory containing the past interactions of the user
+
+        Return:
+            queries (list of RatingQuery): for every item the user, the item and the retrieved items with their interactions
+        """
+        items_ids = [self.action_to_item[a] for a in actions]
+
+        """
+        Use the MoviesLoader to load curr_items, which are the Movie objects crresponding to the ids items_ids
+        """
+        with self.timer.span("load_items"):
+            curr_items = self.items_loader.load_items_from_ids(id_list=items_ids)
 
         """
         We fetch from the memory all previous films seen by the user together with the 
         interaction that the user had with the items. The interaction is represented via an interaction object 
         that summarize all important informations.
         """
-        past_items, past_interactions = self.memory.get_items_and_scores(self._user.id)
-        num_interacted = self.memory.get_num_interaction(self._user.id, item_id)
+        with self.timer.span("memory"):
+            past_items, past_interactions = memory.get_items_and_scores(user.id)
+
+        queries = []
+        for item_id, curr_item in zip(items_ids, curr_items):
+            with self.timer.span("memory"):
+                num_interacted = memory.get_num_interaction(user.id, item_id)
+
+            """
+            The next step is to retrieve from the list of all items seen a smaller list of relevant items. The relevance from the Movie
+            depends on the retrieved mode.
+            """
+            with self.timer.span("retrieval"):
+                retrieved_items, retrieved_interactions = self.items_retrieval.retrieve(
+                    curr_item, past_items, past_interactions
+                )
 
+            queries.append(
+                RatingQuery(
+                    user,
+                    curr_item,
+                    num_interacted,
+                    retrieved_interactions,
+                    retrieved_items,
+                )
+            )
+        return queries
+
+    def rate(
+        self,
+        user_id: int,
+        action: int,
+        history: typing.List[typing.Tuple[int, float]] = None,
+        seed: int = None,
+    ) -> typing.Tuple[float, str, str]:
         """
-        The next step is to retrieve from the list of all items seen a smaller list of relevant items. The relevance from the Movie
-        depends on the retrieved mode.
+        Stateless fast path to get the rating of the LLM for a single (user, item) pair: only the retrieval,
+        the prompt and the LLM are run, the memory, the observation and the random generators (the one of the random
+        ratings of the rater included) are left untouched.
+
+        Args:
+            user_id (integer): id of the user
+            action (integer): action that correspond to the item to rate
+            history (list of tuples (action, rating), optional): past interactions of the user in chronological order,
+                                                                 if None the user has not interacted with any item
+            seed (integer, optional): seed of the LLM, by default the current llm_seed (which is not advanced)
+
+        Return:
+            rating (float), explanation (string) and html of LLM interaction, as returned by LLMRater.query
         """
-        retrieved_items, retrieved_interactions = self.items_retrieval.retrieve(
-            curr_item[0], past_items, past_interactions
-        )
+        return self.rate_many(
+            [user_id], [action], None if history is None else [history], seed
+        )[0]
 
+    def rate_many(
+        self,
+        users_ids: typing.List[int],
+        actions: typing.List[int],
+        histories: typing.List[typing.List[typing.Tuple[int, float]]] = None,
+        seed: int = None,
+        batch_size: int = 64,
+        exact: bool = False,
+    ) -> typing.List[typing.Tuple[float, str, str]]:
         """
-        Given the user, the recommended item and the retieved item we construct a prompt for the LLM to predict the rating that
-        the user would give to the recommended Movie.
-        """
-        with torch.random.fork_rng(["cuda:0"]):
-            torch.manual_seed(self.llm_seed)
-            rating, explanation, html_interaction = self.rating_prompt.query(
-                self._user,
-                curr_item[0],
-                num_interacted,
-                retrieved_interactions,
-                retrieved_items,
+        Bulk version of rate, the pairs (users_ids[i], actions[i]) are rated in batched LLM requests of batch_size prompts,
+        all seeded with seed. The rating of a pair matches the one of rate only if the LLM decodes greedily, a sampling
+        LLM draws the answer of a pair depending on its position in the batch.
+
+        If exact is True every pair is instead rated in its own request, seeded as rate seeds it, so its rating is the one
+        rate returns also when the LLM samples its answer, at the cost of one LLM request per pair.
+
+        Args:
+            users_ids (list of integers): ids of the users
+            actions (list of integers): actions that correspond to the items to rate
+            histories (list of lists of tuples (action, rating), optional): past interactions of each user, see rate
+            seed (integer, optional): seed of the LLM, by default the current llm_seed (which is not advanced)
+            batch_size (integer): maximum number of prompts per LLM request, used only if exact is False
+            exact (bool): if True the pairs are rated one by one and their ratings match the ones of rate, see above
+
+        Return:
+            list of (rating, explanation, html of LLM interaction), one for each pair
+        """
+        if seed is None:
+            seed = self.llm_seed
+
+        empty_memory = Memory(self.items_loader)
+        queries = []
+        for i, (user_id, action) in enumerate(zip(users_ids, actions)):
+            memory = empty_memory
+            if histories is not None and histories[i]:
+                memory = Memory(self.items_loader)
+                for past_action, rating in histories[i]:
+                    memory.update_memory(
+                        user_id, [self.action_to_item[past_action]], [rating]
+                    )
+            queries += self._build_rating_queries(
+                self.user_list[user_id], [action], memory
             )
-            self.llm_seed += 1
+
+        """
+        The random ratings (if the rater has random_rating) are drawn from a generator seeded with seed,
+        so that the ratings of the episodes do not depend on the calls to rate_many
+        """
+        results = []
+        if exact:
+            for query in queries:
+                with seeded_request(self.rating_prompt.llm, seed):
+                    results += self.rating_prompt.query_batch(
+                        [query], np.random.RandomState(seed)
+                    )
+            return results
+        rnd = np.random.RandomState(seed)
+        with seeded_request(self.rating_prompt.llm, seed):
+            for i in range(0, len(queries), batch_size):
+                results += self.rating_prompt.query_batch(
+                    queries[i : i + batch_size], rnd
+                )
+        return results
+
+    def score_candidates(
+        self,
+        actions: typing.List[int],
+        reshape: bool = True,
+        batch_size: int = 64,
+        exact: bool = False,
+    ) -> np.ndarray:
+        """
+        Oracle scoring of candidate items for the current user state: all the candidates are rated by the LLM in a single
+        batched pass (one request every batch_size candidates) seeded with the seed the next step would use,
+        without modifying the memory, the items interacted with or the random generators.
+        This allows to compute the best action (and the regret) of a step.
+        The scores match the ratings step would return only if the LLM decodes greedily, a sampling LLM draws the answer
+        of a candidate depending on its position in the batch.
+
+        If exact is True every candidate is instead rated in its own request, seeded as the next step would seed it, so with
+        slate_size 1 its score is the rating step would return for it also when the LLM samples its answer,
+        at the cost of one LLM request per candidate.
+
+        Args:
+            actions (list of integers): actions that correspond to the candidate items
+            reshape (bool): if True the ratings are passed through the reward shaping, as if the user watched the item next
+                            (the reward perturbation is not applied, since it is noise)
+            batch_size (integer): maximum number of prompts per LLM request, used only if exact is False
+            exact (bool): if True the candidates are rated one by one and their ratings match the ones of step, see above
+
+        Return:
+            scores (array of floats): the score of every candidate, in the order of actions
+        """
+        queries = self._build_rating_queries(self._user, list(actions), self.memory)
+
+        # The random ratings (if the rater has random_rating) are drawn from a copy of the generator of the rater
+        rnd_state = self.rating_prompt.rnd.get_state()
+        rnd = np.random.RandomState()
+        rnd.set_state(rnd_state)
+        results = []
+        with self._llm_lock():
+            if exact:
+                for query in queries:
+                    rnd.set_state(rnd_state)
+                    with seeded_generation(self.llm_seed):
+                        results += self.rating_prompt.query_batch([query], rnd)
+            else:
+                with seeded_generation(self.llm_seed):
+                    for i in range(0, len(queries), batch_size):
+                        results += self.rating_prompt.query_batch(
+                            queries[i : i + batch_size], rnd
+                        )
+
+        scores = np.array([rating for rating, _, _ in results], dtype=np.float64)
+        if not reshape:
+            return scores
+
+        """
+        The reward shaping depends on the previous interactions with the item, we append the interaction the step would
+        create and restore the state of the random generator of the reward shaping afterwards
+        """
+        rng_state = self.reward_shaping.rng.bit_generator.state
+        timestamp = self.memory.get_num_items_interact(self._user.id) + 1
+        for i, (query, score) in enumerate(zip(queries, scores)):
+            past_interactions = self.memory.get_item_interactions(
+                self._user.id, query.item.id
+            )
+            num_watches = self.memory.get_num_interaction(self._user.id, query.item.id)
+            item_interactions = past_interactions + [
+                UserMovieInteraction(score, timestamp, num_watches + 1)
+            ]
+            scores[i], _ = self.reward_shaping.reshape(item_interactions, score)
+        self.reward_shaping.rng.bit_generator.state = rng_state
+        return scores
+
+    def _apply_ratings(
+        self,
+        queries: typing.List[RatingQuery],
+        results: typing.List[typing.Tuple[float, str, str]],
+        raw: typing.Optional[typing.List[typing.Tuple[int, str]]] = None,
+    ):
+        """
+        Given the results of the LLM for the queries returned by _get_rating_queries, updates the state of the environment and
+        returns the same tuple as step. If the environment is recording, the step is written to the log together with
+        raw, the hashes of the prompts and the raw answers of the LLM.
+        """
+        user_id = self._user.id
+        if self.slate_size == 1:
+            step_result = self._apply_rating(queries[0], *results[0])
+        else:
+            step_result = self._apply_slate_ratings(queries, results)
+
+        if self.recorder is not None:
+            self.recorder.record(user_id, queries, results, raw, step_result[1])
+        if self.step_deadline_ms is not None:
+            step_result[4]["rating_fallback"] = self._rating_fallback_used
+
+        step_timings = self.timer.end_step()
+        if self.timing_info:
+            step_result[4]["timings"] = step_timings
+        return step_result
+
+    def _apply_rating(
+        self,
+        query: RatingQuery,
+        rating: float,
+        explanation: str,
+        html_interaction: str,
+    ):
+        """
+        Given the rating predicted by the LLM for query, updates the state of the environment and
+        returns the same tuple as step.
+        """
+        curr_item = [query.item]
+        item_id = query.item.id
 
         """
         After collecting the explanation and the rating from the LLM the next step is to select the item 
         (but this only in the case more than one is recommended)
         """
-        selected_items, selected_ratings = self.items_selector.select(
-            curr_item, [rating]
-        )
+        with self.timer.span("selection"):
+            selected_items, selected_ratings = self.items_selector.select(
+                curr_item, [rating]
+            )
 
         """
         Add a small perturbation to the rating.
         """
-        selected_items, selected_ratings = self.reward_perturbator.perturb(
-            curr_item, [rating]
-        )
+        with self.timer.span("perturbation"):
+            selected_items, selected_ratings = self.reward_perturbator.perturb(
+                curr_item, [rating]
+            )
 
         """
         The next step consists in updating the Memory by adding the recommended item to the list of film seen by the user.
@@ -233,24 +842,18 @@ class Simulatio4RecSys(gym.Env):
         for m in selected_items:
             selected_items_ids.append(m.id)
 
-        self.memory.update_memory(self._user.id, selected_items_ids, selected_ratings)
+        with self.timer.span("memory"):
+            self.memory.update_memory(
+                self._user.id, selected_items_ids, selected_ratings
+            )
 
         """
         We also update the state by adding the recommended item to the list of film seen
         """
-        self._items_interact = self._items_interact + (
-            np.array(
-                [self.item_to_action[selected_items_ids[0]], selected_ratings[0]],
-                dtype=np.int_,
-            ),
+        self._append_item_interact(
+            self.item_to_action[selected_items_ids[0]], selected_ratings[0]
         )
 
-        """
-        Termination is modelled in a similar fashion to a geometric distribution: after every step the user with some small probability
-        stops intercating with the environment 
-        """
-        terminated = self.np_random.choice([True, False], p=[0.025, 0.975])
-        terminated = bool(terminated)
         observation = self._get_obs()
         reward = reduce(lambda x, y: x + y, selected_ratings)
         info = {
@@ -259,10 +862,92 @@ class Simulatio4RecSys(gym.Env):
             "LLM_interaction_HTML": html_interaction,
         }
 
-        item_interaction = self.memory.user_to_seen_films[self._user.id][item_id]
-        reward, reward_shaping_termination = self.reward_shaping.reshape(
-            item_interaction, reward
-        )
+        item_interaction = self.memory.get_item_interactions(self._user.id, item_id)
+        with self.timer.span("reward_shaping"):
+            reward, reward_shaping_termination = self.reward_shaping.reshape(
+                item_interaction, reward
+            )
+        terminated, truncated = self._get_termination(reward_shaping_termination)
+
+        return observation, reward, terminated, truncated, info
+
+    def _apply_slate_ratings(
+        self,
+        queries: typing.List[RatingQuery],
+        results: typing.List[typing.Tuple[float, str, str]],
+    ):
+        """
+        Slate version of _apply_rating: the items selector picks which of the recommended items the user consumes
+        (the items with a non-zero selected rating), only those are added to the memory and rewarded.
+        """
+        curr_items = [query.item for query in queries]
+        ratings = [rating for rating, _, _ in results]
+
+        """
+        The selector decides which items of the slate the user watches, the ratings of the items not watched are set to zero
+        """
+        with self.timer.span("selection"):
+            selected_items, selected_ratings = self.items_selector.select(
+                curr_items, ratings
+            )
+
+        """
+        Add a small perturbation to the rating.
+        """
+        with self.timer.span("perturbation"):
+            selected_items, selected_ratings = self.reward_perturbator.perturb(
+                selected_items, selected_ratings
+            )
+
+        consumed = [
+            (item, rating)
+            for item, rating in zip(selected_items, selected_ratings)
+            if rating > 0
+        ]
+
+        """
+        Update the Memory and the state with the consumed items, each of them is rewarded separately
+        """
+        with self.timer.span("memory"):
+            self.memory.update_memory(
+                self._user.id,
+                [item.id for item, _ in consumed],
+                [rating for _, rating in consumed],
+            )
+
+        reward = 0.0
+        reward_shaping_termination = False
+        for item, rating in consumed:
+            self._append_item_interact(self.item_to_action[item.id], rating)
+            item_interaction = self.memory.get_item_interactions(self._user.id, item.id)
+            with self.timer.span("reward_shaping"):
+                item_reward, item_termination = self.reward_shaping.reshape(
+                    item_interaction, rating
+                )
+            reward += item_reward
+            reward_shaping_termination = reward_shaping_termination or item_termination
+
+        observation = self._get_obs()
+        info = {
+            "LLM_explanation": [explanation for _, explanation, _ in results],
+            "LLM_rating": ratings,
+            "LLM_interaction_HTML": [html for _, _, html in results],
+            "selected_actions": [self.item_to_action[item.id] for item, _ in consumed],
+        }
+        terminated, truncated = self._get_termination(reward_shaping_termination)
+
+        return observation, reward, terminated, truncated, info
+
+    def _get_termination(self, reward_shaping_termination: bool):
+        """
+        Termination is modelled in a similar fashion to a geometric distribution: after every step the user with some small probability
+        stops intercating with the environment, the reward shaping can also terminate the episode.
+
+        Return:
+            terminated (bool), truncated (bool)
+        """
+        terminated = self.np_random.choice([True, False], p=[0.025, 0.975])
+        terminated = bool(terminated)
         if reward_shaping_termination:
             terminated = True
 
@@ -274,7 +959,12 @@ class Simulatio4RecSys(gym.Env):
             if self.evaluation_count == 11:
                 terminated = True
 
-        return observation, reward, terminated, False, info
+        # In lean observation mode the episode is truncated when the buffer cannot hold another step
+        truncated = (
+            self.lean_observation
+            and self._items_interact_len + self.slate_size > self.max_items_interact
+        )
+        return terminated, truncated
 
     def render(self):
         if self.render_mode == "human":
@@ -288,33 +978,158 @@ class Simulatio4RecSys(gym.Env):
                     else ""
                 )
             )
-        if len(self._items_interact) > 0 and self.render_mode == "csv":
-            df = pd.DataFrame(
-                {
-                    "user_id": [self._user.id],
-                    "user_name": [self._user.name],
-                    "time": [len(self._items_interact)],
-                    "movie_id": np.stack(list(self._items_interact))[-1, 0],
-                    "rating": np.stack(list(self._items_interact))[-1, 1],
-                },
+        if (
+            self._items_interact_len > 0
+            and self.render_mode == "csv"
+            and not self._validating
+        ):
+            """
+            The rows are buffered and written in chunks by the sink, the format depends on the extension of render_path
+            (CSV, Parquet or Arrow IPC). The remaining rows are written when the environment is closed.
+            """
+            if self._render_sink is None:
+                self._render_sink = RenderSink(
+                    self.render_path, buffer_size=self.render_buffer_size
+                )
+                weakref.finalize(self, self._render_sink.close)
+            movie_id, rating = self._items_interact_buffer[self._items_interact_len - 1]
+            self._render_sink.append(
+                self._user.id,
+                self._user.name,
+                self._items_interact_len,
+                movie_id,
+                rating,
             )
 
-            if os.path.exists(self.render_path):
-                df.to_csv(
-                    self.render_path,
-                    mode="a",
-                    index=False,
-                    header=False,
-                )
-            else:
-                os.makedirs(os.path.dirname(self.render_path), exist_ok=True)
-                df.to_csv(
-                    self.render_path,
-                    index=False,
-                )
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self._deadline_executor is not None:
+            self._deadline_executor.shutdown(wait=False)
+            self._deadline_executor = None
+            self._deadline_future = None
+        if self._render_sink is not None:
+            self._render_sink.close()
+            self._render_sink = None
 
     def clean_memory(self):
-        self.memory = Memory(self.items_loader)
+        """
+        Empties the memory, a memory with a clear method (e.g. TieredMemory) is emptied in place, so that its storage is reused
+        """
+        clear = getattr(self.memory, "clear", None)
+        if clear is not None:
+            clear()
+        else:
+            self.memory = self.memory_factory(self.items_loader)
+
+    def snapshot(self) -> "EnvSnapshot":
+        """
+        Captures the whole state of the environment: the current user, the items interacted with, the memory,
+        the LLM seed and the state of all the random number generators. The items interacted with are shared
+        copy-on-write with the environment and the memory takes its own snapshot (an undo journal for Memory),
+        so taking a snapshot does not copy the histories of the users.
+
+        Return:
+            snapshot (EnvSnapshot): handle to pass to restore
+        """
+        self._items_interact_shared = True
+        return EnvSnapshot(
+            user=self._user,
+            items_interact_buffer=self._items_interact_buffer,
+            items_interact_len=self._items_interact_len,
+            memory=(self.memory, self.memory.snapshot()),
+            llm_seed=self.llm_seed,
+            evaluation_previous_user_id=self.evaluation_previous_user_id,
+            evaluation_count=self.evaluation_count,
+            rng_states=[
+                rng.bit_generator.state for rng in self._get_random_generators()
+            ],
+            rater_rnd_state=self.rating_prompt.rnd.get_state(),
+            replay_position=(self.replay.position if self.replay is not None else None),
+        )
+
+    def restore(self, snapshot: "EnvSnapshot"):
+        """
+        Brings the environment back to the state it had when snapshot was taken, the same snapshot can be restored
+        any number of times as long as no older snapshot has been restored in the meantime.
+
+        Args:
+            snapshot (EnvSnapshot): handle returned by snapshot
+        """
+        self._user = snapshot.user
+        self._items_interact_buffer = snapshot.items_interact_buffer
+        self._items_interact_len = snapshot.items_interact_len
+        self._items_interact_shared = True
+        # the memory may have been replaced by a reset, the one of the snapshot is restored
+        self.memory, memory_snapshot = snapshot.memory
+        self.memory.restore(memory_snapshot)
+        self.llm_seed = snapshot.llm_seed
+        self.evaluation_previous_user_id = snapshot.evaluation_previous_user_id
+        self.evaluation_count = snapshot.evaluation_count
+        for rng, state in zip(self._get_random_generators(), snapshot.rng_states):
+            rng.bit_generator.state = state
+        self.rating_prompt.rnd.set_state(snapshot.rater_rnd_state)
+        if self.replay is not None and snapshot.replay_position is not None:
+            self.replay.rewind(snapshot.replay_position)
+
+    @contextlib.contextmanager
+    def validation_mode(self):
+        """
+        Context manager to validate the environment (e.g. with check_env) without LLM generations: inside it every item
+        is rated by a deterministic NoOpLLMRater, nothing is recorded, replayed or rendered to csv, no time is recorded and
+        the ratings are not given to the rating fallback.
+        On exit the environment is restored to the state it had before, memory and random number generators included.
+
+        Example:
+            with env.unwrapped.validation_mode():
+                check_env(env)
+        """
+        snapshot = self.snapshot()
+        saved = (
+            self.rating_prompt,
+            self.async_rating_prompt,
+            self.recorder,
+            self.replay,
+            self.prefetcher,
+            self.step_deadline_ms,
+            self.timer.enabled,
+        )
+        no_op_rater = NoOpLLMRater()
+        self.rating_prompt = no_op_rater
+        self.async_rating_prompt = no_op_rater
+        self.recorder = None
+        self.replay = None
+        self.prefetcher = None
+        self.step_deadline_ms = None
+        self.timer.enabled = False
+        self._validating = True
+        try:
+            yield self
+        finally:
+            (
+                self.rating_prompt,
+                self.async_rating_prompt,
+                self.recorder,
+                self.replay,
+                self.prefetcher,
+                self.step_deadline_ms,
+                self.timer.enabled,
+            ) = saved
+            self._validating = False
+            self.restore(snapshot)
+
+    def _get_random_generators(self):
+        """
+        Random number generators that influence the steps of the environment
+        """
+        return [
+            self.np_random,
+            self.items_selector.rng,
+            self.reward_perturbator.rng,
+            self.reward_shaping.rng,
+        ]
 
     def delete_user_item(self, user_id: int, action: int):
         """
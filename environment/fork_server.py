@@ -0,0 +1,291 @@
+import gc
+import multiprocessing
+import os
+import traceback
+import typing
+from copy import deepcopy
+from multiprocessing.connection import Client, Connection, Listener
+
+import gymnasium as gym
+import numpy as np
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import concatenate, create_empty_array, iterate
+
+
+def _work(
+    shared,
+    make_env: typing.Callable[[typing.Any, int], gym.Env],
+    index: int,
+    address: str,
+    authkey: bytes,
+):
+    """
+    Loop of a worker forked by the fork server: creates its environment and serves the commands of ForkServerVectorEnv,
+    the environment is reset automatically at the end of an episode, as in SyncVectorEnv
+    """
+    conn = Client(address, authkey=authkey)
+    conn.send(index)
+    try:
+        env = make_env(shared, index)
+        conn.send(("ok", (env.observation_space, env.action_space)))
+        while True:
+            command, data = conn.recv()
+            if command == "reset":
+                seed, options = data
+                conn.send(("ok", env.reset(seed=seed, options=options)))
+            elif command == "step":
+                observation, reward, terminated, truncated, info = env.step(data)
+                if terminated or truncated:
+                    old_observation, old_info = observation, info
+                    observation, info = env.reset()
+                    info["final_observation"] = old_observation
+                    info["final_info"] = old_info
+                conn.send(("ok", (observation, reward, terminated, truncated, info)))
+            elif command == "call":
+                name, args, kwargs = data
+                attribute = getattr(env, name)
+                result = (
+                    attribute(*args, **kwargs) if callable(attribute) else attribute
+                )
+                conn.send(("ok", result))
+            elif command == "close":
+                env.close()
+                conn.send(("ok", None))
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def _serve(
+    conn: Connection,
+    load_shared: typing.Callable[[], typing.Any],
+    make_env: typing.Callable[[typing.Any, int], gym.Env],
+    address: str,
+    authkey: bytes,
+):
+    """
+    Loop of the fork server: loads the shared data once and forks a worker for every request
+    """
+    context = multiprocessing.get_context("fork")
+    try:
+        shared = load_shared()
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    """
+    The objects loaded so far are moved to the permanent generation of the garbage collector, the collections
+    of the workers then do not touch them and their pages stay shared.
+    """
+    gc.collect()
+    gc.freeze()
+    conn.send(("ok", None))
+
+    workers = []
+    try:
+        while True:
+            command, index = conn.recv()
+            if command == "close":
+                break
+            worker = context.Process(
+                target=_work,
+                args=(shared, make_env, index, address, authkey),
+                daemon=True,
+            )
+            worker.start()
+            workers.append(worker)
+            conn.send(("ok", worker.pid))
+    except EOFError:
+        pass
+    finally:
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        conn.close()
+
+
+def _receive(conn: Connection):
+    status, result = conn.recv()
+    if status == "error":
+        raise RuntimeError(f"Fork server worker failed:\n{result}")
+    return result
+
+
+class ForkServer:
+    """
+    Process that loads the data shared by the environments (the items, the users, their indexes and the LLM) once,
+    and then forks the environment workers on request. The workers share the pages of the data copy-on-write
+    instead of loading a private copy each, so the startup time and the memory do not grow with the number of workers.
+
+    The fork server is forked from the current process when it is created, create it before loading the LLM
+    or initializing CUDA in the current process (CUDA can not be used in a forked process once initialized in the parent).
+    For the same reason load_shared must not initialize CUDA, an LLM that runs on the GPU has to be loaded by make_env
+    in every worker instead.
+
+    Attributes:
+        load_shared (callable): load_shared() returns the shared data, called once in the fork server
+        make_env (callable): make_env(shared, i) returns the environment of the i-th worker, called in the worker
+    """
+
+    def __init__(
+        self,
+        load_shared: typing.Callable[[], typing.Any],
+        make_env: typing.Callable[[typing.Any, int], gym.Env],
+    ):
+        self._authkey = os.urandom(32)
+        self._listener = Listener(family="AF_UNIX", authkey=self._authkey)
+        context = multiprocessing.get_context("fork")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_serve,
+            args=(
+                child_conn,
+                load_shared,
+                make_env,
+                self._listener.address,
+                self._authkey,
+            ),
+        )
+        self._process.start()
+        child_conn.close()
+        _receive(self._conn)
+
+    def start_worker(self, index: int) -> Connection:
+        """
+        Forks a worker that creates the environment make_env(shared, index)
+
+        Return:
+            the connection to the worker
+        """
+        self._conn.send(("start", index))
+        _receive(self._conn)
+        conn = self._listener.accept()
+        if conn.recv() != index:
+            raise RuntimeError("Fork server worker connected out of order")
+        return conn
+
+    def close(self):
+        """
+        Stops the fork server, waiting for the workers to exit
+        """
+        if self._process is None:
+            return
+        try:
+            self._conn.send(("close", None))
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join()
+        self._conn.close()
+        self._listener.close()
+        self._process = None
+
+
+class ForkServerVectorEnv(VectorEnv):
+    """
+    Vectorized environment whose sub-environments run in workers forked by a ForkServer, like SubprocVecEnv
+    but sharing the data loaded by the fork server. The sub-environments are reset automatically at the end of an episode,
+    the last observation and info are in info["final_observation"] and info["final_info"] as in SyncVectorEnv.
+
+    Attributes:
+        fork_server (ForkServer): the fork server, it is not closed with the environment
+        num_envs (integer): number of sub-environments, the i-th is created with make_env(shared, i)
+        copy (bool): if True, reset and step return a copy of the observations
+    """
+
+    def __init__(self, fork_server: ForkServer, num_envs: int, copy: bool = True):
+        self.fork_server = fork_server
+        self.copy = copy
+        self._conns = [fork_server.start_worker(i) for i in range(num_envs)]
+        spaces = [_receive(conn) for conn in self._conns]
+        observation_space, action_space = spaces[0]
+        super().__init__(num_envs, observation_space, action_space)
+
+        self.observations = create_empty_array(
+            self.single_observation_space, n=self.num_envs, fn=np.zeros
+        )
+        self._rewards = np.zeros((self.num_envs,), dtype=np.float64)
+        self._terminateds = np.zeros((self.num_envs,), dtype=np.bool_)
+        self._truncateds = np.zeros((self.num_envs,), dtype=np.bool_)
+
+    def reset_async(
+        self,
+        seed: typing.Optional[typing.Union[int, typing.List[int]]] = None,
+        options: typing.Optional[dict] = None,
+    ):
+        if seed is None:
+            seed = [None for _ in range(self.num_envs)]
+        if isinstance(seed, int):
+            seed = [seed + i for i in range(self.num_envs)]
+        assert len(seed) == self.num_envs
+        for conn, single_seed in zip(self._conns, seed):
+            conn.send(("reset", (single_seed, options)))
+
+    def reset_wait(
+        self,
+        timeout=None,
+        seed: typing.Optional[typing.Union[int, typing.List[int]]] = None,
+        options: typing.Optional[dict] = None,
+    ):
+        self._terminateds[:] = False
+        self._truncateds[:] = False
+        observations, infos = [], {}
+        for i, conn in enumerate(self._conns):
+            observation, info = _receive(conn)
+            observations.append(observation)
+            infos = self._add_info(infos, info, i)
+        self.observations = concatenate(
+            self.single_observation_space, observations, self.observations
+        )
+        return (deepcopy(self.observations) if self.copy else self.observations), infos
+
+    def step_async(self, actions):
+        for conn, action in zip(self._conns, iterate(self.action_space, actions)):
+            conn.send(("step", action))
+
+    def step_wait(self, timeout=None):
+        observations, infos = [], {}
+        for i, conn in enumerate(self._conns):
+            (
+                observation,
+                self._rewards[i],
+                self._terminateds[i],
+                self._truncateds[i],
+                info,
+            ) = _receive(conn)
+            observations.append(observation)
+            infos = self._add_info(infos, info, i)
+        self.observations = concatenate(
+            self.single_observation_space, observations, self.observations
+        )
+        return (
+            deepcopy(self.observations) if self.copy else self.observations,
+            np.copy(self._rewards),
+            np.copy(self._terminateds),
+            np.copy(self._truncateds),
+            infos,
+        )
+
+    def call(self, name: str, *args, **kwargs) -> tuple:
+        """
+        Calls the method name of every sub-environment (or gets the attribute name if it is not callable)
+
+        Return:
+            the results of every sub-environment
+        """
+        for conn in self._conns:
+            conn.send(("call", (name, args, kwargs)))
+        return tuple(_receive(conn) for conn in self._conns)
+
+    def close_extras(self, **kwargs):
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+                _receive(conn)
+            except (EOFError, BrokenPipeError, OSError):
+                pass
+            conn.close()
+        self._conns = []
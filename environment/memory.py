@@ -1,5 +1,12 @@
+import functools
+import math
 import time
 import typing
+import weakref
+from abc import ABC, abstractmethod
+from collections import deque
+
+import numpy as np
 
 
 class UserMovieInteraction:
@@ -14,22 +21,408 @@ class UserMovieInteraction:
         self.num_watches = num_watches
 
 
+def _set_logged(journal: typing.Optional[list], dictionary: dict, key, value):
+    """
+    Sets dictionary[key] to value, removing the key if value is None, and appends to journal (if not None)
+    the function that undoes the change
+    """
+    if journal is not None:
+        journal.append(
+            functools.partial(_set_logged, None, dictionary, key, dictionary.get(key))
+        )
+    if value is None:
+        dictionary.pop(key, None)
+    else:
+        dictionary[key] = value
+
+
+def _setattr_logged(journal: typing.Optional[list], obj, name: str, value):
+    """
+    Sets the attribute name of obj to value, and appends to journal (if not None) the function that undoes the change
+    """
+    if journal is not None:
+        journal.append(functools.partial(setattr, obj, name, getattr(obj, name)))
+    setattr(obj, name, value)
+
+
+class _UserHistoryView:
+    """
+    Materialized history of a user in Memory: the items seen, in order of first interaction, with their last interaction.
+    It is updated in place by the memory, so that reading it does not walk the interactions or load the items again.
+
+    A removed item leaves a hole (None) in the lists, the holes are compacted when they are more than half of the lists,
+    so that removing an item takes O(1) amortized time.
+    The methods that modify the view append to journal (if not None) the functions that undo the changes.
+    """
+
+    __slots__ = ("item_ids", "items", "interactions", "positions", "num_removed")
+
+    def __init__(self):
+        self.item_ids: typing.List[typing.Optional[int]] = []
+        self.items = []
+        self.interactions: typing.List[typing.Optional[UserMovieInteraction]] = []
+        self.positions: typing.Dict[int, int] = {}
+        self.num_removed = 0
+
+    def add(
+        self,
+        item_id: int,
+        item,
+        interaction: UserMovieInteraction,
+        journal: typing.Optional[list] = None,
+    ):
+        self.positions[item_id] = len(self.item_ids)
+        self.item_ids.append(item_id)
+        self.items.append(item)
+        self.interactions.append(interaction)
+        if journal is not None:
+            journal.append(self._undo_add)
+
+    def _undo_add(self):
+        del self.positions[self.item_ids.pop()]
+        self.items.pop()
+        self.interactions.pop()
+
+    def set_interaction(
+        self,
+        item_id: int,
+        interaction: UserMovieInteraction,
+        journal: typing.Optional[list] = None,
+    ):
+        position = self.positions[item_id]
+        if journal is not None:
+            journal.append(
+                functools.partial(
+                    self._set_interaction_at, position, self.interactions[position]
+                )
+            )
+        self.interactions[position] = interaction
+
+    def _set_interaction_at(self, position: int, interaction: UserMovieInteraction):
+        self.interactions[position] = interaction
+
+    def remove(self, item_id: int, journal: typing.Optional[list] = None):
+        position = self.positions.pop(item_id)
+        if journal is not None:
+            journal.append(
+                functools.partial(
+                    self._undo_remove,
+                    item_id,
+                    position,
+                    self.items[position],
+                    self.interactions[position],
+                )
+            )
+        self.item_ids[position] = None
+        self.items[position] = None
+        self.interactions[position] = None
+        self.num_removed += 1
+        if 2 * self.num_removed > len(self.item_ids):
+            self._compact(journal)
+
+    def _undo_remove(
+        self, item_id: int, position: int, item, interaction: UserMovieInteraction
+    ):
+        self.positions[item_id] = position
+        self.item_ids[position] = item_id
+        self.items[position] = item
+        self.interactions[position] = interaction
+        self.num_removed -= 1
+
+    def _compact(self, journal: typing.Optional[list] = None):
+        if journal is not None:
+            # the compaction builds new lists, so undoing it only puts back the old ones
+            journal.append(
+                functools.partial(
+                    self._set_lists,
+                    self.item_ids,
+                    self.items,
+                    self.interactions,
+                    self.positions,
+                    self.num_removed,
+                )
+            )
+        kept = [i for i, item_id in enumerate(self.item_ids) if item_id is not None]
+        self._set_lists(
+            [self.item_ids[i] for i in kept],
+            [self.items[i] for i in kept],
+            [self.interactions[i] for i in kept],
+            {self.item_ids[i]: position for position, i in enumerate(kept)},
+            0,
+        )
+
+    def _set_lists(self, item_ids, items, interactions, positions, num_removed: int):
+        self.item_ids = item_ids
+        self.items = items
+        self.interactions = interactions
+        self.positions = positions
+        self.num_removed = num_removed
+
+    def get_items_and_interactions(self):
+        if self.num_removed == 0:
+            return list(self.items), list(self.interactions)
+        kept = [i for i, item_id in enumerate(self.item_ids) if item_id is not None]
+        return [self.items[i] for i in kept], [self.interactions[i] for i in kept]
+
+
+class EvictionPolicy(ABC):
+    """
+    Policy that decides which interactions a Memory forgets, to bound the history of every user (and so the prompts
+    and the retrieval) in long episodes. The policy keeps a state for every user, which receives the interactions added
+    to the memory and proposes the interactions to forget, each in O(1) amortized time.
+    The interactions proposed may have already been deleted from the memory, in which case they are skipped.
+    The changes of the state can be undone, in reverse order, so that the snapshots of the memory can be restored.
+    """
+
+    @abstractmethod
+    def new_state(self):
+        """
+        Return the state of a new user
+        """
+        pass
+
+    @abstractmethod
+    def add(self, state, item_id: int, interaction: UserMovieInteraction):
+        """
+        Adds to the state an interaction of the user
+
+        Args:
+            state: state of the user
+            item_id (integer): id of the item
+            interaction (UserMovieInteraction): the interaction
+        """
+        pass
+
+    @abstractmethod
+    def undo_add(self, state, item_id: int, interaction: UserMovieInteraction):
+        """
+        Removes from the state the interaction added last by add
+
+        Args:
+            state: state of the user
+            item_id (integer): id of the item
+            interaction (UserMovieInteraction): the interaction
+        """
+        pass
+
+    @abstractmethod
+    def pop_eviction(
+        self, state, num_interactions: int, timestamp: int
+    ) -> typing.Optional[tuple]:
+        """
+        Removes from the state the next interaction to forget
+
+        Args:
+            state: state of the user
+            num_interactions (integer): number of interactions of the user in the memory
+            timestamp (integer): timestamp of the last interaction of the user
+
+        Return:
+            (item_id, timestamp, ...) of the interaction to forget, the policy may append to the tuple what it needs
+            to undo the eviction, None if no interaction has to be forgotten
+        """
+        pass
+
+    @abstractmethod
+    def undo_pop_eviction(self, state, eviction: tuple):
+        """
+        Puts back in the state the interaction removed last by pop_eviction
+
+        Args:
+            state: state of the user
+            eviction (tuple): the value returned by pop_eviction
+        """
+        pass
+
+
+class EvictionPolicyKeepLast(EvictionPolicy):
+    """
+    Keeps the last max_interactions interactions of every user
+    """
+
+    def __init__(self, max_interactions: int = 100):
+        self.max_interactions = max_interactions
+
+    def new_state(self):
+        return deque()
+
+    def add(self, state, item_id: int, interaction: UserMovieInteraction):
+        state.append((item_id, interaction.timestamp))
+
+    def undo_add(self, state, item_id: int, interaction: UserMovieInteraction):
+        state.pop()
+
+    def pop_eviction(self, state, num_interactions: int, timestamp: int):
+        if num_interactions > self.max_interactions and state:
+            return state.popleft()
+        return None
+
+    def undo_pop_eviction(self, state, eviction: tuple):
+        state.appendleft(eviction)
+
+
+class EvictionPolicyTimeDecay(EvictionPolicy):
+    """
+    Forgets the interactions whose weight decay ** age has fallen below threshold, where the age is the number
+    of interactions of the user since the interaction
+    """
+
+    def __init__(self, decay: float = 0.99, threshold: float = 0.05):
+        self.decay = decay
+        self.threshold = threshold
+        self.max_age = math.log(threshold) / math.log(decay)
+
+    def new_state(self):
+        return deque()
+
+    def add(self, state, item_id: int, interaction: UserMovieInteraction):
+        state.append((item_id, interaction.timestamp))
+
+    def undo_add(self, state, item_id: int, interaction: UserMovieInteraction):
+        state.pop()
+
+    def pop_eviction(self, state, num_interactions: int, timestamp: int):
+        if state and timestamp - state[0][1] > self.max_age:
+            return state.popleft()
+        return None
+
+    def undo_pop_eviction(self, state, eviction: tuple):
+        state.appendleft(eviction)
+
+
+class EvictionPolicyKeepExtremes(EvictionPolicy):
+    """
+    Keeps max_interactions interactions of every user, forgetting first the interactions with the ratings
+    closest to neutral_rating (the oldest one among equal ratings), so that the best and the worst rated items are kept.
+    The interactions are grouped by rating, the ratings are a small discrete set (see RewardShaping.rating_fixing).
+    """
+
+    def __init__(self, max_interactions: int = 100, neutral_rating: float = 5.5):
+        self.max_interactions = max_interactions
+        self.neutral_rating = neutral_rating
+
+    def new_state(self):
+        return _RatingBuckets()
+
+    def add(self, state, item_id: int, interaction: UserMovieInteraction):
+        bucket = state.get(interaction.rating)
+        if bucket is None:
+            bucket = state[interaction.rating] = deque()
+        # the rating is kept to find the bucket again when the eviction is undone
+        bucket.append((item_id, interaction.timestamp, interaction.rating))
+
+    def undo_add(self, state, item_id: int, interaction: UserMovieInteraction):
+        bucket = state[interaction.rating]
+        bucket.pop()
+        if not bucket:
+            del state[interaction.rating]
+
+    def pop_eviction(self, state, num_interactions: int, timestamp: int):
+        if num_interactions <= self.max_interactions or not state:
+            return None
+        rating = min(state, key=lambda r: (abs(r - self.neutral_rating), r))
+        bucket = state[rating]
+        eviction = bucket.popleft()
+        if not bucket:
+            del state[rating]
+        return eviction
+
+    def undo_pop_eviction(self, state, eviction: tuple):
+        bucket = state.get(eviction[2])
+        if bucket is None:
+            bucket = state[eviction[2]] = deque()
+        bucket.appendleft(eviction)
+
+
+class _RatingBuckets(dict):
+    """
+    State of EvictionPolicyKeepExtremes: for every rating the interactions with that rating in cronological order
+    """
+
+
+class _UserEviction:
+    """
+    Eviction data of a user in Memory: the state of the eviction policy, the number of interactions in the memory
+    and for every item the last interaction forgotten, which keeps the number of watches and the time of the last watch
+    """
+
+    __slots__ = ("state", "num_interactions", "evicted")
+
+    def __init__(self, state):
+        self.state = state
+        self.num_interactions = 0
+        self.evicted: typing.Dict[int, UserMovieInteraction] = {}
+
+
+class _MemorySnapshot:
+    """
+    Handle returned by Memory.snapshot: the journal of the memory and its length when the snapshot was taken,
+    position is None once the snapshot is no longer valid
+    """
+
+    __slots__ = ("journal", "position", "__weakref__")
+
+    def __init__(self, journal: list):
+        self.journal = journal
+        self.position: typing.Optional[int] = len(journal)
+
+
 class Memory:
     """
     Storage of information: a mapping from item IDs to UserMovieInteraction for each user.
     This allows us to keep track of the list of items watched by the user, along with the corresponding scores provided by the user and
     others relevant information like the timestamp and number of time one watched a item.
     As convention we save in the memory for every user and item id a list of all interaction between the user and the item in cronological order.
+
+    With an eviction_policy (e.g. EvictionPolicyKeepLast) the memory forgets the interactions chosen by the policy
+    after every update, for every item the last interaction forgotten is kept, so that the number of watches and
+    the time of the previous watch (used by the reward shaping) are not lost. Use functools.partial(Memory, eviction_policy=...)
+    as memory_factory of Simulatio4RecSys.
+
+    The snapshots are kept by an undo journal: while a snapshot is referenced every change appends to the journal
+    the function that undoes it, so taking a snapshot costs O(1), a change O(1) more and restoring a snapshot
+    O(number of changes since the snapshot). Snapshots can be restored only in reverse order of creation
+    (restoring a snapshot invalidates the newer ones), the journal is dropped when no snapshot is referenced.
+
+    Attributes:
+        items_loader (ItemsLoader): the items
+        eviction_policy (EvictionPolicy, optional): policy that bounds the history of every user, by default it is not bounded
     """
 
     user_to_seen_films: typing.Dict[
         int, typing.Dict[int, typing.List[UserMovieInteraction]]
     ]
 
-    def __init__(self, items_loader):
+    def __init__(self, items_loader, eviction_policy: EvictionPolicy = None):
         self.user_to_seen_films = {}
         self.user_num_items_interact = {}
         self.items_loader = items_loader
+        """
+        The items seen by every user with their last interaction are kept in a _UserHistoryView, updated by update_memory
+        and by the delete methods, the items are loaded once and cached.
+        """
+        self._user_views: typing.Dict[int, _UserHistoryView] = {}
+        self._items_cache = {}
+        self.eviction_policy = eviction_policy
+        self._user_evictions: typing.Dict[int, _UserEviction] = {}
+        # undo journal, None when no snapshot is referenced, and the snapshots taken on it
+        self._journal: typing.Optional[list] = None
+        self._snapshots: "weakref.WeakSet[_MemorySnapshot]" = weakref.WeakSet()
+
+    def _get_journal(self) -> typing.Optional[list]:
+        """
+        Return the journal the changes have to be appended to, None if no snapshot is referenced
+        """
+        if self._journal is not None and not self._snapshots:
+            self._journal = None
+        return self._journal
+
+    def _load_item(self, item_id: int):
+        item = self._items_cache.get(item_id)
+        if item is None:
+            item = self.items_loader.load_items_from_ids(id_list=[item_id])[0]
+            self._items_cache[item_id] = item
+        return item
 
     def update_memory(
         self, user_id: int, items_ids: typing.List[int], scores: typing.List[float]
@@ -47,22 +440,119 @@ class Memory:
         """
         if user_id not in self.user_to_seen_films:
             self._initialize_user(user_id)
+        journal = self._get_journal()
+        seen_films = self.user_to_seen_films[user_id]
+        view = self._user_views[user_id]
+        eviction = self._user_evictions.get(user_id)
         for i, item_id in enumerate(items_ids):
-            self.user_num_items_interact[user_id] += 1
-            if item_id in self.user_to_seen_films[user_id]:
-                self.user_to_seen_films[user_id][item_id].append(
-                    UserMovieInteraction(
-                        scores[i],
-                        self.user_num_items_interact[user_id],
-                        len(self.user_to_seen_films[user_id][item_id]) + 1,
-                    )
+            timestamp = self.user_num_items_interact[user_id] + 1
+            _set_logged(journal, self.user_num_items_interact, user_id, timestamp)
+            last_interaction = self._get_last_interaction(user_id, item_id)
+            interaction = UserMovieInteraction(
+                scores[i],
+                timestamp,
+                1 if last_interaction is None else last_interaction.num_watches + 1,
+            )
+            if item_id in seen_films:
+                # The list is replaced and not appended to, since it may have been returned by get_item_interactions
+                _set_logged(
+                    journal, seen_films, item_id, seen_films[item_id] + [interaction]
                 )
+                view.set_interaction(item_id, interaction, journal)
             else:
-                self.user_to_seen_films[user_id][item_id] = [
-                    UserMovieInteraction(
-                        scores[i], self.user_num_items_interact[user_id], 1
+                _set_logged(journal, seen_films, item_id, [interaction])
+                view.add(item_id, self._load_item(item_id), interaction, journal)
+            if eviction is not None:
+                _setattr_logged(
+                    journal, eviction, "num_interactions", eviction.num_interactions + 1
+                )
+                self.eviction_policy.add(eviction.state, item_id, interaction)
+                if journal is not None:
+                    journal.append(
+                        functools.partial(
+                            self.eviction_policy.undo_add,
+                            eviction.state,
+                            item_id,
+                            interaction,
+                        )
                     )
-                ]
+                self._evict_interactions(user_id, eviction, journal)
+
+    def _evict_interactions(
+        self,
+        user_id: int,
+        eviction: _UserEviction,
+        journal: typing.Optional[list] = None,
+    ):
+        """
+        Forgets the interactions of the user chosen by the eviction policy
+
+        Args:
+            user_id (integer): id of a user
+            eviction (_UserEviction): eviction data of the user
+            journal (list, optional): journal the changes are logged to
+        """
+        seen_films = self.user_to_seen_films[user_id]
+        view = self._user_views[user_id]
+        while True:
+            proposal = self.eviction_policy.pop_eviction(
+                eviction.state,
+                eviction.num_interactions,
+                self.user_num_items_interact[user_id],
+            )
+            if proposal is None:
+                return
+            if journal is not None:
+                journal.append(
+                    functools.partial(
+                        self.eviction_policy.undo_pop_eviction, eviction.state, proposal
+                    )
+                )
+            item_id, timestamp = proposal[0], proposal[1]
+            interactions = seen_films.get(item_id, [])
+            position = next(
+                (i for i, x in enumerate(interactions) if x.timestamp == timestamp),
+                None,
+            )
+            # the interaction has been deleted in the meantime
+            if position is None:
+                continue
+            forgotten = interactions[position]
+            evicted = eviction.evicted.get(item_id)
+            if evicted is None or evicted.timestamp < forgotten.timestamp:
+                _set_logged(journal, eviction.evicted, item_id, forgotten)
+            _setattr_logged(
+                journal, eviction, "num_interactions", eviction.num_interactions - 1
+            )
+            if len(interactions) == 1:
+                _set_logged(journal, seen_films, item_id, None)
+                view.remove(item_id, journal)
+            else:
+                _set_logged(
+                    journal,
+                    seen_films,
+                    item_id,
+                    interactions[:position] + interactions[position + 1 :],
+                )
+                view.set_interaction(item_id, seen_films[item_id][-1], journal)
+
+    def _get_last_interaction(
+        self, user_id: int, item_id: int
+    ) -> typing.Optional[UserMovieInteraction]:
+        """
+        Return the last interaction of the user with the item, including the interactions forgotten, None if there is none
+        """
+        interactions = self.user_to_seen_films.get(user_id, {}).get(item_id)
+        last_interaction = interactions[-1] if interactions else None
+        eviction = self._user_evictions.get(user_id)
+        if eviction is not None:
+            evicted = eviction.evicted.get(item_id)
+            if evicted is not None and (
+                last_interaction is None
+                or evicted.timestamp > last_interaction.timestamp
+            ):
+                last_interaction = evicted
+        return last_interaction
 
     def _initialize_user(self, user_id: int):
         """
@@ -74,8 +564,33 @@ class Memory:
         Return:
             None
         """
-        self.user_to_seen_films[user_id] = {}
-        self.user_num_items_interact[user_id] = 0
+        journal = self._get_journal()
+        _set_logged(journal, self.user_to_seen_films, user_id, {})
+        _set_logged(journal, self.user_num_items_interact, user_id, 0)
+        _set_logged(journal, self._user_views, user_id, _UserHistoryView())
+        if self.eviction_policy is not None:
+            _set_logged(
+                journal,
+                self._user_evictions,
+                user_id,
+                _UserEviction(self.eviction_policy.new_state()),
+            )
+
+    def _remove_user(self, user_id: int):
+        """
+        Removes all the data of a user from the dictionaries of the memory
+
+        Args:
+            user_id (integer): id of a user
+        """
+        journal = self._get_journal()
+        for users in (
+            self.user_to_seen_films,
+            self.user_num_items_interact,
+            self._user_views,
+            self._user_evictions,
+        ):
+            _set_logged(journal, users, user_id, None)
 
     def _get_items_ids_and_interactions(self, user_id: int):
         """
@@ -101,19 +616,16 @@ class Memory:
 
     def get_items_and_scores(self, user_id: int):
         """
-        Uses internal function _get_items_ids_and_scores to return a
-        list of Movie object with correspective scores
+        Return the list of Movie objects seen by the user, in order of first interaction, with the correspective
+        last interactions, read from the view of the history of the user without loading the items again
 
         Args:
             user_id (integer): id of a user
         """
-        list_items_ids, list_interactions = self._get_items_ids_and_interactions(
-            user_id
-        )
-        return (
-            self.items_loader.load_items_from_ids(list_items_ids),
-            list_interactions,
-        )
+        if user_id not in self.user_to_seen_films:
+            self._initialize_user(user_id)
+            return [], []
+        return self._user_views[user_id].get_items_and_interactions()
 
     def delete_user_item(self, user_id: int, item_id: int):
         """
@@ -124,20 +636,61 @@ class Memory:
             user_id (integer): user from which we want to delete a item
             item_id (integer): id of the item we want to delete
         """
-        del self.user_to_seen_films[user_id][item_id]
+        journal = self._get_journal()
+        seen_films = self.user_to_seen_films[user_id]
+        eviction = self._user_evictions.get(user_id)
+        if eviction is not None:
+            forgotten = eviction.evicted.get(item_id)
+            _set_logged(journal, eviction.evicted, item_id, None)
+            if forgotten is not None and item_id not in seen_films:
+                return
+            _setattr_logged(
+                journal,
+                eviction,
+                "num_interactions",
+                eviction.num_interactions - len(seen_films.get(item_id, [])),
+            )
+        if item_id not in seen_films:
+            raise KeyError(item_id)
+        _set_logged(journal, seen_films, item_id, None)
+        self._user_views[user_id].remove(item_id, journal)
 
     def delete_last_user_item_interaction(self, user_id: int, item_id: int):
         """
         The function is designed to remove the last user item interaction from the memory,
         effectively simulating the act of forgetting that a particular user has watched a specific item last time.
+        With an eviction policy only the last interaction forgotten by the policy is kept, if it is deleted
+        the previous interactions forgotten are lost.
 
         Args:
             user_id (integer): user from which we want to delete a item
             item_id (integer): id of the item we want to delete
         """
-        self.user_to_seen_films[user_id][item_id].pop()
-        if self.user_to_seen_films[user_id][item_id] == []:
-            self.delete_user_item(user_id, item_id)
+        journal = self._get_journal()
+        seen_films = self.user_to_seen_films[user_id]
+        eviction = self._user_evictions.get(user_id)
+        if eviction is not None:
+            last_interaction = self._get_last_interaction(user_id, item_id)
+            if (
+                last_interaction is not None
+                and last_interaction is eviction.evicted.get(item_id)
+            ):
+                # the last interaction has already been forgotten by the eviction policy
+                _set_logged(journal, eviction.evicted, item_id, None)
+                return
+        interactions = seen_films[item_id][:-1]
+        if eviction is not None:
+            _setattr_logged(
+                journal, eviction, "num_interactions", eviction.num_interactions - 1
+            )
+        if interactions == []:
+            _set_logged(journal, seen_films, item_id, None)
+            self._user_views[user_id].remove(item_id, journal)
+        else:
+            _set_logged(journal, seen_films, item_id, interactions)
+            self._user_views[user_id].set_interaction(
+                item_id, interactions[-1], journal
+            )
 
     def get_num_interaction(self, user_id: int, item_id: int):
         """
@@ -147,6 +700,297 @@ class Memory:
             user_id (integer): user from which we want to delete a item
             item_id (integer): id of the item we want to delete
         """
-        if int(item_id) not in self.user_to_seen_films[user_id]:
+        last_interaction = self._get_last_interaction(user_id, int(item_id))
+        return 0 if last_interaction is None else last_interaction.num_watches
+
+    def get_item_interactions(
+        self, user_id: int, item_id: int
+    ) -> typing.List[UserMovieInteraction]:
+        """
+        Return all the interactions of a user with a item, in cronological order, with an eviction policy
+        the interactions in the memory and the last interaction forgotten
+
+        Args:
+            user_id (integer): id of a user
+            item_id (integer): id of a item
+
+        Return:
+            list of UserMovieInteraction, empty if the user never interacted with the item
+        """
+        interactions = self.user_to_seen_films.get(user_id, {}).get(item_id, [])
+        eviction = self._user_evictions.get(user_id)
+        if eviction is None or item_id not in eviction.evicted:
+            return interactions
+        return sorted(
+            interactions + [eviction.evicted[item_id]], key=lambda x: x.timestamp
+        )
+
+    def get_num_items_interact(self, user_id: int) -> int:
+        """
+        Return the number of interactions of a user, the timestamp of the last interaction
+
+        Args:
+            user_id (integer): id of a user
+        """
+        return self.user_num_items_interact.get(user_id, 0)
+
+    def snapshot(self):
+        """
+        Take a snapshot of the memory in O(1): from now on the changes are logged to the undo journal,
+        as long as the snapshot is referenced.
+
+        Return:
+            snapshot (_MemorySnapshot): handle to pass to restore
+        """
+        if self._get_journal() is None:
+            self._journal = []
+        snapshot = _MemorySnapshot(self._journal)
+        self._snapshots.add(snapshot)
+        return snapshot
+
+    def restore(self, snapshot):
+        """
+        Bring the memory back to the state it had when snapshot was taken, undoing the changes logged since then.
+        The snapshot can be restored again later as long as no older snapshot has been restored in the meantime.
+
+        Args:
+            snapshot (_MemorySnapshot): handle returned by snapshot
+        """
+        if snapshot.position is None or snapshot.journal is not self._get_journal():
+            raise ValueError(
+                "The snapshot is no longer valid, an older snapshot was restored"
+            )
+        journal = self._journal
+        while len(journal) > snapshot.position:
+            journal.pop()()
+        for other in list(self._snapshots):
+            if other.position > snapshot.position:
+                other.position = None
+                self._snapshots.discard(other)
+
+
+class _UserColumns:
+    """
+    History of a user in ColumnarMemory: one row per interaction, in cronological order, stored in growable typed columns.
+    prev_rows contains the row of the previous interaction of the user with the same item (-1 for the first one),
+    last_rows maps every item to the row of its last interaction, in order of first interaction as the dictionaries of Memory.
+    """
+
+    __slots__ = (
+        "item_ids",
+        "ratings",
+        "timestamps",
+        "num_watches",
+        "prev_rows",
+        "size",
+        "last_rows",
+        "num_items_interact",
+    )
+
+    def __init__(self, capacity: int = 16):
+        self.item_ids = np.empty(capacity, dtype=np.int32)
+        self.ratings = np.empty(capacity, dtype=np.float32)
+        self.timestamps = np.empty(capacity, dtype=np.uint32)
+        self.num_watches = np.empty(capacity, dtype=np.uint16)
+        self.prev_rows = np.empty(capacity, dtype=np.int32)
+        self.size = 0
+        self.last_rows: typing.Dict[int, int] = {}
+        self.num_items_interact = 0
+
+    def copy(self) -> "_UserColumns":
+        columns = _UserColumns.__new__(_UserColumns)
+        for name in ("item_ids", "ratings", "timestamps", "num_watches", "prev_rows"):
+            setattr(columns, name, getattr(self, name).copy())
+        columns.size = self.size
+        columns.last_rows = dict(self.last_rows)
+        columns.num_items_interact = self.num_items_interact
+        return columns
+
+    def append(self, item_id: int, rating: float):
+        if self.size == len(self.item_ids):
+            for name in (
+                "item_ids",
+                "ratings",
+                "timestamps",
+                "num_watches",
+                "prev_rows",
+            ):
+                column = getattr(self, name)
+                grown = np.empty(2 * len(column), dtype=column.dtype)
+                grown[: self.size] = column[: self.size]
+                setattr(self, name, grown)
+        self.num_items_interact += 1
+        row = self.size
+        prev_row = self.last_rows.get(item_id, -1)
+        self.item_ids[row] = item_id
+        self.ratings[row] = rating
+        self.timestamps[row] = self.num_items_interact
+        self.num_watches[row] = self.num_watches[prev_row] + 1 if prev_row >= 0 else 1
+        self.prev_rows[row] = prev_row
+        self.last_rows[item_id] = row
+        self.size += 1
+
+    def remove_rows(self, rows: typing.List[int]):
+        """
+        Removes some rows compacting the columns, the rows of last_rows and prev_rows are renumbered
+        """
+        keep = np.ones(self.size, dtype=bool)
+        keep[rows] = False
+        new_rows = np.cumsum(keep, dtype=np.int32) - 1
+        new_rows = np.append(new_rows, -1)  # the row -1 stays -1
+        for name in ("item_ids", "ratings", "timestamps", "num_watches", "prev_rows"):
+            column = getattr(self, name)
+            kept = column[: self.size][keep]
+            column[: len(kept)] = kept
+        self.size = int(keep.sum())
+        self.prev_rows[: self.size] = new_rows[self.prev_rows[: self.size]]
+        for item_id, row in self.last_rows.items():
+            self.last_rows[item_id] = int(new_rows[row])
+
+    def get_interaction(self, row: int) -> UserMovieInteraction:
+        return UserMovieInteraction(
+            float(self.ratings[row]),
+            int(self.timestamps[row]),
+            int(self.num_watches[row]),
+        )
+
+
+class ColumnarMemory:
+    """
+    Memory backend with the same interface of Memory, that stores the history of every user in typed columns
+    (item id as int32, rating as float32, timestamp as uint32 and watch count as uint16) instead of one UserMovieInteraction
+    per interaction, about 18 bytes per interaction. The last interaction of every item is found in O(1) by an index,
+    and get_columns exposes the history of a user as numpy views.
+    The UserMovieInteraction objects returned by get_items_and_scores and get_item_interactions are built on demand.
+    """
+
+    def __init__(self, items_loader):
+        self.items_loader = items_loader
+        self.users: typing.Dict[int, _UserColumns] = {}
+        # users whose columns are shared with a snapshot, they are copied before being modified
+        self._shared_users = set()
+
+    def _get_user(self, user_id: int) -> _UserColumns:
+        if user_id not in self.users:
+            self.users[user_id] = _UserColumns()
+        return self.users[user_id]
+
+    def _get_user_for_write(self, user_id: int) -> _UserColumns:
+        if user_id in self._shared_users:
+            self.users[user_id] = self.users[user_id].copy()
+            self._shared_users.discard(user_id)
+        return self._get_user(user_id)
+
+    def update_memory(
+        self, user_id: int, items_ids: typing.List[int], scores: typing.List[float]
+    ):
+        """
+        Updates the memory for a given user with respect to new item IDs and scores, see Memory.update_memory
+        """
+        user = self._get_user_for_write(user_id)
+        for item_id, score in zip(items_ids, scores):
+            user.append(int(item_id), score)
+
+    def get_items_and_scores(self, user_id: int):
+        """
+        Return the items seen by the user, in order of first interaction, with their last interaction, see Memory.get_items_and_scores
+        """
+        user = self._get_user(user_id)
+        return (
+            self.items_loader.load_items_from_ids(list(user.last_rows)),
+            [user.get_interaction(row) for row in user.last_rows.values()],
+        )
+
+    def get_columns(self, user_id: int) -> typing.Dict[str, np.ndarray]:
+        """
+        Return the whole history of a user in cronological order, as read-only views of the columns
+        (item_ids, ratings, timestamps and num_watches), valid until the next modification of the memory
+
+        Args:
+            user_id (integer): id of a user
+        """
+        user = self._get_user(user_id)
+        columns = {}
+        for name in ("item_ids", "ratings", "timestamps", "num_watches"):
+            view = getattr(user, name)[: user.size]
+            view.flags.writeable = False
+            columns[name] = view
+        return columns
+
+    def delete_user_item(self, user_id: int, item_id: int):
+        """
+        Removes all the interactions of the user with the item, see Memory.delete_user_item
+        """
+        user = self._get_user_for_write(user_id)
+        rows = []
+        row = user.last_rows.pop(item_id)
+        while row >= 0:
+            rows.append(row)
+            row = int(user.prev_rows[row])
+        user.remove_rows(rows)
+
+    def delete_last_user_item_interaction(self, user_id: int, item_id: int):
+        """
+        Removes the last interaction of the user with the item, see Memory.delete_last_user_item_interaction
+        """
+        user = self._get_user_for_write(user_id)
+        row = user.last_rows[item_id]
+        prev_row = int(user.prev_rows[row])
+        if prev_row < 0:
+            del user.last_rows[item_id]
+        else:
+            user.last_rows[item_id] = prev_row
+        user.remove_rows([row])
+
+    def get_num_interaction(self, user_id: int, item_id: int):
+        """
+        Return the number of times a user has watched a item
+        """
+        user = self.users.get(user_id)
+        if user is None or int(item_id) not in user.last_rows:
             return 0
-        return self.user_to_seen_films[user_id][item_id][-1].num_watches
+        return int(user.num_watches[user.last_rows[int(item_id)]])
+
+    def get_item_interactions(
+        self, user_id: int, item_id: int
+    ) -> typing.List[UserMovieInteraction]:
+        """
+        Return all the interactions of a user with a item, in cronological order
+        """
+        user = self.users.get(user_id)
+        if user is None or item_id not in user.last_rows:
+            return []
+        interactions = []
+        row = user.last_rows[item_id]
+        while row >= 0:
+            interactions.append(user.get_interaction(row))
+            row = int(user.prev_rows[row])
+        return interactions[::-1]
+
+    def get_num_items_interact(self, user_id: int) -> int:
+        """
+        Return the number of interactions of a user, the timestamp of the last interaction
+        """
+        user = self.users.get(user_id)
+        return 0 if user is None else user.num_items_interact
+
+    def snapshot(self):
+        """
+        Take a copy-on-write snapshot of the memory, the columns of a user are copied the first time they are modified
+        after the snapshot
+
+        Return:
+            snapshot (dictionary): handle to pass to restore
+        """
+        self._shared_users = set(self.users)
+        return dict(self.users)
+
+    def restore(self, snapshot):
+        """
+        Bring the memory back to the state it had when snapshot was taken, the snapshot can be restored again later.
+
+        Args:
+            snapshot (dictionary): handle returned by snapshot
+        """
+        self.users = dict(snapshot)
+        self._shared_users = set(self.users)
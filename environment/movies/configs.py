@@ -1,10 +1,13 @@
 import argparse
 import os
+from functools import partial
 
 from environment import LLM
 from environment.movies.movies_loader import MoviesLoader
 from ..env import Simulatio4RecSys
-from ..users import UsersCSVLoader
+from ..vector_env import BatchedSimulatio4RecSys
+from ..fork_server import ForkServer, ForkServerVectorEnv
+from ..users import UsersCSVLoader, UsersListLoader
 from ..items_retrieval import (
     SentenceSimilarityItemsRetrieval,
     SimpleMoviesRetrieval,
@@ -37,7 +40,6 @@ from environment.reward_shaping import (
 
 from gymnasium.utils.env_checker import check_env
 
-
 # Single module loading utils
 OPTIONS_LLM_RATER = [
     "2Shot_system_our",
@@ -279,22 +281,35 @@ def get_base_parser():
     return parser
 
 
+def get_items_loader(args):
+    return MoviesLoader(
+        os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "./datasets/",
+            args.film_dataset + ".json",
+        )
+    )
+
+
 def get_enviroment_from_args(
-    llm, args, seed=None, render_mode=None, render_path=None, eval_mode=False
+    llm,
+    args,
+    seed=None,
+    render_mode=None,
+    render_path=None,
+    eval_mode=False,
+    items_loader=None,
+    eval_first_user_id=0,
 ):
     """Returns the environment with the configuration specified in args."""
     if seed is None:
         seed = args.seed
+    if items_loader is None:
+        items_loader = get_items_loader(args)
     env = Simulatio4RecSys(
         render_mode=render_mode,
         render_path=render_path,
-        items_loader=MoviesLoader(
-            os.path.join(
-                os.path.dirname(os.path.realpath(__file__)),
-                "./datasets/",
-                args.film_dataset + ".json",
-            )
-        ),
+        items_loader=items_loader,
         users_loader=get_user_dataset(args.user_dataset),
         items_selector=GreedySelector(seed),
         reward_perturbator=get_reward_perturbator(args.perturbator, seed),
@@ -304,6 +319,99 @@ def get_enviroment_from_args(
         ),
         reward_shaping=get_reward_shaping(args.reward_shaping, seed),
         evaluation=eval_mode,
+        evaluation_first_user_id=eval_first_user_id,
     )
     env.reset(seed=seed)
     return env
+
+
+def get_enviroment_factory_from_args(llm, args, seed=None):
+    """
+    Returns a function make_env(i) that creates an environment configured as specified in args and seeded with seed + i,
+    all the environments created share the items dataset, the users and the LLM rater.
+    """
+    if seed is None:
+        seed = args.seed
+    items_loader = get_items_loader(args)
+    llm_rater = get_llm_rater(
+        args.llm_rater, llm, history=args.items_retrieval != "none"
+    )
+    users_loader = get_user_dataset(args.user_dataset)
+
+    def make_env(i):
+        env = Simulatio4RecSys(
+            render_mode=None,
+            items_loader=items_loader,
+            users_loader=users_loader,
+            items_selector=GreedySelector(seed + i),
+            reward_perturbator=get_reward_perturbator(args.perturbator, seed + i),
+            items_retrieval=get_items_retrieval(args.items_retrieval),
+            llm_rater=llm_rater,
+            reward_shaping=get_reward_shaping(args.reward_shaping, seed + i),
+        )
+        env.reset(seed=seed + i)
+        return env
+
+    return make_env
+
+
+def get_batched_enviroment_from_args(llm, args, num_envs, seed=None):
+    """
+    Returns a BatchedSimulatio4RecSys with num_envs sessions configured as specified in args,
+    the sessions share the items dataset and the LLM rater, session i is seeded with seed + i.
+    """
+    make_env = get_enviroment_factory_from_args(llm, args, seed)
+    return BatchedSimulatio4RecSys([partial(make_env, i) for i in range(num_envs)])
+
+
+def load_shared_from_args(args, share_llm=True):
+    """
+    Loads the items dataset, the users and, if share_llm is True, the LLM specified in args,
+    the data shared by the workers of a ForkServer
+    """
+    items_loader = get_items_loader(args)
+    users_loader = UsersListLoader(get_user_dataset(args.user_dataset).get_users())
+    llm = LLM.load_LLM(args.llm_model) if share_llm else None
+    return items_loader, users_loader, llm
+
+
+def make_env_from_shared(args, seed, shared, i):
+    """
+    Creates, in a worker of a ForkServer, the i-th environment configured as specified in args and seeded with seed + i,
+    the LLM is the one loaded by the fork server, or it is loaded by the worker if it is not shared.
+    """
+    items_loader, users_loader, llm = shared
+    if llm is None:
+        llm = LLM.load_LLM(args.llm_model)
+    env = Simulatio4RecSys(
+        render_mode=None,
+        items_loader=items_loader,
+        users_loader=users_loader,
+        items_selector=GreedySelector(seed + i),
+        reward_perturbator=get_reward_perturbator(args.perturbator, seed + i),
+        items_retrieval=get_items_retrieval(args.items_retrieval),
+        llm_rater=get_llm_rater(
+            args.llm_rater, llm, history=args.items_retrieval != "none"
+        ),
+        reward_shaping=get_reward_shaping(args.reward_shaping, seed + i),
+    )
+    env.reset(seed=seed + i)
+    return env
+
+
+def get_fork_server_enviroment_from_args(args, num_envs, seed=None, share_llm=True):
+    """
+    Returns a ForkServerVectorEnv with num_envs environments configured as specified in args,
+    the items dataset, the users and the LLM are loaded once by the fork server, before forking, and shared by all the workers,
+    environment i is seeded with seed + i. Call it before loading the LLM in the current process,
+    close the environment and then its fork_server when done.
+    CUDA can not be used by a process forked after initializing it, the LLM can therefore be shared only if loading it
+    does not initialize CUDA (e.g. the OpenAI models), with share_llm=False every worker loads its own LLM.
+    """
+    if seed is None:
+        seed = args.seed
+    fork_server = ForkServer(
+        partial(load_shared_from_args, args, share_llm),
+        partial(make_env_from_shared, args, seed),
+    )
+    return ForkServerVectorEnv(fork_server, num_envs)
@@ -0,0 +1,291 @@
+import heapq
+import typing
+
+import numpy as np
+
+from environment.item import ItemsLoader
+from environment.items_retrieval import ItemsRetrieval
+from environment.LLM import LLMRater, RatingQuery, seeded_request
+from environment.memory import Memory
+from environment.reward_perturbator import RewardPerturbator
+from environment.reward_shaping import RewardShaping
+from environment.users import User, UsersLoader
+
+_ARRIVAL = 0
+_RECOMMEND = 1
+_RATED = 2
+
+
+class UserSession:
+    """
+    Session of a user in the population simulator, from the arrival of the user to the churn
+
+    Attributes:
+        user (User): the user
+        arrival_time (float): simulated time of arrival
+        churn_time (float): simulated time of churn, None while the session is active
+        items_interact (list of tuples): (action, rating) of every interaction of the session
+        total_reward (float): sum of the rewards of the session
+    """
+
+    def __init__(self, user: User, arrival_time: float):
+        self.user = user
+        self.arrival_time = arrival_time
+        self.churn_time = None
+        self.items_interact: typing.List[typing.Tuple[int, float]] = []
+        self.total_reward = 0.0
+
+
+class PopulationSimulator:
+    """
+    Event-driven simulation of a population of users in simulated time. Users arrive following a Poisson process,
+    ask for a recommendation, wait for a think time after every interaction and churn with probability churn_probability
+    after every interaction (or when the reward shaping asks to terminate), as in Simulatio4RecSys.
+    The events are kept in a priority queue ordered by simulated time. The users waiting for a recommendation are pooled:
+    the policy is called once for all of them and all their rating requests are sent to the LLM in a single batch,
+    the batch is flushed when it has batch_size requests or when the oldest request has waited max_batch_wait.
+
+    The memory of the users is kept across sessions, a user that comes back remembers the previous interactions.
+
+    Attributes:
+        items_loader (ItemsLoader): the items
+        users_loader (UsersLoader): the users
+        items_retrieval (ItemsRetrieval): retrieval of the past items included in the prompt
+        llm_rater (LLMRater): the rater
+        policy (callable): given a list of UserSession returns the action to recommend to every session
+        reward_perturbator (RewardPerturbator, optional): perturbation of the rating, no perturbation if None
+        reward_shaping (RewardShaping, optional): reshaping of the reward, no reshaping if None
+        memory_factory (callable): memory_factory(items_loader) returns the memory of the users, e.g. a TieredMemory
+            for large populations
+        arrival_rate (float): mean number of users arriving per unit of simulated time
+        mean_think_time (float): mean simulated time between the end of an interaction and the next request
+        churn_probability (float): probability that a user leaves after every interaction
+        rating_latency (float): simulated time between the flush of a batch and the delivery of the ratings
+        batch_size (integer): maximum number of rating requests of a batch
+        max_batch_wait (float): maximum simulated time a request waits for the batch to fill up
+        seed (integer): seed of the simulation and of the LLM
+    """
+
+    def __init__(
+        self,
+        items_loader: ItemsLoader,
+        users_loader: UsersLoader,
+        items_retrieval: ItemsRetrieval,
+        llm_rater: LLMRater,
+        policy: typing.Callable[[typing.List[UserSession]], typing.List[int]],
+        reward_perturbator: RewardPerturbator = None,
+        reward_shaping: RewardShaping = None,
+        memory_factory: typing.Callable[[ItemsLoader], Memory] = Memory,
+        arrival_rate: float = 1.0,
+        mean_think_time: float = 1.0,
+        churn_probability: float = 0.025,
+        rating_latency: float = 0.0,
+        batch_size: int = 64,
+        max_batch_wait: float = 0.0,
+        seed: int = 42,
+    ):
+        self.items_loader = items_loader
+        self.items_retrieval = items_retrieval
+        self.rating_prompt = llm_rater
+        self.policy = policy
+        self.reward_perturbator = reward_perturbator
+        self.reward_shaping = reward_shaping
+
+        self.user_list = users_loader.get_users()
+        self.num_users = len(self.user_list)
+        self.item_ids = items_loader.load_all_ids()
+        self.num_items = len(self.item_ids)
+        self.action_to_item = {action: id for action, id in enumerate(self.item_ids)}
+
+        self.arrival_rate = arrival_rate
+        self.mean_think_time = mean_think_time
+        self.churn_probability = churn_probability
+        self.rating_latency = rating_latency
+        self.batch_size = batch_size
+        self.max_batch_wait = max_batch_wait
+
+        self.rng = np.random.default_rng(seed)
+        self.llm_seed = seed
+        self.memory = memory_factory(items_loader)
+
+        self.time = 0.0
+        self._events = []
+        self._events_count = 0
+        self._active_users = set()
+        self._waiting: typing.List[typing.Tuple[float, UserSession]] = []
+        self.finished_sessions: typing.List[UserSession] = []
+        self.num_ratings = 0
+        self.batches_sizes: typing.List[int] = []
+
+        self._push(self.rng.exponential(1 / self.arrival_rate), _ARRIVAL, None)
+
+    def _push(self, time: float, event: int, session: typing.Optional[UserSession]):
+        # the counter keeps the order of the events with the same time and avoids comparing sessions
+        heapq.heappush(self._events, (time, self._events_count, event, session))
+        self._events_count += 1
+
+    def run(
+        self, until: float = float("inf"), max_ratings: int = None
+    ) -> typing.Dict[str, float]:
+        """
+        Advances the simulation until the simulated time until, or until max_ratings more ratings have been delivered
+
+        Args:
+            until (float): simulated time at which the simulation stops
+            max_ratings (integer, optional): number of ratings after which the simulation stops
+
+        Return:
+            the statistics of the simulation, see stats
+        """
+        if until == float("inf") and max_ratings is None:
+            raise ValueError(
+                "Users keep arriving, either until or max_ratings is needed"
+            )
+        if max_ratings is not None:
+            max_ratings += self.num_ratings
+
+        while max_ratings is None or self.num_ratings < max_ratings:
+            next_time = self._events[0][0]
+            if self._waiting:
+                full = len(self._waiting) >= self.batch_size
+                deadline = self._waiting[0][0] + self.max_batch_wait
+                if full or deadline < next_time:
+                    if not full:
+                        self.time = max(self.time, deadline)
+                    if self.time > until:
+                        self.time = until
+                        break
+                    self._flush()
+                    continue
+
+            if next_time > until:
+                self.time = until
+                break
+            self.time, _, event, session = heapq.heappop(self._events)
+            if event == _ARRIVAL:
+                self._arrival()
+            elif event == _RECOMMEND:
+                self._waiting.append((self.time, session))
+            else:
+                self._rated(*session)
+        return self.stats()
+
+    def _arrival(self):
+        """
+        A user that is not already active arrives and asks for a recommendation, the next arrival is scheduled
+        """
+        self._push(
+            self.time + self.rng.exponential(1 / self.arrival_rate), _ARRIVAL, None
+        )
+        if len(self._active_users) == self.num_users:
+            return
+        user_id = int(self.rng.integers(self.num_users))
+        while user_id in self._active_users:
+            user_id = int(self.rng.integers(self.num_users))
+        self._active_users.add(user_id)
+        self._push(
+            self.time, _RECOMMEND, UserSession(self.user_list[user_id], self.time)
+        )
+
+    def _flush(self):
+        """
+        Sends the pooled rating requests to the LLM in a single batch, the ratings are delivered after rating_latency
+        """
+        waiting = self._waiting[: self.batch_size]
+        self._waiting = self._waiting[self.batch_size :]
+        sessions = [session for _, session in waiting]
+
+        actions = self.policy(sessions)
+        queries = [
+            self._build_rating_query(session.user, action)
+            for session, action in zip(sessions, actions)
+        ]
+        with seeded_request(self.rating_prompt.llm, self.llm_seed):
+            results = self.rating_prompt.query_batch(queries)
+        self.llm_seed += 1
+        self.batches_sizes.append(len(queries))
+
+        for session, action, query, (rating, _, _) in zip(
+            sessions, actions, queries, results
+        ):
+            self._push(
+                self.time + self.rating_latency,
+                _RATED,
+                (session, action, query.item, rating),
+            )
+
+    def _build_rating_query(self, user: User, action: int) -> RatingQuery:
+        """
+        Builds the query to rate the item corresponding to action for user, as Simulatio4RecSys does
+        """
+        item_id = self.action_to_item[action]
+        curr_item = self.items_loader.load_items_from_ids(id_list=[item_id])[0]
+        past_items, past_interactions = self.memory.get_items_and_scores(user.id)
+        num_interacted = self.memory.get_num_interaction(user.id, item_id)
+        retrieved_items, retrieved_interactions = self.items_retrieval.retrieve(
+            curr_item, past_items, past_interactions
+        )
+        return RatingQuery(
+            user, curr_item, num_interacted, retrieved_interactions, retrieved_items
+        )
+
+    def _rated(self, session: UserSession, action: int, item, rating: float):
+        """
+        Delivers a rating: the memory of the user is updated, the reward is computed and the user either churns
+        or asks for the next recommendation after a think time
+        """
+        if self.reward_perturbator is not None:
+            _, ratings = self.reward_perturbator.perturb([item], [rating])
+            rating = ratings[0]
+        user_id = session.user.id
+        self.memory.update_memory(user_id, [item.id], [rating])
+
+        reward, termination = rating, False
+        if self.reward_shaping is not None:
+            reward, termination = self.reward_shaping.reshape(
+                self.memory.get_item_interactions(user_id, item.id), rating
+            )
+        session.items_interact.append((action, rating))
+        session.total_reward += reward
+        self.num_ratings += 1
+
+        if termination or self.rng.random() < self.churn_probability:
+            session.churn_time = self.time
+            self._active_users.discard(user_id)
+            self.finished_sessions.append(session)
+        else:
+            self._push(
+                self.time + self.rng.exponential(self.mean_think_time),
+                _RECOMMEND,
+                session,
+            )
+
+    def stats(self) -> typing.Dict[str, float]:
+        """
+        Statistics of the simulation
+
+        Return:
+            dictionary with the simulated time, the number of ratings delivered, the number of active users,
+            the number of finished sessions with their mean reward and length, the number of batches sent to the LLM
+            and their mean size
+        """
+        return {
+            "time": self.time,
+            "num_ratings": self.num_ratings,
+            "active_users": len(self._active_users),
+            "finished_sessions": len(self.finished_sessions),
+            "mean_session_reward": (
+                float(np.mean([s.total_reward for s in self.finished_sessions]))
+                if self.finished_sessions
+                else 0.0
+            ),
+            "mean_session_length": (
+                float(np.mean([len(s.items_interact) for s in self.finished_sessions]))
+                if self.finished_sessions
+                else 0.0
+            ),
+            "num_batches": len(self.batches_sizes),
+            "mean_batch_size": (
+                float(np.mean(self.batches_sizes)) if self.batches_sizes else 0.0
+            ),
+        }
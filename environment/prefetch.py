@@ -0,0 +1,162 @@
+import threading
+import typing
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import gymnasium as gym
+
+from environment.LLM import LLMRater, RatingQuery, seeded_request
+
+
+class RatingPrefetcher:
+    """
+    Computes in a background thread the ratings of the actions a policy is likely to take in the next step,
+    while the learner is busy. The ratings are computed with the seed the next step will use and kept in a bounded cache,
+    that Simulatio4RecSys.step consults before querying the LLM. An entry is found only if the prompts and the seed are
+    exactly the ones of the step, so the ratings are the same the step would have computed.
+    All the requests to the LLM, of the prefetcher and of the steps of the environments using it, are serialized by the lock
+    of the LLM (LLM.lock), since neither the model nor the global torch random generator are thread safe.
+
+    Raters with random_rating are not prefetched, since their random ratings would be drawn out of order.
+
+    Attributes:
+        rating_prompt (LLMRater): the rater of the environment
+        max_size (integer): maximum number of entries of the cache, the oldest are evicted first
+    """
+
+    def __init__(self, rating_prompt: LLMRater, max_size: int = 1024):
+        self.rating_prompt = rating_prompt
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: typing.OrderedDict[tuple, Future] = OrderedDict()
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def _get_key(self, seed: int, queries: typing.List[RatingQuery]) -> tuple:
+        return (seed, tuple(self.rating_prompt.get_queries_hashes(queries)))
+
+    def submit(self, seed: int, queries_list: typing.List[typing.List[RatingQuery]]):
+        """
+        Schedules the rating of every list of queries (e.g. the queries of the candidate actions) with seed.
+        The requests scheduled by the previous call that have not started yet are cancelled, since they refer to a previous state.
+
+        Args:
+            seed (integer): the seed the next step will use
+            queries_list (list of lists of RatingQuery): the queries of every candidate action
+        """
+        if self.rating_prompt.random_rating or self._closed:
+            return
+        keys = [self._get_key(seed, queries) for queries in queries_list]
+        with self._condition:
+            while self._pending:
+                self._pending.popleft()[3].cancel()
+            for key, queries in zip(keys, queries_list):
+                if key in self._cache and not self._cache[key].cancelled():
+                    self._cache.move_to_end(key)
+                    continue
+                future = Future()
+                self._cache[key] = future
+                self._pending.append((key, seed, queries, future))
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)[1].cancel()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def get(self, seed: int, queries: typing.List[RatingQuery], timeout: float = None):
+        """
+        Returns the prefetched results of queries rated with seed, waiting for them if they are being computed
+
+        Args:
+            seed (integer): the seed of the step
+            queries (list of RatingQuery): the queries of the step
+            timeout (float, optional): seconds waited for results being computed, concurrent.futures.TimeoutError
+                is raised when they expire (the results are still computed and cached), by default no limit
+
+        Return:
+            the results and the raw answers of the LLM (as LLMRater.query_batch_with_raw), None if they were not prefetched
+        """
+        key = self._get_key(seed, queries)
+        with self._condition:
+            future = self._cache.get(key)
+            # the step is waiting for it, so it is computed before the other candidates
+            for i, request in enumerate(self._pending):
+                if request[3] is future:
+                    del self._pending[i]
+                    self._pending.appendleft(request)
+                    break
+        if future is None:
+            self.misses += 1
+            return None
+        try:
+            results = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.misses += 1
+            raise
+        except (CancelledError, Exception):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return results
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                key, seed, queries, future = self._pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+            try:
+                with seeded_request(self.rating_prompt.llm, seed):
+                    results = self.rating_prompt.query_batch_with_raw(queries)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(results)
+
+    def close(self):
+        """
+        Stops the background thread, the requests not started yet are cancelled and the next ones are ignored
+        """
+        with self._condition:
+            self._closed = True
+            while self._pending:
+                self._pending.popleft()[3].cancel()
+            self._condition.notify()
+
+
+class PrefetchWrapper(gym.Wrapper):
+    """
+    Wrapper that, after every reset and step, asks candidates_fn for the actions the policy is likely to take
+    in the next step and prefetches their ratings (see RatingPrefetcher), e.g. the top-k actions of the Q-network of DQN.
+    The wrapped environment must have been created with a prefetcher.
+
+    Attributes:
+        env (gym.Env): the environment, Simulatio4RecSys possibly wrapped
+        candidates_fn (callable): given the observation returned by env, returns the candidate actions
+    """
+
+    def __init__(
+        self, env: gym.Env, candidates_fn: typing.Callable[[typing.Any], typing.List]
+    ):
+        super().__init__(env)
+        self.candidates_fn = candidates_fn
+
+    def reset(self, **kwargs):
+        observation, info = self.env.reset(**kwargs)
+        self.env.unwrapped.prefetch(self.candidates_fn(observation))
+        return observation, info
+
+    def step(self, action):
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        if not (terminated or truncated):
+            self.env.unwrapped.prefetch(self.candidates_fn(observation))
+        return observation, reward, terminated, truncated, info
@@ -0,0 +1,115 @@
+import typing
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from environment.LLM import RatingQuery
+
+
+class RatingFallback(ABC):
+    """
+    Cheaper source of ratings, used by Simulatio4RecSys when the LLM does not answer within step_deadline_ms
+    """
+
+    @abstractmethod
+    def rate(self, query: RatingQuery) -> typing.Optional[float]:
+        """
+        Returns the rating of the query, or None if the source can not rate it
+        """
+        pass
+
+    def update(self, query: RatingQuery, rating: float):
+        """
+        Receives the rating computed by the LLM for query, also when it arrives after the deadline
+        """
+        pass
+
+
+class CachedRatingFallback(RatingFallback):
+    """
+    Returns the last rating the LLM gave to the item for the user
+
+    Attributes:
+        max_size (integer): maximum number of (user, item) pairs stored, the oldest are evicted first
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.cache: typing.Dict[typing.Tuple[int, int], float] = {}
+
+    def rate(self, query: RatingQuery) -> typing.Optional[float]:
+        return self.cache.get((query.user.id, query.item.id))
+
+    def update(self, query: RatingQuery, rating: float):
+        key = (query.user.id, query.item.id)
+        self.cache.pop(key, None)
+        self.cache[key] = rating
+        if len(self.cache) > self.max_size:
+            del self.cache[next(iter(self.cache))]
+
+
+class VoteAverageFallback(RatingFallback):
+    """
+    Returns the vote average of the item rescaled to the ratings from 1 to 10
+
+    Attributes:
+        max_vote_average (float): maximum of the vote average of the dataset (10 for TMDB movies)
+        default (float): rating of the items without vote average
+    """
+
+    def __init__(self, max_vote_average: float = 10, default: float = 5):
+        self.max_vote_average = max_vote_average
+        self.default = default
+
+    def rate(self, query: RatingQuery) -> typing.Optional[float]:
+        vote_average = getattr(query.item, "vote_average", None)
+        if vote_average is None or np.isnan(vote_average):
+            return self.default
+        return float(
+            np.clip(np.round(vote_average / self.max_vote_average * 10), 1, 10)
+        )
+
+
+class ModelFallback(RatingFallback):
+    """
+    Returns the rating predicted by a lightweight model
+
+    Attributes:
+        model (callable): given a RatingQuery returns the predicted rating, or None
+    """
+
+    def __init__(self, model: typing.Callable[[RatingQuery], typing.Optional[float]]):
+        self.model = model
+
+    def rate(self, query: RatingQuery) -> typing.Optional[float]:
+        return self.model(query)
+
+
+class ChainFallback(RatingFallback):
+    """
+    Tries the fallbacks in order and returns the first rating found, all of them receive the ratings of the LLM
+
+    Attributes:
+        fallbacks (list of RatingFallback): the fallbacks, from the preferred one
+    """
+
+    def __init__(self, fallbacks: typing.List[RatingFallback]):
+        self.fallbacks = fallbacks
+
+    def rate(self, query: RatingQuery) -> typing.Optional[float]:
+        for fallback in self.fallbacks:
+            rating = fallback.rate(query)
+            if rating is not None:
+                return rating
+        return None
+
+    def update(self, query: RatingQuery, rating: float):
+        for fallback in self.fallbacks:
+            fallback.update(query, rating)
+
+
+def get_default_fallback() -> RatingFallback:
+    """
+    The cached rating of the item if the user already got it, otherwise its vote average
+    """
+    return ChainFallback([CachedRatingFallback(), VoteAverageFallback()])
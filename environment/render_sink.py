@@ -0,0 +1,190 @@
+import os
+import typing
+
+import numpy as np
+import pandas as pd
+
+RENDER_COLUMNS = ["user_id", "user_name", "time", "movie_id", "rating"]
+
+
+def get_render_format(path: str) -> str:
+    """
+    Format of a render log from the extension of its path: "parquet", "arrow" or "csv"
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return "parquet"
+    elif extension in [".arrow", ".feather", ".ipc"]:
+        return "arrow"
+    return "csv"
+
+
+def get_render_log_part_path(path: str, part: int) -> str:
+    """
+    Path of the part of a Parquet or Arrow IPC render log, part 0 is path itself and part i is e.g. render.i.parquet
+    """
+    if part == 0:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{part}{extension}"
+
+
+def get_render_log_parts(path: str) -> typing.List[str]:
+    """
+    Paths of the existing parts of a render log, in the order they were written (a CSV log has a single part)
+    """
+    if get_render_format(path) == "csv":
+        return [path] if os.path.exists(path) else []
+    parts = []
+    while os.path.exists(get_render_log_part_path(path, len(parts))):
+        parts.append(get_render_log_part_path(path, len(parts)))
+    return parts
+
+
+def read_render_log(path: str) -> pd.DataFrame:
+    """
+    Reads a render log written by RenderSink, in any of its formats, with all its parts
+    """
+    render_format = get_render_format(path)
+    if render_format == "csv":
+        return pd.read_csv(path)
+    dfs = []
+    for part_path in get_render_log_parts(path):
+        if render_format == "parquet":
+            dfs.append(pd.read_parquet(part_path))
+        else:
+            import pyarrow as pa
+
+            with pa.memory_map(part_path) as source:
+                dfs.append(pa.ipc.open_file(source).read_pandas())
+    if not dfs:
+        raise FileNotFoundError(f"Render log {path} not found")
+    return pd.concat(dfs, ignore_index=True)
+
+
+def merge_render_logs(paths: typing.List[str], path: str, buffer_size: int = 4096):
+    """
+    Writes the rows of the render logs in paths, in order, to the render log path (with the same rules of RenderSink,
+    the rows are appended to an existing log)
+
+    Args:
+        paths (list of strings): the render logs to merge
+        path (string): the merged render log
+    """
+    sink = RenderSink(path, buffer_size=buffer_size)
+    for shard_path in paths:
+        sink.append_many(read_render_log(shard_path))
+    sink.close()
+
+
+class RenderSink:
+    """
+    Buffered writer of the rows rendered by the environment in csv render mode.
+    The rows are accumulated in typed arrays and written in chunks of buffer_size rows, the format is chosen
+    by the extension of the path: Parquet (.parquet), Arrow IPC (.arrow, .feather, .ipc) or CSV (anything else).
+    Parquet and Arrow IPC require pyarrow. Their files can not be appended to, if the log already exists the rows are
+    written to a new part file (see get_render_log_part_path) and read_render_log reads all the parts. A CSV file is
+    appended to, as render used to do.
+
+    Attributes:
+        path (string): path of the output file
+        buffer_size (integer): number of rows kept in memory before writing them
+    """
+
+    def __init__(self, path: str, buffer_size: int = 4096):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.format = get_render_format(path)
+
+        self._user_id = np.zeros(buffer_size, dtype=np.int64)
+        self._user_name: typing.List[str] = []
+        self._time = np.zeros(buffer_size, dtype=np.int32)
+        self._movie_id = np.zeros(buffer_size, dtype=np.int32)
+        self._rating = np.zeros(buffer_size, dtype=np.int32)
+        self._len = 0
+        self._writer = None
+        self.closed = False
+
+    def append(self, user_id: int, user_name: str, time: int, movie_id, rating):
+        """
+        Adds a row, the rows are written when the buffer is full, on flush or on close
+        """
+        i = self._len
+        self._user_id[i] = user_id
+        self._user_name.append(user_name)
+        self._time[i] = time
+        self._movie_id[i] = movie_id
+        self._rating[i] = rating
+        self._len += 1
+        if self._len == self.buffer_size:
+            self.flush()
+
+    def append_many(self, rows: pd.DataFrame):
+        """
+        Adds the rows of a DataFrame with the columns RENDER_COLUMNS
+        """
+        start = 0
+        while start < len(rows):
+            i = self._len
+            n = min(len(rows) - start, self.buffer_size - i)
+            chunk = rows.iloc[start : start + n]
+            self._user_id[i : i + n] = chunk["user_id"].to_numpy()
+            self._user_name.extend(chunk["user_name"].tolist())
+            self._time[i : i + n] = chunk["time"].to_numpy()
+            self._movie_id[i : i + n] = chunk["movie_id"].to_numpy()
+            self._rating[i : i + n] = chunk["rating"].to_numpy()
+            self._len += n
+            start += n
+            if self._len == self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows to the file
+        """
+        if self._len == 0:
+            return
+        n = self._len
+        columns = {
+            "user_id": self._user_id[:n],
+            "user_name": self._user_name,
+            "time": self._time[:n],
+            "movie_id": self._movie_id[:n],
+            "rating": self._rating[:n],
+        }
+        if self.format == "csv":
+            df = pd.DataFrame(columns, columns=RENDER_COLUMNS)
+            exists = os.path.exists(self.path)
+            if not exists:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            df.to_csv(self.path, mode="a", index=False, header=not exists)
+        else:
+            import pyarrow as pa
+
+            table = pa.table(columns)
+            if self._writer is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                part_path = get_render_log_part_path(
+                    self.path, len(get_render_log_parts(self.path))
+                )
+                if self.format == "parquet":
+                    import pyarrow.parquet as pq
+
+                    self._writer = pq.ParquetWriter(part_path, table.schema)
+                else:
+                    self._writer = pa.ipc.new_file(part_path, table.schema)
+            self._writer.write_table(table)
+        self._user_name = []
+        self._len = 0
+
+    def close(self):
+        """
+        Writes the remaining rows and closes the file, the sink can not be used anymore
+        """
+        if self.closed:
+            return
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self.closed = True
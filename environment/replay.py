@@ -0,0 +1,231 @@
+import struct
+import typing
+
+from environment.LLM import RatingQuery
+
+_MAGIC = b"SUBERLG1"
+# user id, reward, number of rated items
+_STEP = struct.Struct("<idH")
+# item id, prompt hash, rating, number of retrieved items
+_ITEM = struct.Struct("<iQdH")
+_LENGTH = struct.Struct("<I")
+
+
+class StepRecord:
+    """
+    Everything the LLM produced during a step of the environment
+
+    Attributes:
+        user_id (integer): the user of the step
+        reward (float): the reward returned by the step
+        items_ids (list of integers): the rated items (more than one for slates)
+        prompts_hashes (list of integers): for every rated item the hash of the prompt
+        ratings (list of floats): for every rated item the rating parsed from the answer of the LLM
+        retrieved_items_ids (list of lists of integers): for every rated item the retrieved items included in the prompt
+        raw_outputs (list of strings): for every rated item the raw answer of the LLM
+        explanations (list of strings): for every rated item the explanation of the LLM
+        interactions (list of strings): for every rated item the html of the explanation request
+    """
+
+    __slots__ = (
+        "user_id",
+        "reward",
+        "items_ids",
+        "prompts_hashes",
+        "ratings",
+        "retrieved_items_ids",
+        "raw_outputs",
+        "explanations",
+        "interactions",
+    )
+
+    def __init__(self, user_id: int, reward: float):
+        self.user_id = user_id
+        self.reward = reward
+        self.items_ids = []
+        self.prompts_hashes = []
+        self.ratings = []
+        self.retrieved_items_ids = []
+        self.raw_outputs = []
+        self.explanations = []
+        self.interactions = []
+
+
+class StepRecorder:
+    """
+    Writes a compact binary log of every step of an environment, the log can be served back by StepLog
+    to run the environment again without the LLM.
+
+    Attributes:
+        path (string): path of the log file, it is overwritten
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(_MAGIC)
+
+    def record(
+        self,
+        user_id: int,
+        queries: typing.List[RatingQuery],
+        results: typing.List[typing.Tuple[float, str, str]],
+        raw: typing.Optional[typing.List[typing.Tuple[int, str]]],
+        reward: float,
+    ):
+        """
+        Appends a step to the log
+
+        Args:
+            user_id (integer): the user of the step
+            queries (list of RatingQuery): the queries rated during the step
+            results (list of tuples): for every query the rating, the explanation and html of the LLM interaction
+            raw (list of tuples or None): for every query the hash of the prompt and the raw answer of the LLM, if None they are not stored
+            reward (float): the reward returned by the step
+        """
+        if raw is None:
+            raw = [(0, "")] * len(queries)
+        chunks = [_STEP.pack(int(user_id), float(reward), len(queries))]
+        for query, (rating, explanation, interaction), (prompt_hash, out) in zip(
+            queries, results, raw
+        ):
+            retrieved_ids = [item.id for item in query.retrieved_items]
+            chunks.append(
+                _ITEM.pack(
+                    int(query.item.id),
+                    prompt_hash,
+                    float(rating),
+                    len(retrieved_ids),
+                )
+            )
+            chunks.append(struct.pack(f"<{len(retrieved_ids)}i", *retrieved_ids))
+            for text in (out, explanation, interaction):
+                data = str(text).encode("utf-8")
+                chunks.append(_LENGTH.pack(len(data)))
+                chunks.append(data)
+        self._file.write(b"".join(chunks))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class StepLog:
+    """
+    Log written by StepRecorder, loaded in memory. In replay mode the environment takes the ratings of every step
+    from the log, in order, instead of querying the LLM.
+
+    Attributes:
+        path (string): path of the log file
+        records (list of StepRecord): the steps of the log
+        position (integer): index of the next step to replay
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = self._load(path)
+        self.position = 0
+
+    @staticmethod
+    def _load(path: str) -> typing.List[StepRecord]:
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[: len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a log written by StepRecorder")
+
+        records = []
+        offset = len(_MAGIC)
+        while offset < len(data):
+            user_id, reward, num_items = _STEP.unpack_from(data, offset)
+            offset += _STEP.size
+            record = StepRecord(user_id, reward)
+            for _ in range(num_items):
+                item_id, prompt_hash, rating, num_retrieved = _ITEM.unpack_from(
+                    data, offset
+                )
+                offset += _ITEM.size
+                retrieved_ids = list(
+                    struct.unpack_from(f"<{num_retrieved}i", data, offset)
+                )
+                offset += 4 * num_retrieved
+                texts = []
+                for _ in range(3):
+                    (length,) = _LENGTH.unpack_from(data, offset)
+                    offset += _LENGTH.size
+                    texts.append(data[offset : offset + length].decode("utf-8"))
+                    offset += length
+                record.items_ids.append(item_id)
+                record.prompts_hashes.append(prompt_hash)
+                record.ratings.append(rating)
+                record.retrieved_items_ids.append(retrieved_ids)
+                record.raw_outputs.append(texts[0])
+                record.explanations.append(texts[1])
+                record.interactions.append(texts[2])
+            records.append(record)
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def next_step(
+        self,
+        user_id: int,
+        queries: typing.List[RatingQuery],
+        prompts_hashes: typing.List[int] = None,
+    ) -> typing.Tuple[
+        typing.List[typing.Tuple[float, str, str]], typing.List[typing.Tuple[int, str]]
+    ]:
+        """
+        Serves the results of the next step of the log, checking that the environment is rating the same items
+        for the same user, with the same prompts, as when the log was recorded. The prompts of the steps recorded
+        without hash (e.g. rated by the rating fallback) are not checked.
+
+        Args:
+            user_id (integer): the user of the step
+            queries (list of RatingQuery): the queries to rate
+            prompts_hashes (list of integers, optional): the hashes of the prompts of queries
+                (see LLMRater.get_queries_hashes), if None the prompts are not checked
+
+        Return:
+            the results, as returned by LLMRater.query_batch, and the hashes of the prompts with the raw answers of the LLM
+        """
+        if self.position >= len(self.records):
+            raise ValueError(f"The replay log {self.path} has no more steps")
+        record = self.records[self.position]
+        items_ids = [query.item.id for query in queries]
+        if record.user_id != user_id or record.items_ids != items_ids:
+            raise ValueError(
+                f"The environment diverged from the replay log at step {self.position}:"
+                f" expected user {record.user_id} and items {record.items_ids},"
+                f" got user {user_id} and items {items_ids}"
+            )
+        if prompts_hashes is not None:
+            changed = [
+                item_id
+                for item_id, recorded, prompt_hash in zip(
+                    items_ids, record.prompts_hashes, prompts_hashes
+                )
+                if recorded != 0 and recorded != prompt_hash
+            ]
+            if changed:
+                raise ValueError(
+                    f"The environment diverged from the replay log at step {self.position}:"
+                    f" the prompts of items {changed} differ from the recorded ones"
+                )
+        self.position += 1
+
+        results = list(zip(record.ratings, record.explanations, record.interactions))
+        raw = list(zip(record.prompts_hashes, record.raw_outputs))
+        return results, raw
+
+    def rewind(self, position: int = 0):
+        """
+        Moves the replay to the given step of the log
+        """
+        self.position = position
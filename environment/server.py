@@ -0,0 +1,432 @@
+import asyncio
+import functools
+import json
+import socket
+import struct
+import typing
+
+import gymnasium as gym
+import numpy as np
+from gymnasium import spaces
+
+from environment.env import Simulatio4RecSys
+from environment.vector_env import step_batch
+
+"""
+Every message is a JSON object preceded by its length as a 4 bytes big endian unsigned integer.
+A request has a "method" (make, reset, step or close), the "session" it refers to (except for make) and the parameters of the method,
+the response has either a "result" or an "error". Observations, actions and infos are encoded as plain JSON (arrays become lists),
+the observation and action spaces as JSON descriptors (see space_to_json).
+"""
+_HEADER = struct.Struct(">I")
+
+
+def to_json(x):
+    """
+    Converts observations, actions and infos to objects that can be encoded in JSON
+    """
+    if isinstance(x, dict):
+        return {key: to_json(value) for key, value in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [to_json(value) for value in x]
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+
+def from_json(space: spaces.Space, x):
+    """
+    Converts an object decoded from JSON back to an element of space
+    """
+    if isinstance(space, spaces.Dict):
+        return {key: from_json(space[key], value) for key, value in x.items()}
+    if isinstance(space, spaces.Sequence):
+        return tuple(from_json(space.feature_space, value) for value in x)
+    if isinstance(space, (spaces.Box, spaces.MultiDiscrete)):
+        return np.array(x, dtype=space.dtype)
+    if isinstance(space, spaces.Discrete):
+        return int(x)
+    return x
+
+
+def space_to_json(space: spaces.Space) -> dict:
+    """
+    JSON descriptor of a space, a dictionary with the "type" of the space and its parameters, e.g.
+    {"type": "Discrete", "n": 10, "start": 0} or {"type": "Box", "low": [...], "high": [...], "shape": [2], "dtype": "int32"}.
+    The spaces of Simulatio4RecSys are supported: Dict, Discrete, Box, MultiDiscrete, Text and Sequence.
+    """
+    if isinstance(space, spaces.Dict):
+        return {
+            "type": "Dict",
+            "spaces": {key: space_to_json(value) for key, value in space.items()},
+        }
+    if isinstance(space, spaces.Discrete):
+        return {"type": "Discrete", "n": int(space.n), "start": int(space.start)}
+    if isinstance(space, spaces.Box):
+        return {
+            "type": "Box",
+            "low": space.low.tolist(),
+            "high": space.high.tolist(),
+            "shape": list(space.shape),
+            "dtype": space.dtype.name,
+        }
+    if isinstance(space, spaces.MultiDiscrete):
+        return {
+            "type": "MultiDiscrete",
+            "nvec": space.nvec.tolist(),
+            "dtype": space.dtype.name,
+        }
+    if isinstance(space, spaces.Text):
+        return {
+            "type": "Text",
+            "min_length": space.min_length,
+            "max_length": space.max_length,
+            "charset": "".join(sorted(space.character_set)),
+        }
+    if isinstance(space, spaces.Sequence):
+        return {"type": "Sequence", "feature_space": space_to_json(space.feature_space)}
+    raise ValueError(f"Space {type(space).__name__} can not be encoded in JSON")
+
+
+def space_from_json(descriptor: dict) -> spaces.Space:
+    """
+    Builds the space described by a JSON descriptor returned by space_to_json
+    """
+    space_type = descriptor["type"]
+    if space_type == "Dict":
+        return spaces.Dict(
+            {key: space_from_json(value) for key, value in descriptor["spaces"].items()}
+        )
+    if space_type == "Discrete":
+        return spaces.Discrete(descriptor["n"], start=descriptor["start"])
+    if space_type == "Box":
+        dtype = np.dtype(descriptor["dtype"])
+        return spaces.Box(
+            low=np.array(descriptor["low"], dtype=dtype),
+            high=np.array(descriptor["high"], dtype=dtype),
+            shape=tuple(descriptor["shape"]),
+            dtype=dtype,
+        )
+    if space_type == "MultiDiscrete":
+        return spaces.MultiDiscrete(
+            descriptor["nvec"], dtype=np.dtype(descriptor["dtype"])
+        )
+    if space_type == "Text":
+        return spaces.Text(
+            descriptor["max_length"],
+            min_length=descriptor["min_length"],
+            charset=descriptor["charset"],
+        )
+    if space_type == "Sequence":
+        return spaces.Sequence(space_from_json(descriptor["feature_space"]))
+    raise ValueError(f"Unknown space {space_type}")
+
+
+class EnvServer:
+    """
+    Local server that exposes Simulatio4RecSys environments over a Unix socket or TCP, so that many processes can share
+    one catalog, one set of users and one LLM. Every client creates its own sessions (environments) with make_env.
+    The step requests of all the clients that arrive within max_batch_wait seconds are batched, and the LLM is queried once
+    for the whole batch (see step_batch). The requests of a single connection are served in order.
+
+    Attributes:
+        make_env (callable): make_env(i) returns the environment of the i-th session, the environments should share the LLMRater
+        host (string): host of the TCP server, ignored if unix_socket is given
+        port (integer): port of the TCP server
+        unix_socket (string, optional): path of the Unix socket
+        max_batch_size (integer): maximum number of steps of a batch
+        max_batch_wait (float): seconds waited for more steps after the first step of a batch arrives
+    """
+
+    def __init__(
+        self,
+        make_env: typing.Callable[[int], Simulatio4RecSys],
+        host: str = "127.0.0.1",
+        port: int = 5555,
+        unix_socket: str = None,
+        max_batch_size: int = 64,
+        max_batch_wait: float = 0.005,
+    ):
+        self.make_env = make_env
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self.envs: typing.Dict[int, Simulatio4RecSys] = {}
+        self.batches_sizes: typing.List[int] = []
+        self._num_sessions = 0
+        self._steps = None
+        # the batch being stepped in a worker thread for every environment
+        self._running_batches: typing.Dict[Simulatio4RecSys, asyncio.Future] = {}
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    async def serve(self, started: asyncio.Event = None):
+        """
+        Serves the clients until cancelled
+
+        Args:
+            started (asyncio.Event, optional): set once the server accepts connections
+        """
+        self._steps = asyncio.Queue()
+        if self.unix_socket is not None:
+            server = await asyncio.start_unix_server(
+                self._handle, path=self.unix_socket
+            )
+        else:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        batcher = asyncio.create_task(self._batch_steps())
+        if started is not None:
+            started.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            envs, self.envs = self.envs, {}
+            for env in envs.values():
+                await self._close_env(env)
+
+    async def _close_env(self, env: Simulatio4RecSys):
+        """
+        Closes the environment once the batch stepping it, if any, is done, since the worker thread keeps running
+        also when the request that started it is cancelled
+        """
+        running = self._running_batches.get(env)
+        if running is not None:
+            await asyncio.wait([running])
+        env.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serves the requests of a connection, the sessions created by the connection are closed when it is closed,
+        also when the connection is dropped or the handler cancelled while a step of one of them is in flight
+        """
+        sessions = []
+        try:
+            while True:
+                try:
+                    (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                    request = json.loads(await reader.readexactly(length))
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    response = {"result": await self._dispatch(request, sessions)}
+                except Exception as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                data = json.dumps(response).encode("utf-8")
+                writer.write(_HEADER.pack(len(data)) + data)
+                await writer.drain()
+        finally:
+            for session in sessions:
+                if session in self.envs:
+                    await self._close_env(self.envs.pop(session))
+            writer.close()
+
+    async def _dispatch(self, request: dict, sessions: typing.List[int]):
+        method = request["method"]
+        if method == "make":
+            session = self._num_sessions
+            self._num_sessions += 1
+            env = self.make_env(session)
+            self.envs[session] = env
+            sessions.append(session)
+            return {
+                "session": session,
+                "observation_space": space_to_json(env.observation_space),
+                "action_space": space_to_json(env.action_space),
+            }
+
+        env = self.envs[request["session"]]
+        if method == "reset":
+            observation, info = env.reset(
+                seed=request.get("seed"), user_id=request.get("user_id")
+            )
+            return {"observation": to_json(observation), "info": to_json(info)}
+        elif method == "step":
+            action = from_json(env.action_space, request["action"])
+            future = asyncio.get_running_loop().create_future()
+            await self._steps.put((env, action, future))
+            observation, reward, terminated, truncated, info = await future
+            return {
+                "observation": to_json(observation),
+                "reward": float(reward),
+                "terminated": bool(terminated),
+                "truncated": bool(truncated),
+                "info": to_json(info),
+            }
+        elif method == "close":
+            self.envs.pop(request["session"]).close()
+            sessions.remove(request["session"])
+            return None
+        raise ValueError(f"Unknown method {method}")
+
+    async def _batch_steps(self):
+        """
+        Collects the step requests in batches and steps every batch in a worker thread, so that the server keeps
+        accepting requests while the LLM is working
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._steps.get()]
+            deadline = loop.time() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(
+                        await asyncio.wait_for(
+                            self._steps.get(), max(deadline - loop.time(), 0)
+                        )
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            """
+            An environment can be stepped only once per batch, and the environments of a batch must share the LLMRater,
+            the other requests are stepped in the following batches.
+            """
+            groups = {}
+            for env, action, future in batch:
+                # the request has been cancelled, e.g. its connection has been dropped
+                if future.done():
+                    continue
+                key = (id(env.rating_prompt), env.replay is not None)
+                group = groups.setdefault(key, ([], [], [], []))
+                if env in group[0]:
+                    group[3].append((env, action, future))
+                else:
+                    group[0].append(env)
+                    group[1].append(action)
+                    group[2].append(future)
+            for envs, actions, futures, postponed in groups.values():
+                for request in postponed:
+                    self._steps.put_nowait(request)
+                self.batches_sizes.append(len(envs))
+                """
+                The errors are reported to the session that raised them, the other sessions of the batch are stepped.
+                If the LLM request fails none of the sessions is stepped, and all of them get the error.
+                """
+                running = asyncio.ensure_future(
+                    asyncio.to_thread(step_batch, envs, actions, return_exceptions=True)
+                )
+                for env in envs:
+                    self._running_batches[env] = running
+                running.add_done_callback(functools.partial(self._forget_batch, envs))
+                try:
+                    # if the batcher is cancelled the batch is still awaited by _close_env
+                    results = await asyncio.shield(running)
+                except Exception as e:
+                    results = [e] * len(envs)
+                for future, result in zip(futures, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    def _forget_batch(
+        self, envs: typing.List[Simulatio4RecSys], running: asyncio.Future
+    ):
+        """
+        Called when the batch running is done, the environments can be closed
+        """
+        for env in envs:
+            if self._running_batches.get(env) is running:
+                del self._running_batches[env]
+
+
+class EnvClient(gym.Env):
+    """
+    Gymnasium environment that forwards reset and step to a session of an EnvServer
+
+    Attributes:
+        address (tuple (host, port) or string): address of the TCP server or path of its Unix socket
+    """
+
+    def __init__(self, address: typing.Union[typing.Tuple[str, int], str]):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(address)
+        else:
+            self._socket = socket.create_connection(address)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.session = None
+        result = self._request("make")
+        self.session = result["session"]
+        self.observation_space = space_from_json(result["observation_space"])
+        self.action_space = space_from_json(result["action_space"])
+
+    def _request(self, method: str, **params):
+        data = json.dumps({"method": method, "session": self.session, **params}).encode(
+            "utf-8"
+        )
+        self._socket.sendall(_HEADER.pack(len(data)) + data)
+        (length,) = _HEADER.unpack(self._recv(_HEADER.size))
+        response = json.loads(self._recv(length))
+        if "error" in response:
+            raise RuntimeError(f"EnvServer: {response['error']}")
+        return response["result"]
+
+    def _recv(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("EnvServer closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def reset(self, seed=None, options=None, user_id=None):
+        super().reset(seed=seed)
+        result = self._request(
+            "reset", seed=seed, user_id=None if user_id is None else int(user_id)
+        )
+        return from_json(self.observation_space, result["observation"]), result["info"]
+
+    def step(self, action):
+        result = self._request("step", action=to_json(action))
+        return (
+            from_json(self.observation_space, result["observation"]),
+            result["reward"],
+            result["terminated"],
+            result["truncated"],
+            result["info"],
+        )
+
+    def close(self):
+        if self._socket is None:
+            return
+        if self.session is not None:
+            self._request("close")
+        self._socket.close()
+        self._socket = None
+
+
+if __name__ == "__main__":
+    from environment import load_LLM
+    from environment.movies.configs import (
+        get_base_parser,
+        get_enviroment_factory_from_args,
+    )
+
+    parser = get_base_parser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--unix-socket", type=str, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-batch-wait", type=float, default=0.005)
+    args = parser.parse_args()
+
+    llm = load_LLM(args.llm_model)
+    EnvServer(
+        get_enviroment_factory_from_args(llm, args),
+        host=args.host,
+        port=args.port,
+        unix_socket=args.unix_socket,
+        max_batch_size=args.max_batch_size,
+        max_batch_wait=args.max_batch_wait,
+    ).serve_forever()
@@ -0,0 +1,430 @@
+import multiprocessing
+import sys
+import typing
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from environment.memory import UserMovieInteraction
+
+"""
+Columns of the shared block, each an array of shape (num_users, max_interactions_per_user) except the per user counters.
+The generation of a user is incremented every time rows of its history are removed or overwritten,
+so that the processes know when the watch counts they have indexed are no longer valid
+"""
+_COLUMNS = (
+    ("item_ids", np.int32),
+    ("ratings", np.float32),
+    ("timestamps", np.uint32),
+    ("num_watches", np.uint16),
+)
+_COUNTERS = (
+    ("sizes", np.int32),
+    ("num_items_interact", np.uint32),
+    ("generations", np.uint32),
+)
+_ALIGNMENT = 8
+
+
+def _get_layout(num_users: int, max_interactions_per_user: int):
+    layout, size = [], 0
+    for name, dtype in _COLUMNS + _COUNTERS:
+        shape = (
+            (num_users, max_interactions_per_user)
+            if (name, dtype) in _COLUMNS
+            else (num_users,)
+        )
+        layout.append((name, shape, np.dtype(dtype), size))
+        size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size += -size % _ALIGNMENT
+    return layout, max(size, 1)
+
+
+def _attach_block(name: str) -> SharedMemory:
+    """
+    Attaches to an existing shared block without letting the resource tracker of this process unlink it at exit
+    (before Python 3.13 every SharedMemory is registered in the resource tracker, also when attaching).
+    The workers started by the owner share its resource tracker, for them the registration is a no-op
+    and removing it would remove the one of the owner, so it is removed only when this process has its own tracker.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    own_tracker = resource_tracker._resource_tracker._fd is None
+    block = SharedMemory(name=name)
+    if own_tracker:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+class _Snapshot:
+    """
+    Handle returned by SharedColumnarMemory.snapshot: the journal of the process and its length when the snapshot
+    was taken, position is None once the snapshot is no longer valid
+    """
+
+    __slots__ = ("journal", "position", "__weakref__")
+
+    def __init__(self, journal: list):
+        self.journal = journal
+        self.position: typing.Optional[int] = len(journal)
+
+
+class SharedColumnarMemory:
+    """
+    Memory backend with the same interface of Memory, whose histories live in a multiprocessing.shared_memory block,
+    so that several environment workers simulating overlapping users read and append to the same histories,
+    and population statistics can be computed on the whole block without moving data between processes.
+    The history of every user is a row of typed columns (as in ColumnarMemory) with room for max_interactions_per_user
+    interactions. The users are protected by num_locks locks, user i by lock i % num_locks, so that workers on different
+    users rarely wait for each other.
+
+    The process that creates the memory owns the block and must unlink it. The other processes get handle
+    (which contains the locks and can be passed to multiprocessing.Process) and call SharedColumnarMemory.attach.
+    Since Simulatio4RecSys empties its memory at every reset, pass memory_factory=lambda items_loader: memory
+    and keep_memory=True to keep the histories across episodes.
+
+    Every process indexes the number of watches of the items of the users it reads, the index is extended with the rows
+    appended by the other processes and rebuilt only when rows are removed, so get_num_interaction takes O(1) amortized time.
+
+    Attributes:
+        items_loader (ItemsLoader): the items
+        num_users (integer): number of users, the ids of the users go from 0 to num_users - 1
+        max_interactions_per_user (integer): maximum length of the history of a user
+        num_locks (integer): number of locks
+    """
+
+    def __init__(
+        self,
+        items_loader,
+        num_users: int,
+        max_interactions_per_user: int = 1024,
+        num_locks: int = 64,
+        _handle: tuple = None,
+    ):
+        self.items_loader = items_loader
+        self.num_users = num_users
+        self.max_interactions_per_user = max_interactions_per_user
+        self._layout, size = _get_layout(num_users, max_interactions_per_user)
+        if _handle is None:
+            # forked workers must share the resource tracker of the block, otherwise they would start their own one,
+            # that would unlink the block when the worker exits
+            resource_tracker.ensure_running()
+            self._block = SharedMemory(create=True, size=size)
+            np.frombuffer(self._block.buf, dtype=np.uint8)[:] = 0
+            self._locks = [multiprocessing.Lock() for _ in range(num_locks)]
+            self._owner = True
+        else:
+            name, _, _, self._locks = _handle
+            self._block = _attach_block(name)
+            self._owner = False
+        self._columns = self._get_columns(self._block.buf)
+        self._items_cache = {}
+        # for every user read by this process: (generation, number of rows indexed, watches of every item)
+        self._watch_counts: typing.Dict[
+            int, typing.Tuple[int, int, typing.Dict[int, int]]
+        ] = {}
+        """
+        The snapshots are kept by a journal of this process: while a snapshot is referenced, the rows and counters
+        of a user are appended to the journal before the first change of this process to the user after the latest
+        snapshot, so a snapshot copies only the users this process writes.
+        """
+        self._journal: typing.Optional[list] = None
+        self._snapshots: "weakref.WeakSet[_Snapshot]" = weakref.WeakSet()
+        # users saved in the journal since the latest snapshot
+        self._saved_users: typing.Set[int] = set()
+
+    def _get_columns(self, buffer) -> typing.Dict[str, np.ndarray]:
+        return {
+            name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            for name, shape, dtype, offset in self._layout
+        }
+
+    @property
+    def handle(self) -> tuple:
+        """
+        Handle to attach to the memory from another process
+        """
+        return (
+            self._block.name,
+            self.num_users,
+            self.max_interactions_per_user,
+            self._locks,
+        )
+
+    @classmethod
+    def attach(cls, items_loader, handle: tuple) -> "SharedColumnarMemory":
+        """
+        Attaches to the memory created by another process
+
+        Args:
+            items_loader (ItemsLoader): the items
+            handle (tuple): the handle of the memory
+        """
+        _, num_users, max_interactions_per_user, locks = handle
+        return cls(
+            items_loader,
+            num_users,
+            max_interactions_per_user,
+            num_locks=len(locks),
+            _handle=handle,
+        )
+
+    def lock(self, user_id: int):
+        """
+        Lock of the user, hold it to read the views returned by get_columns consistently
+        """
+        return self._locks[user_id % len(self._locks)]
+
+    def _load_item(self, item_id: int):
+        item = self._items_cache.get(item_id)
+        if item is None:
+            item = self.items_loader.load_items_from_ids(id_list=[item_id])[0]
+            self._items_cache[item_id] = item
+        return item
+
+    def _get_interaction(self, user_id: int, row: int) -> UserMovieInteraction:
+        return UserMovieInteraction(
+            float(self._columns["ratings"][user_id, row]),
+            int(self._columns["timestamps"][user_id, row]),
+            int(self._columns["num_watches"][user_id, row]),
+        )
+
+    def _save_user(self, user_id: int):
+        """
+        Appends the rows and the counters of the user to the journal, if this is the first change of this process
+        to the user since the latest snapshot, the lock of the user must be held
+        """
+        if self._journal is not None and not self._snapshots:
+            self._journal = None
+        if self._journal is None or user_id in self._saved_users:
+            return
+        self._saved_users.add(user_id)
+        size = int(self._columns["sizes"][user_id])
+        self._journal.append(
+            (
+                user_id,
+                {
+                    name: self._columns[name][user_id, :size].copy()
+                    for name, _ in _COLUMNS
+                },
+                {name: self._columns[name][user_id] for name, _ in _COUNTERS[:2]},
+            )
+        )
+
+    def _get_watch_counts(self, user_id: int) -> typing.Dict[int, int]:
+        """
+        Return the number of watches of every item seen by the user, the lock of the user must be held
+        """
+        columns = self._columns
+        generation = int(columns["generations"][user_id])
+        size = int(columns["sizes"][user_id])
+        indexed_generation, num_rows, counts = self._watch_counts.get(
+            user_id, (generation, 0, {})
+        )
+        if indexed_generation != generation or num_rows > size:
+            num_rows, counts = 0, {}
+        for item_id, num_watches in zip(
+            columns["item_ids"][user_id, num_rows:size].tolist(),
+            columns["num_watches"][user_id, num_rows:size].tolist(),
+        ):
+            counts[item_id] = num_watches
+        self._watch_counts[user_id] = (generation, size, counts)
+        return counts
+
+    def _get_item_rows(self, user_id: int, item_id: int) -> np.ndarray:
+        size = self._columns["sizes"][user_id]
+        return np.flatnonzero(self._columns["item_ids"][user_id, :size] == item_id)
+
+    def _remove_rows(self, user_id: int, rows: np.ndarray):
+        self._save_user(user_id)
+        size = int(self._columns["sizes"][user_id])
+        keep = np.ones(size, dtype=bool)
+        keep[rows] = False
+        for name, _ in _COLUMNS:
+            column = self._columns[name][user_id]
+            kept = column[:size][keep]
+            column[: len(kept)] = kept
+        self._columns["sizes"][user_id] = int(keep.sum())
+        self._columns["generations"][user_id] += 1
+
+    def update_memory(
+        self, user_id: int, items_ids: typing.List[int], scores: typing.List[float]
+    ):
+        """
+        Updates the memory for a given user with respect to new item IDs and scores, see Memory.update_memory
+        """
+        columns = self._columns
+        with self.lock(user_id):
+            self._save_user(user_id)
+            counts = self._get_watch_counts(user_id)
+            for item_id, score in zip(items_ids, scores):
+                item_id = int(item_id)
+                size = int(columns["sizes"][user_id])
+                if size == self.max_interactions_per_user:
+                    raise ValueError(
+                        f"The history of user {user_id} is full,"
+                        " increase max_interactions_per_user"
+                    )
+                timestamp = int(columns["num_items_interact"][user_id]) + 1
+                num_watches = counts.get(item_id, 0) + 1
+                columns["item_ids"][user_id, size] = item_id
+                columns["ratings"][user_id, size] = score
+                columns["timestamps"][user_id, size] = timestamp
+                columns["num_watches"][user_id, size] = num_watches
+                columns["num_items_interact"][user_id] = timestamp
+                columns["sizes"][user_id] = size + 1
+                counts[item_id] = num_watches
+            self._watch_counts[user_id] = (
+                int(columns["generations"][user_id]),
+                int(columns["sizes"][user_id]),
+                counts,
+            )
+
+    def get_items_and_scores(self, user_id: int):
+        """
+        Return the items seen by the user, in order of first interaction, with their last interaction, see Memory.get_items_and_scores
+        """
+        with self.lock(user_id):
+            size = int(self._columns["sizes"][user_id])
+            items_ids = self._columns["item_ids"][user_id, :size]
+            unique_ids, first_rows = np.unique(items_ids, return_index=True)
+            _, last_rows = np.unique(items_ids[::-1], return_index=True)
+            last_rows = size - 1 - last_rows
+            order = np.argsort(first_rows)
+            interactions = [
+                self._get_interaction(user_id, row) for row in last_rows[order]
+            ]
+        return [self._load_item(int(i)) for i in unique_ids[order]], interactions
+
+    def get_columns(self, user_id: int) -> typing.Dict[str, np.ndarray]:
+        """
+        Return the whole history of a user in cronological order, as read-only views of the shared columns
+        (item_ids, ratings, timestamps and num_watches), hold lock(user_id) while reading them
+
+        Args:
+            user_id (integer): id of a user
+        """
+        size = int(self._columns["sizes"][user_id])
+        columns = {}
+        for name, _ in _COLUMNS:
+            view = self._columns[name][user_id, :size]
+            view.flags.writeable = False
+            columns[name] = view
+        return columns
+
+    def get_population_columns(self) -> typing.Dict[str, np.ndarray]:
+        """
+        Return read-only views of the columns of all the users, with the length of every history in "sizes",
+        to compute statistics of the whole population (the rows after the length of a history are not valid)
+        """
+        columns = {}
+        for name, _ in _COLUMNS + (("sizes", None),):
+            view = self._columns[name][:]
+            view.flags.writeable = False
+            columns[name] = view
+        return columns
+
+    def delete_user_item(self, user_id: int, item_id: int):
+        """
+        Removes all the interactions of the user with the item, see Memory.delete_user_item
+        """
+        with self.lock(user_id):
+            rows = self._get_item_rows(user_id, item_id)
+            if len(rows) == 0:
+                raise KeyError(item_id)
+            self._remove_rows(user_id, rows)
+
+    def delete_last_user_item_interaction(self, user_id: int, item_id: int):
+        """
+        Removes the last interaction of the user with the item, see Memory.delete_last_user_item_interaction
+        """
+        with self.lock(user_id):
+            rows = self._get_item_rows(user_id, item_id)
+            if len(rows) == 0:
+                raise KeyError(item_id)
+            self._remove_rows(user_id, rows[-1:])
+
+    def get_num_interaction(self, user_id: int, item_id: int):
+        """
+        Return the number of times a user has watched a item
+        """
+        with self.lock(user_id):
+            return self._get_watch_counts(user_id).get(int(item_id), 0)
+
+    def get_item_interactions(
+        self, user_id: int, item_id: int
+    ) -> typing.List[UserMovieInteraction]:
+        """
+        Return all the interactions of a user with a item, in cronological order
+        """
+        with self.lock(user_id):
+            return [
+                self._get_interaction(user_id, row)
+                for row in self._get_item_rows(user_id, item_id)
+            ]
+
+    def get_num_items_interact(self, user_id: int) -> int:
+        """
+        Return the number of interactions of a user, the timestamp of the last interaction
+        """
+        return int(self._columns["num_items_interact"][user_id])
+
+    def snapshot(self):
+        """
+        Take a snapshot of the users this process writes: from now on, as long as the snapshot is referenced,
+        the users are saved in the journal before their first change of this process
+
+        Return:
+            snapshot (_Snapshot): handle to pass to restore, in the same process
+        """
+        if self._journal is not None and not self._snapshots:
+            self._journal = None
+        if self._journal is None:
+            self._journal = []
+        self._saved_users = set()
+        snapshot = _Snapshot(self._journal)
+        self._snapshots.add(snapshot)
+        return snapshot
+
+    def restore(self, snapshot):
+        """
+        Bring back to the state they had when snapshot was taken the users modified by this process after the snapshot,
+        the users modified only by the other processes are not touched, so every worker can restore its own episodes.
+        A user modified by several processes after the snapshot is restored for all of them, every user
+        must be written by a single process between a snapshot and its restore.
+        The snapshot can be restored again later as long as no older snapshot has been restored in the meantime.
+
+        Args:
+            snapshot (_Snapshot): handle returned by snapshot
+        """
+        if snapshot.position is None or snapshot.journal is not self._journal:
+            raise ValueError(
+                "The snapshot is no longer valid, an older snapshot was restored"
+            )
+        while len(self._journal) > snapshot.position:
+            user_id, rows, counters = self._journal.pop()
+            with self.lock(user_id):
+                for name, column in rows.items():
+                    self._columns[name][user_id, : len(column)] = column
+                for name, value in counters.items():
+                    self._columns[name][user_id] = value
+                self._columns["generations"][user_id] += 1
+        self._saved_users = set()
+        for other in list(self._snapshots):
+            if other.position > snapshot.position:
+                other.position = None
+                self._snapshots.discard(other)
+
+    def close(self):
+        """
+        Detaches from the shared block, the process that created the memory also unlinks it
+        """
+        if self._block is None:
+            return
+        self._columns = None
+        self._block.close()
+        if self._owner:
+            self._block.unlink()
+        self._block = None
@@ -0,0 +1,292 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import typing
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from environment.memory import (
+    EvictionPolicy,
+    Memory,
+    UserMovieInteraction,
+    _setattr_logged,
+)
+
+"""
+The interactions of a user are stored on disk as a single blob, one row per interaction grouped by item,
+the items in order of first interaction and the interactions of an item in cronological order.
+With an eviction policy the eviction data of the user (the state of the policy and the interactions forgotten)
+is pickled in a second blob, NULL without eviction policy
+"""
+_ROW = np.dtype(
+    [
+        ("item_id", "<i4"),
+        ("rating", "<f8"),
+        ("timestamp", "<u4"),
+        ("num_watches", "<u2"),
+    ]
+)
+
+
+def _close_database(db: sqlite3.Connection, path: typing.Optional[str]):
+    """
+    Commits and closes the database, the file is deleted if path is given
+    """
+    if db.in_transaction:
+        db.execute("COMMIT")
+    db.close()
+    if path is not None:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+class _Savepoint:
+    """
+    Savepoint of the database taken by a snapshot of TieredMemory, when it is garbage collected its name is added
+    to dropped, and the memory releases the savepoint as soon as all the newer ones are released
+    """
+
+    __slots__ = ("name", "__weakref__")
+
+    def __init__(self, name: str, dropped: typing.Set[str]):
+        self.name = name
+        weakref.finalize(self, dropped.add, name)
+
+
+class TieredMemory(Memory):
+    """
+    Memory that keeps in RAM only the max_hot_users users accessed most recently, the other users are stored
+    in a SQLite database and loaded back transparently when accessed, so the histories of millions of users can be kept
+    during a long simulation (e.g. by PopulationSimulator). A user is written to disk only when it is evicted after
+    being modified.
+
+    The snapshot of the memory is the undo journal of Memory for the users in RAM and a savepoint of the database
+    for the users on disk, snapshots can be restored only in reverse order of creation (restoring a snapshot invalidates the newer ones).
+    The savepoint of a snapshot is released when the snapshot and all the newer ones have been garbage collected,
+    so that the changes are committed and the write-ahead log does not grow without bound.
+    The memory is emptied in place by clear, reusing the database, Simulatio4RecSys calls it at every reset
+    unless it is created with keep_memory=True.
+
+    Attributes:
+        items_loader (ItemsLoader): the items
+        path (string, optional): path of the database, by default a temporary file deleted by close
+        max_hot_users (integer): maximum number of users kept in RAM
+        eviction_policy (EvictionPolicy, optional): policy that bounds the history of every user, see Memory
+    """
+
+    def __init__(
+        self,
+        items_loader,
+        path: str = None,
+        max_hot_users: int = 10000,
+        eviction_policy: EvictionPolicy = None,
+    ):
+        super().__init__(items_loader, eviction_policy)
+        self.max_hot_users = max_hot_users
+        self._temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+        self.path = path
+        # transactions are managed explicitly with savepoints
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY,"
+            " num_items_interact INTEGER, interactions BLOB, eviction BLOB)"
+        )
+        self._finalizer = weakref.finalize(
+            self, _close_database, self._db, path if self._temporary else None
+        )
+        self._hot_users: typing.OrderedDict[int, None] = OrderedDict()
+        self._dirty_users = set()
+        self._num_snapshots = 0
+        # names of the savepoints open in the database, from the oldest, and of the ones no longer referenced
+        self._savepoints: typing.List[str] = []
+        self._dropped_savepoints: typing.Set[str] = set()
+
+    def _access(self, user_id: int, write: bool = False):
+        """
+        Makes sure the user is in RAM, loading it from the database if needed, and marks it as the most recently used
+        """
+        if user_id in self._hot_users:
+            self._hot_users.move_to_end(user_id)
+        else:
+            row = self._db.execute(
+                "SELECT num_items_interact, interactions, eviction FROM users"
+                " WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+            if row is not None:
+                self._load_user(user_id, *row)
+            self._hot_users[user_id] = None
+            self._evict()
+        if write:
+            self._dirty_users.add(user_id)
+
+    def _load_user(
+        self,
+        user_id: int,
+        num_items_interact: int,
+        data: bytes,
+        eviction: typing.Optional[bytes],
+    ):
+        self._initialize_user(user_id)
+        self.user_num_items_interact[user_id] = num_items_interact
+        if eviction is not None and user_id in self._user_evictions:
+            self._user_evictions[user_id] = pickle.loads(eviction)
+        seen_films = self.user_to_seen_films[user_id]
+        view = self._user_views[user_id]
+        for item_id, rating, timestamp, num_watches in np.frombuffer(data, dtype=_ROW):
+            item_id = int(item_id)
+            interaction = UserMovieInteraction(
+                float(rating), int(timestamp), int(num_watches)
+            )
+            if item_id in seen_films:
+                seen_films[item_id].append(interaction)
+                view.interactions[-1] = interaction
+            else:
+                seen_films[item_id] = [interaction]
+                view.add(item_id, self._load_item(item_id), interaction)
+
+    def _evict(self):
+        """
+        Moves the least recently used users to the database until at most max_hot_users are in RAM
+        """
+        while len(self._hot_users) > self.max_hot_users:
+            user_id, _ = self._hot_users.popitem(last=False)
+            if user_id in self._dirty_users:
+                self._dirty_users.discard(user_id)
+                rows = np.array(
+                    [
+                        (item_id, i.rating, i.timestamp, i.num_watches)
+                        for item_id, interactions in self.user_to_seen_films.get(
+                            user_id, {}
+                        ).items()
+                        for i in interactions
+                    ],
+                    dtype=_ROW,
+                )
+                eviction = self._user_evictions.get(user_id)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)",
+                    (
+                        user_id,
+                        self.user_num_items_interact.get(user_id, 0),
+                        rows.tobytes(),
+                        None if eviction is None else pickle.dumps(eviction),
+                    ),
+                )
+            self._remove_user(user_id)
+
+    def update_memory(
+        self, user_id: int, items_ids: typing.List[int], scores: typing.List[float]
+    ):
+        self._access(user_id, write=True)
+        super().update_memory(user_id, items_ids, scores)
+
+    def get_items_and_scores(self, user_id: int):
+        self._access(user_id)
+        return super().get_items_and_scores(user_id)
+
+    def delete_user_item(self, user_id: int, item_id: int):
+        self._access(user_id, write=True)
+        super().delete_user_item(user_id, item_id)
+
+    def delete_last_user_item_interaction(self, user_id: int, item_id: int):
+        self._access(user_id, write=True)
+        super().delete_last_user_item_interaction(user_id, item_id)
+
+    def get_num_interaction(self, user_id: int, item_id: int):
+        self._access(user_id)
+        return super().get_num_interaction(user_id, item_id)
+
+    def get_item_interactions(
+        self, user_id: int, item_id: int
+    ) -> typing.List[UserMovieInteraction]:
+        self._access(user_id)
+        return super().get_item_interactions(user_id, item_id)
+
+    def get_num_items_interact(self, user_id: int) -> int:
+        self._access(user_id)
+        return super().get_num_items_interact(user_id)
+
+    def snapshot(self):
+        """
+        Take a snapshot of the memory: the undo journal for the users in RAM, a savepoint for the database
+
+        Return:
+            snapshot (tuple): handle to pass to restore
+        """
+        self._release_dropped_savepoints()
+        name = f"snapshot{self._num_snapshots}"
+        self._num_snapshots += 1
+        self._db.execute(f"SAVEPOINT {name}")
+        self._savepoints.append(name)
+        return (
+            super().snapshot(),
+            OrderedDict(self._hot_users),
+            set(self._dirty_users),
+            _Savepoint(name, self._dropped_savepoints),
+        )
+
+    def _release_dropped_savepoints(self):
+        """
+        Releases the newest savepoints as long as their snapshots have been garbage collected,
+        releasing the oldest one commits the changes
+        """
+        while self._savepoints and self._savepoints[-1] in self._dropped_savepoints:
+            name = self._savepoints.pop()
+            self._dropped_savepoints.discard(name)
+            self._db.execute(f"RELEASE {name}")
+        self._dropped_savepoints.intersection_update(self._savepoints)
+
+    def restore(self, snapshot):
+        """
+        Bring the memory back to the state it had when snapshot was taken, the snapshot can be restored again later
+        as long as no older snapshot has been restored in the meantime
+
+        Args:
+            snapshot (tuple): handle returned by snapshot
+        """
+        memory_snapshot, hot_users, dirty_users, savepoint = snapshot
+        if savepoint.name not in self._savepoints:
+            raise ValueError(
+                "The snapshot is no longer valid, an older snapshot was restored"
+            )
+        self._db.execute(f"ROLLBACK TO {savepoint.name}")
+        # the newer savepoints have been cancelled by the rollback
+        del self._savepoints[self._savepoints.index(savepoint.name) + 1 :]
+        self._release_dropped_savepoints()
+        super().restore(memory_snapshot)
+        self._hot_users = OrderedDict(hot_users)
+        self._dirty_users = set(dirty_users)
+
+    def clear(self):
+        """
+        Forgets all the users, in RAM and in the database, which is reused.
+        Inside a snapshot the users are deleted from the database in the savepoint, so the snapshot can still be restored.
+        """
+        self._release_dropped_savepoints()
+        self._db.execute("DELETE FROM users")
+        journal = self._get_journal()
+        for name in (
+            "user_to_seen_films",
+            "user_num_items_interact",
+            "_user_views",
+            "_user_evictions",
+        ):
+            _setattr_logged(journal, self, name, {})
+        self._hot_users = OrderedDict()
+        self._dirty_users = set()
+
+    def close(self):
+        """
+        Closes the database, the temporary database is deleted. It is also done when the memory is garbage collected.
+        """
+        self._finalizer()
@@ -0,0 +1,144 @@
+import json
+import time
+import typing
+
+import numpy as np
+
+
+class _Span:
+    """
+    Context manager that adds the time spent inside it to a stage of a StageTimer
+    """
+
+    __slots__ = ("timer", "stage", "start")
+
+    def __init__(self, timer: "StageTimer", stage: str):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class StageTimer:
+    """
+    Low-overhead timing of the stages of a step, based on the monotonic clock time.perf_counter.
+    The time spent in each stage is accumulated during a step, at the end of the step the totals are available in step_timings
+    and are added to a rolling window of the last window steps, from which the percentiles are computed.
+
+    Attributes:
+        enabled (bool): if False, spans do nothing and no time is recorded
+        window (integer): number of steps kept for each stage to compute the percentiles
+    """
+
+    def __init__(self, enabled: bool = True, window: int = 10000):
+        self.enabled = enabled
+        self.window = window
+        self.step_timings: typing.Dict[str, float] = {}
+        self._history: typing.Dict[str, np.ndarray] = {}
+        self._count: typing.Dict[str, int] = {}
+        self._step_start = None
+
+    def span(self, stage: str):
+        """
+        Returns a context manager that times the code inside it as part of stage
+
+        Args:
+            stage (string): name of the stage
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def add(self, stage: str, duration: float):
+        """
+        Adds duration (in seconds) to the time spent in stage during the current step
+        """
+        self.step_timings[stage] = self.step_timings.get(stage, 0.0) + duration
+
+    def begin_step(self):
+        """
+        Starts a new step, the timings of the previous step are discarded
+        """
+        if not self.enabled:
+            return
+        self.step_timings = {}
+        self._step_start = time.perf_counter()
+
+    def end_step(self) -> typing.Dict[str, float]:
+        """
+        Ends the current step: the total time of the step is recorded under the stage "step" and the
+        timings of all stages are added to the rolling windows.
+
+        Return:
+            step_timings (dictionary from stage to seconds): the timings of the step
+        """
+        if not self.enabled:
+            return {}
+        if self._step_start is not None:
+            self.step_timings["step"] = time.perf_counter() - self._step_start
+            self._step_start = None
+        for stage, duration in self.step_timings.items():
+            if stage not in self._history:
+                self._history[stage] = np.zeros(self.window, dtype=np.float64)
+                self._count[stage] = 0
+            self._history[stage][self._count[stage] % self.window] = duration
+            self._count[stage] += 1
+        return dict(self.step_timings)
+
+    def summary(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """
+        Statistics of every stage over the rolling window, times are in milliseconds
+
+        Return:
+            dictionary from stage to a dictionary with the number of steps recorded, the mean, p50, p95 and p99
+        """
+        summary = {}
+        for stage, history in self._history.items():
+            values = history[: min(self._count[stage], self.window)] * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[stage] = {
+                "count": self._count[stage],
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+            }
+        return summary
+
+    def dump(self, path: str):
+        """
+        Writes the summary to a JSON file
+
+        Args:
+            path (string): path of the JSON file
+        """
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+
+    def reset(self):
+        """
+        Discards all the recorded timings
+        """
+        self.step_timings = {}
+        self._history = {}
+        self._count = {}
+        self._step_start = None
@@ -0,0 +1,200 @@
+import time
+import typing
+from copy import deepcopy
+
+import numpy as np
+from gymnasium.vector import SyncVectorEnv
+from gymnasium.vector.utils import concatenate
+
+from environment.env import Simulatio4RecSys
+
+
+class BatchedSimulatio4RecSys(SyncVectorEnv):
+    """
+    Vectorized environment that advances num_envs independent user sessions at once.
+    At every step the prompts of all the sessions are collected and sent to the LLM in a single batched request,
+    then selection, perturbation, memory update and reward shaping are applied to every session separately.
+
+    All the sub-environments must be Simulatio4RecSys objects sharing the same LLMRater.
+
+    The LLM samples the whole batch with a single seed, the llm_seed of the first session, since a batched generation
+    draws from one random generator. So with a sampling LLM the ratings depend on the composition of the batch and
+    a batched run is not reproducible by stepping the sessions one by one, with greedy decoding the ratings are the same.
+    With step_deadline_ms the deadline and the rating fallback of the first session apply to the whole batch.
+
+    Attributes:
+        env_fns (list of callables): functions that create the sub-environments
+        copy (bool): if True, reset and step return a copy of the observations
+    """
+
+    def __init__(
+        self,
+        env_fns: typing.Iterable[typing.Callable[[], Simulatio4RecSys]],
+        copy: bool = True,
+    ):
+        super().__init__(env_fns, copy=copy)
+
+        for env in self.envs:
+            if not isinstance(env, Simulatio4RecSys):
+                raise ValueError(
+                    "BatchedSimulatio4RecSys expects unwrapped Simulatio4RecSys"
+                    f" sub-environments, got {type(env).__name__}"
+                )
+        self.rating_prompt = self.envs[0].rating_prompt
+        if any(env.rating_prompt is not self.rating_prompt for env in self.envs):
+            raise ValueError("All the sub-environments must share the same LLMRater")
+        replay = self.envs[0].replay is not None
+        if any((env.replay is not None) != replay for env in self.envs):
+            raise ValueError(
+                "Either all or none of the sub-environments must be in replay mode"
+            )
+        step_deadline_ms = self.envs[0].step_deadline_ms
+        if any(env.step_deadline_ms != step_deadline_ms for env in self.envs):
+            raise ValueError(
+                "All the sub-environments must have the same step_deadline_ms"
+            )
+
+    def step_wait(self):
+        """
+        Steps all the sub-environments, the LLM is queried once for the whole batch.
+
+        Return:
+            the batched observations, rewards, terminateds, truncateds and infos
+        """
+        observations, infos = [], {}
+        for i, (env, step_result) in enumerate(
+            zip(self.envs, step_batch(self.envs, self._actions))
+        ):
+            (
+                observation,
+                self._rewards[i],
+                self._terminateds[i],
+                self._truncateds[i],
+                info,
+            ) = step_result
+
+            if self._terminateds[i] or self._truncateds[i]:
+                old_observation, old_info = observation, info
+                observation, info = env.reset()
+                info["final_observation"] = old_observation
+                info["final_info"] = old_info
+            observations.append(observation)
+            infos = self._add_info(infos, info, i)
+        self.observations = concatenate(
+            self.single_observation_space, observations, self.observations
+        )
+
+        return (
+            deepcopy(self.observations) if self.copy else self.observations,
+            np.copy(self._rewards),
+            np.copy(self._terminateds),
+            np.copy(self._truncateds),
+            infos,
+        )
+
+
+def step_batch(
+    envs: typing.List[Simulatio4RecSys], actions, return_exceptions: bool = False
+) -> typing.List[tuple]:
+    """
+    Steps every environment with its action, the prompts of all the environments are sent to the LLM in a single batched request,
+    then selection, perturbation, memory update and reward shaping are applied to every environment separately.
+    The environments must share the same LLMRater and either all or none of them must be in replay mode.
+
+    Args:
+        envs (list of Simulatio4RecSys): the environments, each at most once
+        actions (list): the action of every environment
+        return_exceptions (bool): if True, an exception raised by an environment (e.g. for an invalid action) is returned
+                                  in place of its result and the other environments are stepped, otherwise it is raised.
+                                  An exception of the batched LLM request is always raised, and no environment is stepped
+
+    Return:
+        for every environment the same tuple as step, or the exception it raised
+    """
+    results = [None] * len(envs)
+
+    def run(i, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results[i] = e
+
+    for env in envs:
+        env.timer.begin_step()
+    queries = [
+        run(i, env._get_rating_queries, action)
+        for i, (env, action) in enumerate(zip(envs, actions))
+    ]
+    valid = [i for i in range(len(envs)) if results[i] is None]
+
+    ratings, raws = [None] * len(envs), [None] * len(envs)
+    if envs[0].replay is not None:
+        for i in valid:
+            with envs[i].timer.span("llm"):
+                out = run(i, envs[i]._query_ratings, queries[i])
+            if out is not None:
+                ratings[i], raws[i] = out
+    elif valid:
+        batch_ratings, batch_raws = _query_batch(
+            [envs[i] for i in valid], [queries[i] for i in valid]
+        )
+        for i, env_ratings, env_raw in zip(valid, batch_ratings, batch_raws):
+            ratings[i], raws[i] = env_ratings, env_raw
+
+    for i in valid:
+        if results[i] is None:
+            step_result = run(
+                i, envs[i]._apply_ratings, queries[i], ratings[i], raws[i]
+            )
+            if step_result is not None:
+                results[i] = step_result
+    return results
+
+
+def _query_batch(envs: typing.List[Simulatio4RecSys], queries):
+    """
+    Rates the queries of all the environments with a single request to the LLM
+
+    Args:
+        envs (list of Simulatio4RecSys): the environments
+        queries (list of lists of RatingQuery): the queries of every environment
+
+    Return:
+        the results and the raw answers of the LLM of every environment
+    """
+
+    """
+    The batch is sampled with the seed of the first session (see BatchedSimulatio4RecSys), every session then advances
+    its own seed as if it had been stepped on its own.
+    """
+    flat_queries = [query for env_queries in queries for query in env_queries]
+    llm_start = time.perf_counter()
+    if envs[0].step_deadline_ms is not None:
+        envs[0]._rating_fallback_used = False
+        flat_results, flat_raw = envs[0]._request_ratings_with_deadline(
+            flat_queries, envs[0].llm_seed, envs[0].step_deadline_ms / 1000
+        )
+        for env in envs:
+            env._rating_fallback_used = envs[0]._rating_fallback_used
+    else:
+        flat_results, flat_raw = envs[0]._request_ratings(
+            flat_queries,
+            envs[0].llm_seed,
+            any(env.recorder is not None for env in envs),
+        )
+    llm_duration = time.perf_counter() - llm_start
+    for env in envs:
+        env.llm_seed += 1
+        if env.timer.enabled:
+            env.timer.add("llm", llm_duration)
+
+    results, raws = [], []
+    start = 0
+    for env_queries in queries:
+        end = start + len(env_queries)
+        results.append(flat_results[start:end])
+        raws.append(flat_raw[start:end] if flat_raw is not None else None)
+        start = end
+    return results, raws
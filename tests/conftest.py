@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the environment package from the root of the repository, also when run with pytest instead of python -m pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
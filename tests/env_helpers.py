@@ -0,0 +1,160 @@
+import time
+import typing
+import zlib
+
+import torch
+
+from environment.env import Simulatio4RecSys
+from environment.item import Item, ItemsLoader
+from environment.items_retrieval import TimeItemsRetrieval
+from environment.items_selection import GreedySelector
+from environment.LLM import LLMRater
+from environment.LLM.llm import LLM
+from environment.reward_perturbator import GaussianPerturbator
+from environment.reward_shaping import RewardReshapingRandomWatch
+from environment.users import User, UsersListLoader
+
+"""
+Helpers shared by the tests of the environment: a small catalog, a few users and a fake LLM, so that the environment
+runs end to end (prompts, seeds, ratings, memory) without a model
+"""
+NUM_ITEMS = 20
+NUM_USERS = 5
+
+
+class FakeItem(Item):
+    def __init__(self, id: int):
+        super().__init__(id, f"Item {id}")
+        self.title = f"Item {id}"
+        self.vote_average = 1 + id % 9
+
+
+class FakeItemsLoader(ItemsLoader):
+    def __init__(self, num_items: int = NUM_ITEMS):
+        self.items = {id: FakeItem(id) for id in range(num_items)}
+
+    def load_all_ids(self) -> typing.List[int]:
+        return list(self.items)
+
+    def load_items(self) -> typing.List[Item]:
+        return list(self.items.values())
+
+    def load_items_from_ids(self, id_list: typing.List[int]) -> typing.List[Item]:
+        return [self.items[id] for id in id_list]
+
+
+def make_users_loader(num_users: int = NUM_USERS) -> UsersListLoader:
+    return UsersListLoader(
+        [
+            User(f"User {i}", "M" if i % 2 == 0 else "F", 20 + i, f"a person {i}")
+            for i in range(num_users)
+        ]
+    )
+
+
+class FakeLLM(LLM):
+    """
+    LLM whose answer to a rating request is a digit derived from the prompt and, if sample is True, from a draw of the
+    torch generator, so that it depends on the seed of the request as the answer of a sampling model does.
+    Every request is logged in requests as (name of the method, number of dialogs, True if the lock was held).
+
+    Attributes:
+        sample (bool): if False the answer depends only on the prompt, as for a model decoding greedily
+        delay (float): seconds every request takes
+    """
+
+    def __init__(self, sample: bool = True, delay: float = 0.0):
+        super().__init__("fake")
+        self.sample = sample
+        self.delay = delay
+        self.requests: typing.List[typing.Tuple[str, int, bool]] = []
+
+    def _log(self, name: str, num_dialogs: int):
+        self.requests.append((name, num_dialogs, self.lock.locked()))
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+    def _answer(self, dialog) -> typing.Tuple[str, str]:
+        prompt = "".join(message["content"] for message in dialog)
+        digit = zlib.crc32(prompt.encode("utf-8"))
+        if self.sample:
+            digit += int(torch.randint(0, 10, (1,)))
+        return prompt, str(digit % 10)
+
+    def request_rating_0_9(self, system_prompt, dialog):
+        self._log("request_rating_0_9", 1)
+        return self._answer(dialog)
+
+    def request_rating_0_9_batch(self, system_prompt, dialogs):
+        self._log("request_rating_0_9_batch", len(dialogs))
+        return [self._answer(dialog) for dialog in dialogs]
+
+    def request_rating_1_10(self, system_prompt, dialog):
+        raise NotImplementedError
+
+    def request_rating_text(self, system_prompt, dialog):
+        raise NotImplementedError
+
+    def request_explanation(self, system_prompt, dialog):
+        self._log("request_explanation", 1)
+        return "", "explanation"
+
+    def num_requests(self) -> int:
+        return len(self.requests)
+
+
+class FakeRater(LLMRater):
+    """
+    Rater with a one-line prompt containing everything the rating depends on: the user, the item,
+    the number of watches and the retrieved items with their ratings
+    """
+
+    def __init__(self, llm: LLM):
+        super().__init__(llm, ["vote_average"], ["rating"])
+
+    def adjust_rating_in(self, rating):
+        return rating - 1
+
+    def adjust_rating_out(self, rating):
+        return rating + 1
+
+    def adjust_text_in(self, text):
+        return text
+
+    def _get_prompt(self, user, item, num_interacted, interactions, retrieved_items):
+        history = ", ".join(
+            f"{m.title} ({i.rating})" for m, i in zip(retrieved_items, interactions)
+        )
+        return [
+            {
+                "role": "user",
+                "content": f"{user.name} watches {item.title} for the"
+                f" {self.number_to_rank(num_interacted + 1)} time, after: {history}",
+            },
+            {"role": "assistant_start", "content": "Rating: "},
+        ]
+
+    def _get_few_shot_prompts(self):
+        return []
+
+    def _get_prompt_explanation(self, prompt, rating):
+        return prompt[:1] + [{"role": "assistant", "content": str(rating)}]
+
+
+def make_env(llm: LLM = None, **kwargs) -> Simulatio4RecSys:
+    """
+    Environment on the fake catalog, rated by FakeRater (or llm_rater), with random selection, perturbation and reward
+    shaping so that the tests also cover their random generators
+    """
+    return Simulatio4RecSys(
+        render_mode=kwargs.pop("render_mode", None),
+        items_loader=FakeItemsLoader(),
+        users_loader=make_users_loader(),
+        items_selector=GreedySelector(),
+        reward_perturbator=GaussianPerturbator(),
+        items_retrieval=TimeItemsRetrieval(3),
+        reward_shaping=RewardReshapingRandomWatch(q=0.5),
+        llm_rater=kwargs.pop("llm_rater", None)
+        or FakeRater(llm if llm is not None else FakeLLM()),
+        **kwargs,
+    )
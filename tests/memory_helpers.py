@@ -0,0 +1,64 @@
+import random
+import typing
+
+"""
+Helpers shared by the tests of the memory backends: the backends expose the same interface as Memory,
+so they are compared by applying the same random operations and reading back everything they expose
+"""
+
+
+class ItemsLoader:
+    """
+    Items loader whose items are the strings "item<id>", enough for the memories which only store and return them
+    """
+
+    def load_items_from_ids(self, id_list: typing.List[int]):
+        return [f"item{item_id}" for item_id in id_list]
+
+
+def as_tuple(interaction):
+    return (interaction.rating, interaction.timestamp, interaction.num_watches)
+
+
+def get_state(memory, num_users: int, num_items: int) -> dict:
+    """
+    Return everything the memory exposes about the users with id below num_users and the items with id below num_items
+    """
+    state = {}
+    for user_id in range(num_users):
+        items, interactions = memory.get_items_and_scores(user_id)
+        state[user_id] = (
+            memory.get_num_items_interact(user_id),
+            list(items),
+            [as_tuple(i) for i in interactions],
+            [memory.get_num_interaction(user_id, i) for i in range(num_items)],
+            [
+                [as_tuple(x) for x in memory.get_item_interactions(user_id, i)]
+                for i in range(num_items)
+            ],
+        )
+    return state
+
+
+def apply_random_operation(
+    memories: list, rnd: random.Random, num_users: int, num_items: int
+):
+    """
+    Applies the same random update or deletion to all the memories, the ratings are integers so that they are
+    stored exactly also in float32 columns
+    """
+    user_id = rnd.randrange(num_users)
+    item_id = rnd.randrange(num_items)
+    operation = rnd.random()
+    watched = memories[0].get_num_interaction(user_id, item_id) > 0
+    for memory in memories:
+        if operation < 0.1 and watched:
+            memory.delete_user_item(user_id, item_id)
+        elif operation < 0.2 and watched:
+            memory.delete_last_user_item_interaction(user_id, item_id)
+    if operation < 0.2 and watched:
+        return
+    items_ids = [rnd.randrange(num_items) for _ in range(rnd.randint(1, 3))]
+    scores = [float(rnd.randint(1, 10)) for _ in items_ids]
+    for memory in memories:
+        memory.update_memory(user_id, items_ids, scores)
@@ -0,0 +1,48 @@
+import asyncio
+
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+
+ACTIONS = np.random.RandomState(0).randint(NUM_ITEMS, size=15)
+
+
+def _run(env, step) -> list:
+    env.reset(seed=0)
+    trace = []
+    for action in ACTIONS:
+        _, reward, terminated, truncated, info = step(action)
+        trace.append((reward, info["LLM_rating"], env.llm_seed))
+        if terminated or truncated:
+            env.reset()
+    return trace
+
+
+def test_astep_matches_step():
+    env = make_env(FakeLLM())
+    expected = _run(env, env.step)
+    env = make_env(FakeLLM())
+    assert _run(env, lambda action: asyncio.run(env.astep(action))) == expected
+
+
+def test_openai_text_ratings_are_requested_concurrently(monkeypatch):
+    openai = pytest.importorskip("openai")
+    from environment.LLM.openai_api import OpenAIModelAPI
+
+    in_flight, max_in_flight = 0, 0
+
+    async def acreate(model, messages, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return {"choices": [{"message": {"content": messages[-1]["content"]}}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", acreate)
+    llm = OpenAIModelAPI("gpt-test")
+    dialogs = [[{"role": "user", "content": word}] for word in ["one", "two", "three"]]
+    outs = llm.request_rating_text_batch(None, dialogs)
+    assert [out for _, out in outs] == ["one", "two", "three"]
+    assert max_in_flight == 3
+    assert llm.request_rating_text(None, dialogs[0])[1] == "one"
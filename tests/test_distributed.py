@@ -0,0 +1,60 @@
+import threading
+
+import gymnasium as gym
+from stable_baselines3 import DQN
+
+from algorithms.distributed import RolloutCoordinator, RolloutWorker
+
+NUM_WORKERS = 3
+
+
+def _make_model() -> DQN:
+    return DQN(
+        "MlpPolicy",
+        gym.make("CartPole-v1"),
+        learning_starts=10,
+        train_freq=4,
+        batch_size=8,
+        seed=0,
+    )
+
+
+def test_coordinator_trains_on_the_transitions_of_local_workers():
+    model = _make_model()
+    coordinator = RolloutCoordinator(model.policy, port=0)
+    workers = [
+        RolloutWorker(
+            coordinator.address,
+            gym.make("CartPole-v1"),
+            _make_model().policy,
+            steps_per_message=16,
+            seed=i,
+        )
+        for i in range(NUM_WORKERS)
+    ]
+    threads = [
+        threading.Thread(target=worker.run, kwargs={"max_steps": 10000, "seed": i})
+        for i, worker in enumerate(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        coordinator.learn(model, total_timesteps=100, broadcast_interval=20, timeout=30)
+        # the messages have 16 transitions, the ones after total_timesteps are not trained on
+        assert model.num_timesteps == 100
+        assert model.replay_buffer.size() == 100
+        assert model._current_progress_remaining == 0.0
+        # the initial broadcast and one every 20 transitions, also in the middle of a message
+        assert coordinator.version == 6
+        assert coordinator.num_workers == NUM_WORKERS
+
+        coordinator.learn(model, total_timesteps=50, broadcast_interval=20, timeout=30)
+        assert model.num_timesteps == 150
+        assert model.replay_buffer.size() == 150
+    finally:
+        coordinator.close()
+        for thread in threads:
+            thread.join(timeout=30)
+        for worker in workers:
+            worker.close()
+    assert all(worker.version is not None for worker in workers)
@@ -0,0 +1,62 @@
+import functools
+
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+
+from environment.memory import ColumnarMemory, EvictionPolicyKeepLast, Memory
+from environment.tiered_memory import TieredMemory
+
+MEMORY_FACTORIES = {
+    "Memory": Memory,
+    "Memory-eviction": functools.partial(
+        Memory, eviction_policy=EvictionPolicyKeepLast(max_interactions=3)
+    ),
+    "ColumnarMemory": ColumnarMemory,
+    "TieredMemory": functools.partial(TieredMemory, max_hot_users=2),
+}
+
+
+def _get_state(env) -> dict:
+    return {
+        "llm_seed": env.llm_seed,
+        "items_interact": env._items_interact.tolist(),
+        "rng_states": [rng.bit_generator.state for rng in env._get_random_generators()],
+    }
+
+
+def _run(env, actions) -> list:
+    """
+    Steps the environment with the actions, resetting it at the end of the episodes,
+    return the observations, rewards and state after every step
+    """
+    trace = []
+    for action in actions:
+        observation, reward, terminated, truncated, _ = env.step(action)
+        trace.append(
+            (
+                {key: np.asarray(value).tolist() for key, value in observation.items()},
+                reward,
+                _get_state(env),
+            )
+        )
+        if terminated or truncated:
+            env.reset()
+    return trace
+
+
+@pytest.mark.parametrize("memory_factory", list(MEMORY_FACTORIES))
+def test_restore_replays_the_same_steps(memory_factory):
+    env = make_env(FakeLLM(), memory_factory=MEMORY_FACTORIES[memory_factory])
+    rnd = np.random.RandomState(0)
+    env.reset(seed=0)
+    _run(env, rnd.randint(NUM_ITEMS, size=5))
+    snapshot = env.snapshot()
+    state = _get_state(env)
+    actions = rnd.randint(NUM_ITEMS, size=30)
+    expected = _run(env, actions)
+    for _ in range(2):
+        env.restore(snapshot)
+        assert _get_state(env) == state
+        assert _run(env, actions) == expected
+    env.close()
@@ -0,0 +1,82 @@
+import functools
+import os
+
+import pytest
+from env_helpers import NUM_ITEMS, NUM_USERS, FakeLLM, make_env
+
+from algorithms.evaluation import evaluate_sharded, get_shard_path, get_shards
+from environment.render_sink import read_render_log
+
+
+def _evaluate_shard(seed, first_user_id, num_episodes, render_path):
+    """
+    Plays num_episodes episodes in evaluation mode, every episode is seeded with its user id so that its rewards
+    do not depend on the shard which plays it
+    """
+    env = make_env(
+        FakeLLM(),
+        render_mode="csv" if render_path is not None else None,
+        render_path=render_path,
+        evaluation=True,
+        evaluation_first_user_id=first_user_id,
+    )
+    rewards, lengths = [], []
+    for episode in range(num_episodes):
+        env.reset(seed=seed + first_user_id + episode)
+        total, length, terminated = 0.0, 0, False
+        while not terminated:
+            _, reward, terminated, _, _ = env.step((length * 7) % NUM_ITEMS)
+            if render_path is not None:
+                env.render()
+            total += reward
+            length += 1
+        rewards.append(total)
+        lengths.append(length)
+    env.close()
+    return rewards, lengths
+
+
+@pytest.mark.parametrize(
+    "num_episodes, num_shards, expected",
+    [
+        (5, 2, [(0, 3), (3, 2)]),
+        (6, 3, [(0, 2), (2, 2), (4, 2)]),
+        (2, 4, [(0, 1), (1, 1)]),
+    ],
+)
+def test_get_shards(num_episodes, num_shards, expected):
+    assert get_shards(num_episodes, num_shards) == expected
+
+
+def test_sharded_evaluation_matches_a_single_worker(tmp_path):
+    evaluate_shard = functools.partial(_evaluate_shard, 0)
+    single = evaluate_sharded(
+        evaluate_shard,
+        NUM_USERS,
+        num_workers=1,
+        logs_path=str(tmp_path / "single" / "render.csv"),
+    )
+    logs_path = str(tmp_path / "render.csv")
+    report_path = str(tmp_path / "report" / "report.json")
+    sharded = evaluate_sharded(
+        evaluate_shard,
+        NUM_USERS,
+        num_workers=2,
+        logs_path=logs_path,
+        report_path=report_path,
+    )
+
+    assert sharded["episode_rewards"] == single["episode_rewards"]
+    assert sharded["episode_lengths"] == single["episode_lengths"] == [11] * NUM_USERS
+    assert sharded["mean_reward"] == pytest.approx(single["mean_reward"])
+    assert [(s["first_user_id"], s["num_episodes"]) for s in sharded["shards"]] == [
+        (0, 3),
+        (3, 2),
+    ]
+    assert os.path.exists(report_path)
+
+    # the logs of the shards are merged in order of user and deleted
+    log = read_render_log(logs_path)
+    assert list(log["user_id"]) == [u for u in range(NUM_USERS) for _ in range(11)]
+    assert log.equals(read_render_log(str(tmp_path / "single" / "render.csv")))
+    assert not any(os.path.exists(get_shard_path(logs_path, i)) for i in range(2))
@@ -0,0 +1,122 @@
+import random
+
+import pytest
+from memory_helpers import ItemsLoader, apply_random_operation, as_tuple, get_state
+
+from environment.memory import (
+    EvictionPolicyKeepExtremes,
+    EvictionPolicyKeepLast,
+    EvictionPolicyTimeDecay,
+    Memory,
+)
+from environment.tiered_memory import TieredMemory
+
+NUM_USERS = 5
+NUM_ITEMS = 8
+
+
+def _num_interactions(memory, user_id):
+    return sum(len(x) for x in memory.user_to_seen_films[user_id].values())
+
+
+def test_keep_last_bounds_the_history():
+    memory = Memory(ItemsLoader(), EvictionPolicyKeepLast(max_interactions=3))
+    memory.update_memory(0, [1, 2, 3, 4, 5], [1.0, 2.0, 3.0, 4.0, 5.0])
+    assert _num_interactions(memory, 0) == 3
+    items, _ = memory.get_items_and_scores(0)
+    assert items == ["item3", "item4", "item5"]
+    assert memory.get_num_items_interact(0) == 5
+
+
+def test_forgotten_interactions_keep_the_watch_count():
+    memory = Memory(ItemsLoader(), EvictionPolicyKeepLast(max_interactions=1))
+    memory.update_memory(0, [1, 2, 1, 2, 1], [1.0, 2.0, 3.0, 4.0, 5.0])
+    assert _num_interactions(memory, 0) == 1
+    assert memory.get_num_interaction(0, 1) == 3
+    assert memory.get_num_interaction(0, 2) == 2
+    # the interactions in the memory and the last one forgotten
+    assert [as_tuple(x) for x in memory.get_item_interactions(0, 2)] == [(4.0, 4, 2)]
+    assert [as_tuple(x) for x in memory.get_item_interactions(0, 1)] == [
+        (3.0, 3, 2),
+        (5.0, 5, 3),
+    ]
+
+
+def test_time_decay_forgets_the_old_interactions():
+    policy = EvictionPolicyTimeDecay(decay=0.5, threshold=0.2)
+    memory = Memory(ItemsLoader(), policy)
+    memory.update_memory(0, list(range(6)), [1.0] * 6)
+    max_age = int(policy.max_age)
+    items, _ = memory.get_items_and_scores(0)
+    assert items == [f"item{i}" for i in range(5 - max_age, 6)]
+
+
+def test_keep_extremes_forgets_the_neutral_ratings_first():
+    memory = Memory(
+        ItemsLoader(), EvictionPolicyKeepExtremes(max_interactions=3, neutral_rating=5)
+    )
+    memory.update_memory(0, [1, 2, 3, 4, 5], [1.0, 5.0, 10.0, 6.0, 5.0])
+    items, _ = memory.get_items_and_scores(0)
+    assert items == ["item1", "item3", "item4"]
+
+
+def test_deleted_item_is_forgotten_with_its_evictions():
+    memory = Memory(ItemsLoader(), EvictionPolicyKeepLast(max_interactions=1))
+    memory.update_memory(0, [1, 1, 2], [1.0, 2.0, 3.0])
+    memory.delete_user_item(0, 1)
+    assert memory.get_num_interaction(0, 1) == 0
+    assert memory.get_item_interactions(0, 1) == []
+    memory.update_memory(0, [1], [4.0])
+    assert memory.get_num_interaction(0, 1) == 1
+
+
+@pytest.mark.parametrize(
+    "policy",
+    [
+        EvictionPolicyKeepLast(max_interactions=4),
+        EvictionPolicyTimeDecay(decay=0.8, threshold=0.3),
+        EvictionPolicyKeepExtremes(max_interactions=4),
+    ],
+    ids=["keep_last", "time_decay", "keep_extremes"],
+)
+def test_tiered_memory_matches_memory(policy):
+    rnd = random.Random(0)
+    reference = Memory(ItemsLoader(), policy)
+    memory = TieredMemory(ItemsLoader(), max_hot_users=2, eviction_policy=policy)
+    for step in range(300):
+        apply_random_operation([reference, memory], rnd, NUM_USERS, NUM_ITEMS)
+        if step % 10 == 0:
+            assert get_state(memory, NUM_USERS, NUM_ITEMS) == get_state(
+                reference, NUM_USERS, NUM_ITEMS
+            )
+    memory.close()
+
+
+@pytest.mark.parametrize(
+    "policy",
+    [
+        EvictionPolicyKeepLast(max_interactions=3),
+        EvictionPolicyTimeDecay(decay=0.8, threshold=0.3),
+        EvictionPolicyKeepExtremes(max_interactions=3),
+    ],
+    ids=["keep_last", "time_decay", "keep_extremes"],
+)
+def test_restore_brings_back_the_evictions(policy):
+    rnd = random.Random(1)
+    memory = Memory(ItemsLoader(), policy)
+    for _ in range(50):
+        apply_random_operation([memory], rnd, NUM_USERS, NUM_ITEMS)
+    snapshot = memory.snapshot()
+    expected = get_state(memory, NUM_USERS, NUM_ITEMS)
+    for _ in range(50):
+        apply_random_operation([memory], rnd, NUM_USERS, NUM_ITEMS)
+    memory.restore(snapshot)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == expected
+    # the state of the policy is restored too, so the same steps evict the same interactions
+    for _ in range(50):
+        apply_random_operation([memory], random.Random(2), NUM_USERS, NUM_ITEMS)
+    after = get_state(memory, NUM_USERS, NUM_ITEMS)
+    memory.restore(snapshot)
+    for _ in range(50):
+        apply_random_operation([memory], random.Random(2), NUM_USERS, NUM_ITEMS)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == after
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+from gymnasium.vector import SyncVectorEnv
+
+from environment.fork_server import ForkServer, ForkServerVectorEnv
+
+NUM_ENVS = 3
+
+
+def _load_shared():
+    return {"pid": os.getpid()}
+
+
+def _make_env(shared, index):
+    env = make_env(FakeLLM())
+    env.shared_pid = shared["pid"]
+    return env
+
+
+def _as_list(value):
+    if isinstance(value, dict):
+        return {key: _as_list(v) for key, v in value.items()}
+    if isinstance(value, (tuple, list)):
+        return [_as_list(v) for v in value]
+    return np.asarray(value).tolist()
+
+
+def _assert_equal(a, b):
+    assert _as_list(a) == _as_list(b)
+
+
+@pytest.fixture
+def fork_server():
+    fork_server = ForkServer(_load_shared, _make_env)
+    yield fork_server
+    fork_server.close()
+
+
+def test_workers_share_the_data_of_the_fork_server(fork_server):
+    env = ForkServerVectorEnv(fork_server, NUM_ENVS)
+    assert env.call("shared_pid") == (fork_server._process.pid,) * NUM_ENVS
+    assert fork_server._process.pid != os.getpid()
+    env.close()
+
+
+def test_steps_match_sync_vector_env(fork_server):
+    env = ForkServerVectorEnv(fork_server, NUM_ENVS)
+    expected = SyncVectorEnv(
+        [lambda i=i: _make_env(_load_shared(), i) for i in range(NUM_ENVS)]
+    )
+    _assert_equal(env.reset(seed=0)[0], expected.reset(seed=0)[0])
+    rnd = np.random.RandomState(0)
+    for _ in range(60):
+        actions = rnd.randint(NUM_ITEMS, size=NUM_ENVS)
+        observation, reward, terminated, truncated, _ = env.step(actions)
+        (
+            expected_observation,
+            expected_reward,
+            expected_terminated,
+            expected_truncated,
+            _,
+        ) = expected.step(actions)
+        _assert_equal(observation, expected_observation)
+        np.testing.assert_array_equal(reward, expected_reward)
+        np.testing.assert_array_equal(terminated, expected_terminated)
+        np.testing.assert_array_equal(truncated, expected_truncated)
+    env.close()
+    expected.close()
+
+
+def test_worker_errors_are_raised():
+    def make_failing_env(shared, index):
+        raise ValueError("no environment")
+
+    fork_server = ForkServer(_load_shared, make_failing_env)
+    with pytest.raises(RuntimeError, match="no environment"):
+        ForkServerVectorEnv(fork_server, 1)
+    fork_server.close()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+
+from algorithms.wrappers import HierarchicalActionWrapper, get_metadata_clusters
+
+
+def test_metadata_clusters_are_split():
+    clusters = get_metadata_clusters(
+        make_env(FakeLLM()), field="vote_average", max_cluster_size=2
+    )
+    assert sorted(a for cluster in clusters for a in cluster) == list(range(NUM_ITEMS))
+    assert all(1 <= len(cluster) <= 2 for cluster in clusters)
+    for cluster in clusters:
+        assert len({a % 9 for a in cluster}) == 1
+
+
+@pytest.mark.parametrize("slate_size", [None, 3])
+def test_reverse_action_round_trip(slate_size):
+    kwargs = {} if slate_size is None else {"slate_size": slate_size}
+    env = make_env(FakeLLM(), **kwargs)
+    clusters = get_metadata_clusters(env, field="vote_average", max_cluster_size=2)
+    wrapper = HierarchicalActionWrapper(env, clusters)
+    for action in range(NUM_ITEMS):
+        actions = action if slate_size is None else np.full(slate_size, action)
+        hierarchical = wrapper.reverse_action(actions)
+        assert wrapper.action_space.contains(hierarchical)
+        np.testing.assert_array_equal(wrapper.action(hierarchical), actions)
+
+
+def test_indexes_are_spread_over_the_cluster():
+    env = make_env(FakeLLM())
+    wrapper = HierarchicalActionWrapper(env, [[0, 1, 2, 3], [4, 5], [6]])
+    assert list(wrapper.action_space.nvec) == [3, 4]
+    assert [wrapper.action([1, i]) for i in range(4)] == [4, 4, 5, 5]
+    assert [wrapper.action([2, i]) for i in range(4)] == [6, 6, 6, 6]
+    # the first index of an action within its cluster
+    np.testing.assert_array_equal(wrapper.reverse_action(5), [1, 2])
+
+
+def test_empty_clusters_are_rejected():
+    with pytest.raises(ValueError):
+        HierarchicalActionWrapper(make_env(FakeLLM()), [[0, 1], []])
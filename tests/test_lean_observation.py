@@ -0,0 +1,34 @@
+import numpy as np
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+
+ACTIONS = np.random.RandomState(0).randint(NUM_ITEMS, size=6)
+
+
+def test_lean_observation_is_a_view_of_the_buffer():
+    env = make_env(FakeLLM(), lean_observation=True, observation_text=False)
+    reference = make_env(FakeLLM())
+    observation, _ = env.reset(seed=0, user_id=1)
+    reference.reset(seed=0, user_id=1)
+    assert "user_name" not in observation and "user_description" not in observation
+    for action in ACTIONS:
+        observation, *_ = env.step(action)
+        expected, *_ = reference.step(action)
+        assert env.observation_space.contains(observation)
+        # no copy of the history is made at every step
+        assert observation["items_interact"] is env._items_interact_buffer
+        length = observation["items_interact_len"]
+        np.testing.assert_array_equal(
+            observation["items_interact"][:length], np.array(expected["items_interact"])
+        )
+
+
+def test_lean_episode_is_truncated_before_the_buffer_overflows():
+    env = make_env(FakeLLM(), lean_observation=True, max_items_interact=4)
+    env.reset(seed=1)
+    buffer = env._items_interact_buffer
+    for step in range(4):
+        observation, _, terminated, truncated, _ = env.step(step)
+        assert not terminated
+        assert truncated == (step == 3)
+    assert observation["items_interact_len"] == 4
+    assert env._items_interact_buffer is buffer
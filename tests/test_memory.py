@@ -0,0 +1,195 @@
+import functools
+import random
+
+import numpy as np
+import pytest
+from memory_helpers import ItemsLoader, apply_random_operation, as_tuple, get_state
+
+from environment.memory import ColumnarMemory, Memory
+from environment.shared_columnar_memory import SharedColumnarMemory
+from environment.tiered_memory import TieredMemory
+
+NUM_USERS = 5
+NUM_ITEMS = 8
+
+# backends with the same interface of Memory, compared to it
+BACKEND_FACTORIES = {
+    "ColumnarMemory": ColumnarMemory,
+    # fewer users in RAM than NUM_USERS, so that the users go back and forth from the database
+    "TieredMemory": functools.partial(TieredMemory, max_hot_users=2),
+    "SharedColumnarMemory": functools.partial(
+        SharedColumnarMemory, num_users=NUM_USERS, num_locks=2
+    ),
+}
+MEMORY_FACTORIES = {"Memory": Memory, **BACKEND_FACTORIES}
+
+
+def _make(factories, request):
+    memory = factories[request.param](ItemsLoader())
+    yield memory
+    if hasattr(memory, "close"):
+        memory.close()
+
+
+@pytest.fixture(params=list(MEMORY_FACTORIES))
+def memory(request):
+    yield from _make(MEMORY_FACTORIES, request)
+
+
+@pytest.fixture(params=list(BACKEND_FACTORIES))
+def backend(request):
+    yield from _make(BACKEND_FACTORIES, request)
+
+
+def _run(memory, rnd, steps):
+    for _ in range(steps):
+        apply_random_operation([memory], rnd, NUM_USERS, NUM_ITEMS)
+
+
+def test_restore_discards_the_changes_after_the_snapshot(memory):
+    rnd = random.Random(0)
+    _run(memory, rnd, 100)
+    expected = get_state(memory, NUM_USERS, NUM_ITEMS)
+    snapshot = memory.snapshot()
+    _run(memory, rnd, 100)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) != expected
+    memory.restore(snapshot)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == expected
+
+
+def test_snapshot_can_be_restored_again(memory):
+    rnd = random.Random(1)
+    _run(memory, rnd, 50)
+    snapshot = memory.snapshot()
+    expected = get_state(memory, NUM_USERS, NUM_ITEMS)
+    for _ in range(3):
+        _run(memory, rnd, 50)
+        memory.restore(snapshot)
+        assert get_state(memory, NUM_USERS, NUM_ITEMS) == expected
+
+
+def test_restore_repeats_the_same_steps(memory):
+    """
+    The steps after a restore start from the state of the snapshot, so replaying them gives the same memory
+    """
+    _run(memory, random.Random(2), 50)
+    snapshot = memory.snapshot()
+    _run(memory, random.Random(3), 50)
+    expected = get_state(memory, NUM_USERS, NUM_ITEMS)
+    memory.restore(snapshot)
+    _run(memory, random.Random(3), 50)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == expected
+
+
+def test_nested_snapshots_are_restored_newest_first(memory):
+    rnd = random.Random(4)
+    _run(memory, rnd, 30)
+    outer = memory.snapshot()
+    outer_state = get_state(memory, NUM_USERS, NUM_ITEMS)
+    _run(memory, rnd, 30)
+    inner = memory.snapshot()
+    inner_state = get_state(memory, NUM_USERS, NUM_ITEMS)
+    _run(memory, rnd, 30)
+    memory.restore(inner)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == inner_state
+    memory.restore(outer)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == outer_state
+
+
+def test_snapshot_does_not_copy_the_histories():
+    """
+    After a snapshot the changes are undone from the journal, the history of the user is modified in place
+    """
+    memory = Memory(ItemsLoader())
+    memory.update_memory(0, list(range(NUM_ITEMS)), [1.0] * NUM_ITEMS)
+    seen_films, view = memory.user_to_seen_films[0], memory._user_views[0]
+    snapshot = memory.snapshot()
+    memory.update_memory(0, [1], [2.0])
+    memory.delete_user_item(0, 2)
+    assert memory.user_to_seen_films[0] is seen_films
+    assert memory._user_views[0] is view
+    memory.restore(snapshot)
+    assert memory.get_num_interaction(0, 1) == 1
+    assert memory.get_num_interaction(0, 2) == 1
+    # without snapshots referenced the changes are no longer logged
+    del snapshot
+    memory.update_memory(0, [1], [2.0])
+    assert memory._journal is None
+
+
+def test_restoring_an_older_snapshot_invalidates_the_newer_ones():
+    memory = Memory(ItemsLoader())
+    outer = memory.snapshot()
+    memory.update_memory(0, [1], [2.0])
+    inner = memory.snapshot()
+    memory.restore(outer)
+    with pytest.raises(ValueError):
+        memory.restore(inner)
+    memory.restore(outer)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_backend_matches_memory(backend, seed):
+    rnd = random.Random(seed)
+    reference = Memory(ItemsLoader())
+    for step in range(300):
+        apply_random_operation([reference, backend], rnd, NUM_USERS, NUM_ITEMS)
+        if step % 10 == 0:
+            assert get_state(backend, NUM_USERS, NUM_ITEMS) == get_state(
+                reference, NUM_USERS, NUM_ITEMS
+            )
+    assert get_state(backend, NUM_USERS, NUM_ITEMS) == get_state(
+        reference, NUM_USERS, NUM_ITEMS
+    )
+
+
+class CountingItemsLoader(ItemsLoader):
+    def __init__(self):
+        self.loads = []
+
+    def load_items_from_ids(self, id_list):
+        self.loads += id_list
+        return super().load_items_from_ids(id_list)
+
+
+def test_history_view_follows_the_interactions():
+    """
+    The view lists the items in order of first interaction with their last interaction, also after the deletions
+    and the compactions of the holes they leave, every item is loaded once
+    """
+    loader = CountingItemsLoader()
+    memory = Memory(loader)
+    rnd = random.Random(5)
+    num_compactions = 0
+    for _ in range(500):
+        view = memory._user_views.get(0)
+        num_removed = 0 if view is None else view.num_removed
+        # more deletions than apply_random_operation, so that the view is compacted
+        item_id = rnd.randrange(NUM_ITEMS)
+        if memory.get_num_interaction(0, item_id) > 0 and rnd.random() < 0.4:
+            memory.delete_user_item(0, item_id)
+        else:
+            apply_random_operation([memory], rnd, 1, NUM_ITEMS)
+        num_compactions += memory._user_views[0].num_removed < num_removed
+        items, interactions = memory.get_items_and_scores(0)
+        seen_films = memory.user_to_seen_films[0]
+        assert items == [f"item{item_id}" for item_id in seen_films]
+        assert [as_tuple(i) for i in interactions] == [
+            as_tuple(seen_films[item_id][-1]) for item_id in seen_films
+        ]
+    assert num_compactions > 0
+    assert sorted(loader.loads) == list(range(NUM_ITEMS))
+
+
+def test_columnar_memory_get_columns():
+    memory = ColumnarMemory(ItemsLoader())
+    memory.update_memory(0, [3, 5, 3], [7.0, 2.0, 9.0])
+    memory.delete_last_user_item_interaction(0, 5)
+    memory.update_memory(0, [4], [1.0])
+    columns = memory.get_columns(0)
+    np.testing.assert_array_equal(columns["item_ids"], [3, 3, 4])
+    np.testing.assert_array_equal(columns["ratings"], [7.0, 9.0, 1.0])
+    np.testing.assert_array_equal(columns["timestamps"], [1, 3, 4])
+    np.testing.assert_array_equal(columns["num_watches"], [1, 2, 1])
+    assert not columns["item_ids"].flags.writeable
+    assert memory.get_columns(1)["item_ids"].size == 0
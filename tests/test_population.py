@@ -0,0 +1,48 @@
+import numpy as np
+from env_helpers import FakeItemsLoader, FakeLLM, FakeRater, make_users_loader
+
+from environment.items_retrieval import TimeItemsRetrieval
+from environment.population import PopulationSimulator
+
+
+def _make_simulator(llm, seed=0, **kwargs):
+    rng = np.random.default_rng(seed)
+    return PopulationSimulator(
+        FakeItemsLoader(),
+        make_users_loader(),
+        TimeItemsRetrieval(3),
+        FakeRater(llm),
+        policy=lambda sessions: [int(rng.integers(20)) for _ in sessions],
+        arrival_rate=5.0,
+        seed=seed,
+        **kwargs,
+    )
+
+
+def test_one_locked_llm_request_per_batch():
+    llm = FakeLLM()
+    simulator = _make_simulator(llm, batch_size=3, max_batch_wait=0.5)
+    stats = simulator.run(max_ratings=50)
+    assert stats["num_ratings"] >= 50
+    assert [n for _, n, _ in llm.requests] == simulator.batches_sizes
+    assert all(name == "request_rating_0_9_batch" for name, _, _ in llm.requests)
+    assert all(locked for _, _, locked in llm.requests)
+    assert max(simulator.batches_sizes) <= 3
+
+
+def test_same_seed_same_simulation():
+    first = _make_simulator(FakeLLM(), batch_size=4).run(max_ratings=40)
+    second = _make_simulator(FakeLLM(), batch_size=4).run(max_ratings=40)
+    assert first == second
+
+
+def test_memory_is_kept_across_sessions():
+    simulator = _make_simulator(FakeLLM(), churn_probability=0.3)
+    simulator.run(max_ratings=100)
+    sessions = simulator.finished_sessions
+    assert len(sessions) > 0
+    for user_id in {s.user.id for s in sessions}:
+        num_interactions = sum(
+            len(s.items_interact) for s in sessions if s.user.id == user_id
+        )
+        assert simulator.memory.get_num_items_interact(user_id) >= num_interactions
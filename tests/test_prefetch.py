@@ -0,0 +1,53 @@
+import time
+
+from env_helpers import FakeLLM, FakeRater, make_env
+
+from environment.prefetch import RatingPrefetcher
+
+
+def _make_env(llm, **kwargs):
+    rater = FakeRater(llm)
+    return make_env(llm_rater=rater, prefetcher=RatingPrefetcher(rater), **kwargs)
+
+
+def test_prefetched_ratings_match_step():
+    llm = FakeLLM()
+    env = _make_env(llm)
+    env.reset(seed=0)
+    env.step(2)
+    snapshot = env.snapshot()
+    expected = env.step(5)[4]["LLM_rating"]
+    env.restore(snapshot)
+    env.prefetch([5, 6])
+    assert env.step(5)[4]["LLM_rating"] == expected
+    assert env.prefetcher.hits == 1
+    env.close()
+
+
+def test_prefetch_waits_at_most_the_step_deadline():
+    llm = FakeLLM(delay=0.5)
+    env = _make_env(llm, step_deadline_ms=50)
+    env.reset(seed=1)
+    env.prefetch([3])
+    start = time.perf_counter()
+    _, _, _, _, info = env.step(3)
+    assert time.perf_counter() - start < 0.4
+    assert info["rating_fallback"]
+    assert env.prefetcher.misses == 1
+    env.close()
+
+
+def test_close_stops_the_prefetcher():
+    llm = FakeLLM()
+    env = _make_env(llm)
+    env.reset(seed=2)
+    env.prefetch([1])
+    prefetcher = env.prefetcher
+    env.close()
+    prefetcher._thread.join(timeout=5)
+    assert not prefetcher._thread.is_alive()
+    num_requests = llm.num_requests()
+    prefetcher.submit(env.llm_seed, [env._get_rating_queries(2)])
+    # the requests after close are ignored, the step queries the LLM itself
+    assert env.prefetcher.get(env.llm_seed, env._get_rating_queries(2)) is None
+    assert llm.num_requests() == num_requests
@@ -0,0 +1,57 @@
+from env_helpers import NUM_USERS, FakeLLM, make_env
+
+PAIRS = [(user_id, (3 * user_id + 1) % 7) for user_id in range(NUM_USERS)]
+HISTORIES = [
+    [(action, 5.0 + action % 3) for action in range(user_id)] for user_id, _ in PAIRS
+]
+
+
+def _rate_all(env, **kwargs):
+    users_ids, actions = zip(*PAIRS)
+    return env.rate_many(list(users_ids), list(actions), HISTORIES, seed=7, **kwargs)
+
+
+def test_rate_leaves_the_environment_untouched():
+    env = make_env(FakeLLM())
+    env.reset(seed=0)
+    env.step(1)
+    llm_seed = env.llm_seed
+    rngs = [rng.bit_generator.state for rng in env._get_random_generators()]
+    rater_rnd = env.rating_prompt.rnd.get_state()[1].tolist()
+    history = env.memory.get_items_and_scores(env._user.id)[0]
+
+    env.rate(0, 2, [(1, 8.0)])
+    _rate_all(env)
+
+    assert env.llm_seed == llm_seed
+    assert [rng.bit_generator.state for rng in env._get_random_generators()] == rngs
+    assert env.rating_prompt.rnd.get_state()[1].tolist() == rater_rnd
+    assert env.memory.get_items_and_scores(env._user.id)[0] == history
+
+
+def test_exact_rate_many_matches_rate():
+    llm = FakeLLM()
+    env = make_env(llm)
+    expected = [
+        env.rate(user_id, action, history, seed=7)
+        for (user_id, action), history in zip(PAIRS, HISTORIES)
+    ]
+    num_requests = llm.num_requests()
+    assert _rate_all(env, exact=True) == expected
+    assert llm.num_requests() - num_requests == len(PAIRS)
+
+
+def test_batched_rate_many_matches_rate_with_greedy_llm():
+    llm = FakeLLM(sample=False)
+    env = make_env(llm)
+    expected = [
+        env.rate(user_id, action, history, seed=7)
+        for (user_id, action), history in zip(PAIRS, HISTORIES)
+    ]
+    num_requests = llm.num_requests()
+    assert _rate_all(env, batch_size=2) == expected
+    assert llm.requests[num_requests:] == [
+        ("request_rating_0_9_batch", 2, True),
+        ("request_rating_0_9_batch", 2, True),
+        ("request_rating_0_9_batch", 1, True),
+    ]
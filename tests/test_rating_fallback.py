@@ -0,0 +1,60 @@
+import time
+from types import SimpleNamespace
+
+from env_helpers import FakeItem, FakeLLM, make_env
+
+from environment.LLM import RatingQuery
+from environment.rating_fallback import (
+    CachedRatingFallback,
+    ChainFallback,
+    VoteAverageFallback,
+)
+
+
+def test_generous_deadline_matches_no_deadline():
+    expected = make_env(FakeLLM())
+    env = make_env(FakeLLM(), step_deadline_ms=10000)
+    expected.reset(seed=0)
+    env.reset(seed=0)
+    for action in [1, 4, 2, 7, 1]:
+        info = env.step(action)[4]
+        assert not info["rating_fallback"]
+        assert info["LLM_rating"] == expected.step(action)[4]["LLM_rating"]
+    env.close()
+
+
+def test_late_answers_are_backfilled_into_the_cache():
+    llm = FakeLLM(delay=0.3)
+    env = make_env(llm, step_deadline_ms=20)
+    env.reset(seed=3, user_id=1)
+    expected = make_env(FakeLLM())
+    expected.reset(seed=3, user_id=1)
+    llm_rating = expected.step(4)[4]["LLM_rating"]
+
+    info = env.step(4)[4]
+    assert info["rating_fallback"]
+    # the item was never rated for the user, its vote average is used
+    assert info["LLM_rating"] == FakeItem(4).vote_average
+    # the late request is still in flight, the step falls back without querying the LLM
+    assert env.step(5)[4]["rating_fallback"]
+    assert llm.num_requests() == 1
+
+    time.sleep(0.5)
+    cache = env.rating_fallback.fallbacks[0]
+    assert cache.cache[(1, 4)] == llm_rating
+    info = env.step(4)[4]
+    assert info["rating_fallback"] and info["LLM_rating"] == llm_rating
+    env.close()
+
+
+def test_cached_rating_fallback_evicts_the_oldest():
+    def query(user_id, item_id):
+        return RatingQuery(SimpleNamespace(id=user_id), FakeItem(item_id), 0, [], [])
+
+    chain = ChainFallback([CachedRatingFallback(max_size=2), VoteAverageFallback()])
+    for item_id, rating in [(1, 9.0), (2, 8.0), (1, 7.0), (3, 6.0)]:
+        chain.update(query(0, item_id), rating)
+    assert chain.rate(query(0, 1)) == 7.0
+    assert chain.rate(query(0, 3)) == 6.0
+    # evicted, rated by its vote average
+    assert chain.rate(query(0, 2)) == FakeItem(2).vote_average
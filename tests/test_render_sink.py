@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+from env_helpers import FakeLLM, make_env
+
+from environment.render_sink import (
+    RENDER_COLUMNS,
+    RenderSink,
+    get_render_log_parts,
+    merge_render_logs,
+    read_render_log,
+)
+
+EXTENSIONS = ["csv", "parquet", "arrow"]
+
+
+def _render_episode(path: str, user_id: int, num_steps: int = 10) -> list:
+    """
+    Renders every step of an episode to path, return the rows expected in the log
+    """
+    env = make_env(FakeLLM(), render_mode="csv", render_path=path, render_buffer_size=4)
+    env.reset(seed=user_id, user_id=user_id)
+    for action in range(num_steps):
+        env.step(action)
+        env.render()
+    rows = [
+        (user_id, f"User {user_id}", time + 1, int(movie_id), int(rating))
+        for time, (movie_id, rating) in enumerate(env._items_interact)
+    ]
+    env.close()
+    return rows
+
+
+def _read_rows(path: str) -> list:
+    df = read_render_log(path)
+    assert list(df.columns) == RENDER_COLUMNS
+    return [tuple(row) for row in df.itertuples(index=False)]
+
+
+@pytest.mark.parametrize("extension", EXTENSIONS)
+def test_env_renders_every_step(tmp_path, extension):
+    path = str(tmp_path / f"render.{extension}")
+    expected = _render_episode(path, 1)
+    assert _read_rows(path) == expected
+
+
+@pytest.mark.parametrize("extension", EXTENSIONS)
+def test_existing_log_is_appended_to(tmp_path, extension):
+    path = str(tmp_path / f"render.{extension}")
+    expected = _render_episode(path, 1) + _render_episode(path, 2)
+    assert _read_rows(path) == expected
+    # the files of Parquet and Arrow can not be appended to, the rows go to a new part
+    assert len(get_render_log_parts(path)) == (1 if extension == "csv" else 2)
+
+
+def test_merge_render_logs(tmp_path):
+    shards = [str(tmp_path / f"shard{i}.parquet") for i in range(3)]
+    expected = []
+    for user_id, shard in enumerate(shards):
+        expected += _render_episode(shard, user_id)
+    path = str(tmp_path / "merged.arrow")
+    merge_render_logs(shards, path, buffer_size=7)
+    assert _read_rows(path) == expected
+
+
+def test_rows_are_written_on_close(tmp_path):
+    path = str(tmp_path / "render.csv")
+    sink = RenderSink(path, buffer_size=4)
+    for time in range(3):
+        sink.append(0, "User 0", time, 5, 7)
+    assert get_render_log_parts(path) == []
+    sink.close()
+    assert len(pd.read_csv(path)) == 3
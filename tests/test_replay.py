@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, FakeRater, make_env
+
+from environment.replay import StepLog, StepRecorder
+
+ACTIONS = np.random.RandomState(0).randint(NUM_ITEMS, size=20)
+
+
+def _run(env) -> list:
+    env.reset(seed=0)
+    trace = []
+    for action in ACTIONS:
+        _, reward, terminated, truncated, info = env.step(action)
+        trace.append((reward, info["LLM_rating"]))
+        if terminated or truncated:
+            env.reset()
+    env.close()
+    return trace
+
+
+class _OtherRater(FakeRater):
+    def _get_prompt(self, user, item, num_interacted, interactions, retrieved_items):
+        prompt = super()._get_prompt(
+            user, item, num_interacted, interactions, retrieved_items
+        )
+        prompt[0]["content"] += "."
+        return prompt
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    path = str(tmp_path / "steps.log")
+    expected = _run(make_env(FakeLLM(), recorder=StepRecorder(path)))
+    return path, expected
+
+
+def test_replay_reproduces_the_ratings(log_path):
+    path, expected = log_path
+    llm = FakeLLM()
+    log = StepLog(path)
+    assert len(log) == len(ACTIONS)
+    assert _run(make_env(llm, replay=log)) == expected
+    assert llm.num_requests() == 0
+
+
+def test_replay_with_other_prompts_raises(log_path):
+    path, _ = log_path
+    env = make_env(llm_rater=_OtherRater(FakeLLM()), replay=StepLog(path))
+    env.reset(seed=0)
+    with pytest.raises(ValueError, match="prompts"):
+        env.step(ACTIONS[0])
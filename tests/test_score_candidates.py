@@ -0,0 +1,55 @@
+import numpy as np
+from env_helpers import FakeLLM, make_env
+
+
+def test_one_batched_request_without_side_effects():
+    llm = FakeLLM()
+    env = make_env(llm)
+    env.reset(seed=0)
+    for action in range(3):
+        env.step(action)
+    items_interact = env._items_interact.copy()
+    memory = (
+        env.memory.get_items_and_scores(env._user.id)[0],
+        env.memory.get_num_items_interact(env._user.id),
+    )
+    llm_seed = env.llm_seed
+    rngs = [rng.bit_generator.state for rng in env._get_random_generators()]
+    num_requests = llm.num_requests()
+
+    scores = env.score_candidates(list(range(10)))
+
+    assert scores.shape == (10,)
+    assert llm.requests[num_requests:] == [("request_rating_0_9_batch", 10, True)]
+    np.testing.assert_array_equal(env._items_interact, items_interact)
+    assert (
+        env.memory.get_items_and_scores(env._user.id)[0],
+        env.memory.get_num_items_interact(env._user.id),
+    ) == memory
+    assert env.llm_seed == llm_seed
+    assert [rng.bit_generator.state for rng in env._get_random_generators()] == rngs
+
+
+def test_exact_scores_match_step():
+    env = make_env(FakeLLM())
+    env.reset(seed=1)
+    env.step(4)
+    candidates = [0, 4, 7, 11]
+    scores = env.score_candidates(candidates, reshape=False, exact=True)
+    for action, score in zip(candidates, scores):
+        snapshot = env.snapshot()
+        _, _, _, _, info = env.step(action)
+        assert info["LLM_rating"] == score
+        env.restore(snapshot)
+
+
+def test_batched_scores_match_step_with_greedy_llm():
+    env = make_env(FakeLLM(sample=False))
+    env.reset(seed=2)
+    env.step(3)
+    candidates = [1, 3, 5]
+    scores = env.score_candidates(candidates, reshape=False)
+    for action, score in zip(candidates, scores):
+        snapshot = env.snapshot()
+        assert env.step(action)[4]["LLM_rating"] == score
+        env.restore(snapshot)
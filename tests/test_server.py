@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from env_helpers import FakeLLM, FakeRater, make_env
+
+import environment.server
+from environment.server import EnvClient, EnvServer
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """
+    Runs servers in an event loop in a background thread, return the function that starts one
+    and the loop, the servers are cancelled at the end of the test
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servings = []
+
+    def start(server: EnvServer):
+        server.unix_socket = str(tmp_path / f"server{len(servings)}.sock")
+
+        async def serve():
+            started = asyncio.Event()
+            task = asyncio.ensure_future(server.serve(started))
+            await started.wait()
+            return task
+
+        servings.append(asyncio.run_coroutine_threadsafe(serve(), loop).result(10))
+        return server.unix_socket
+
+    yield start, loop
+    for task in servings:
+        loop.call_soon_threadsafe(task.cancel)
+    time.sleep(0.1)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+
+
+def _wait_for(condition, timeout: float = 10):
+    end = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < end
+        time.sleep(0.01)
+
+
+def test_steps_of_the_clients_are_batched(serve):
+    start, _ = serve
+    llm = FakeLLM()
+    rater = FakeRater(llm)
+    server = EnvServer(lambda i: make_env(llm_rater=rater), max_batch_wait=0.5)
+    address = start(server)
+    clients = [EnvClient(address) for _ in range(2)]
+    for i, client in enumerate(clients):
+        client.reset(seed=i, user_id=i)
+    results = [None] * len(clients)
+
+    def step(i):
+        results[i] = clients[i].step(3)
+
+    threads = [threading.Thread(target=step, args=(i,)) for i in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert server.batches_sizes == [2]
+    assert llm.requests == [("request_rating_0_9_batch", 2, True)]
+    assert all(result[4]["LLM_rating"] is not None for result in results)
+    for client in clients:
+        client.close()
+    assert server.envs == {}
+
+
+def test_session_is_closed_after_its_batch(serve, monkeypatch):
+    """
+    The handler of a connection is cancelled while a step of its session is being computed,
+    the environment is closed only when the step is done
+    """
+    start, loop = serve
+    batch_done = threading.Event()
+    closed = []
+    step_batch = environment.server.step_batch
+
+    def slow_step_batch(*args, **kwargs):
+        try:
+            return step_batch(*args, **kwargs)
+        finally:
+            batch_done.set()
+
+    def make(i):
+        env = make_env(FakeLLM(delay=0.5))
+        close = env.close
+        env.close = lambda: (closed.append(batch_done.is_set()), close())
+        return env
+
+    monkeypatch.setattr(environment.server, "step_batch", slow_step_batch)
+    server = EnvServer(make, max_batch_wait=0.0)
+    client = EnvClient(start(server))
+    client.reset(seed=0)
+    thread = threading.Thread(target=lambda: pytest.raises(Exception, client.step, 1))
+    thread.start()
+    _wait_for(lambda: len(server._running_batches) == 1)
+
+    async def cancel_handlers():
+        for task in asyncio.all_tasks():
+            if task.get_coro().__qualname__ == "EnvServer._handle":
+                task.cancel()
+
+    asyncio.run_coroutine_threadsafe(cancel_handlers(), loop).result(10)
+    _wait_for(lambda: closed)
+    assert closed == [True]
+    assert server.envs == {}
+    thread.join(10)
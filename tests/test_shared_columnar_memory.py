@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+from memory_helpers import ItemsLoader
+
+from environment.shared_columnar_memory import SharedColumnarMemory
+
+NUM_USERS = 4
+
+
+@pytest.fixture
+def memory():
+    memory = SharedColumnarMemory(
+        ItemsLoader(), NUM_USERS, max_interactions_per_user=8, num_locks=2
+    )
+    yield memory
+    memory.close()
+
+
+def _run_in_worker(target, *args):
+    worker = multiprocessing.get_context("fork").Process(target=target, args=args)
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+
+def _update(handle, user_id, items_ids, scores):
+    memory = SharedColumnarMemory.attach(ItemsLoader(), handle)
+    memory.update_memory(user_id, items_ids, scores)
+    memory.close()
+
+
+def _delete(handle, user_id, item_id):
+    memory = SharedColumnarMemory.attach(ItemsLoader(), handle)
+    memory.delete_user_item(user_id, item_id)
+    memory.close()
+
+
+def test_workers_share_the_histories(memory):
+    _run_in_worker(_update, memory.handle, 1, [3, 3], [4.0, 6.0])
+    assert memory.get_num_items_interact(1) == 2
+    assert memory.get_num_interaction(1, 3) == 2
+    items, interactions = memory.get_items_and_scores(1)
+    assert items == ["item3"]
+    assert interactions[0].rating == 6.0
+
+
+def test_watch_counts_follow_the_other_workers(memory):
+    memory.update_memory(0, [2, 5], [1.0, 2.0])
+    assert memory.get_num_interaction(0, 2) == 1
+    _run_in_worker(_update, memory.handle, 0, [2], [3.0])
+    assert memory.get_num_interaction(0, 2) == 2
+    _run_in_worker(_delete, memory.handle, 0, 2)
+    assert memory.get_num_interaction(0, 2) == 0
+    assert memory.get_num_interaction(0, 5) == 1
+    memory.update_memory(0, [2], [4.0])
+    assert memory.get_num_interaction(0, 2) == 1
+
+
+def test_restore_only_the_users_of_the_process(memory):
+    memory.update_memory(0, [1], [5.0])
+    snapshot = memory.snapshot()
+    memory.update_memory(0, [2], [5.0])
+    _run_in_worker(_update, memory.handle, 1, [3], [5.0])
+    memory.restore(snapshot)
+    assert memory.get_num_items_interact(0) == 1
+    assert memory.get_num_interaction(0, 2) == 0
+    assert memory.get_num_items_interact(1) == 1
+    memory.update_memory(0, [2], [5.0])
+    assert memory.get_num_interaction(0, 2) == 1
+
+
+def test_snapshot_saves_only_the_users_written(memory):
+    memory.update_memory(0, [1, 2], [5.0, 6.0])
+    memory.update_memory(1, [1], [5.0])
+    snapshot = memory.snapshot()
+    assert memory._journal == []
+    memory.update_memory(0, [3], [5.0])
+    memory.delete_user_item(0, 1)
+    # the user is saved once, before its first change
+    assert [user_id for user_id, _, _ in memory._journal] == [0]
+    memory.restore(snapshot)
+    assert memory.get_num_items_interact(0) == 2
+    assert memory.get_num_interaction(0, 1) == 1
+    assert memory.get_num_interaction(0, 3) == 0
+    del snapshot
+    memory.update_memory(0, [3], [5.0])
+    assert memory._journal is None
+
+
+def test_full_history_raises(memory):
+    memory.update_memory(2, list(range(8)), [1.0] * 8)
+    with pytest.raises(ValueError):
+        memory.update_memory(2, [0], [1.0])
+
+
+def test_attaching_process_does_not_unlink_the_block(memory):
+    """
+    A process not started by the owner has its own resource tracker, which must not unlink the block when it exits
+    """
+    name = memory.handle[0]
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from environment.shared_columnar_memory import _attach_block;"
+            f"_attach_block({name!r}).close()",
+        ],
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    SharedMemory(name=name).close()
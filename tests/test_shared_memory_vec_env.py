@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from algorithms.shared_memory_vec_env import SharedMemoryVecEnv
+from algorithms.wrappers import StableBaselineWrapperNum
+
+NUM_ENVS = 3
+
+
+def _make_env():
+    return StableBaselineWrapperNum(make_env(FakeLLM()))
+
+
+def _assert_equal(observation, expected):
+    assert observation.keys() == expected.keys()
+    for key in observation:
+        np.testing.assert_array_equal(observation[key], expected[key])
+
+
+def test_steps_match_dummy_vec_env():
+    env = SharedMemoryVecEnv([_make_env] * NUM_ENVS)
+    expected = DummyVecEnv([_make_env] * NUM_ENVS)
+    env.seed(0)
+    expected.seed(0)
+    _assert_equal(env.reset(), expected.reset())
+    rnd = np.random.RandomState(0)
+    num_dones = 0
+    for _ in range(80):
+        actions = rnd.randint(NUM_ITEMS, size=NUM_ENVS)
+        observation, reward, done, info = env.step(actions)
+        expected_observation, expected_reward, expected_done, expected_info = (
+            expected.step(actions)
+        )
+        _assert_equal(observation, expected_observation)
+        np.testing.assert_array_equal(reward, expected_reward)
+        np.testing.assert_array_equal(done, expected_done)
+        for index in np.flatnonzero(done):
+            _assert_equal(
+                info[index]["terminal_observation"],
+                expected_info[index]["terminal_observation"],
+            )
+        num_dones += done.sum()
+    # the episodes end, so that the terminal observations are checked too
+    assert num_dones > 0
+    env.close()
+    expected.close()
+
+
+def test_observations_are_copies():
+    env = SharedMemoryVecEnv([_make_env] * 2, start_method="fork")
+    observation = env.reset()
+    before = {key: value.copy() for key, value in observation.items()}
+    env.step(np.array([1, 2]))
+    _assert_equal(observation, before)
+    env.close()
+
+
+def test_rejects_observations_not_in_boxes():
+    with pytest.raises(ValueError, match="Box"):
+        SharedMemoryVecEnv([lambda: make_env(FakeLLM())], start_method="fork")
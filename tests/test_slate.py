@@ -0,0 +1,34 @@
+from env_helpers import FakeLLM, make_env
+from gymnasium import spaces
+
+SLATE = [2, 7, 11]
+
+
+def test_slate_is_rated_in_one_request():
+    llm = FakeLLM()
+    env = make_env(llm, slate_size=len(SLATE))
+    assert env.action_space == spaces.MultiDiscrete([env.num_items] * len(SLATE))
+    env.reset(seed=0, user_id=2)
+    num_requests = llm.num_requests()
+    observation, _, _, _, info = env.step(SLATE)
+    assert llm.requests[num_requests:] == [
+        ("request_rating_0_9_batch", len(SLATE), True)
+    ]
+    assert len(info["LLM_rating"]) == len(SLATE)
+    # only the items picked by the selector are consumed
+    selected = info["selected_actions"]
+    assert set(selected) <= set(SLATE)
+    assert [action for action, _ in observation["items_interact"]] == selected
+    assert env.memory.get_num_items_interact(2) == len(selected)
+    for action in SLATE:
+        assert env.memory.get_num_interaction(2, env.action_to_item[action]) == (
+            1 if action in selected else 0
+        )
+
+
+def test_slate_ratings_match_the_ratings_of_the_items_with_greedy_llm():
+    env = make_env(FakeLLM(sample=False), slate_size=len(SLATE))
+    env.reset(seed=1)
+    env.step([0, 1, 2])
+    scores = env.score_candidates(SLATE, reshape=False)
+    assert env.step(SLATE)[4]["LLM_rating"] == list(scores)
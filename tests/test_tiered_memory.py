@@ -0,0 +1,113 @@
+import functools
+import gc
+import os
+import random
+
+import pytest
+from env_helpers import make_env
+from memory_helpers import ItemsLoader, apply_random_operation, get_state
+
+from environment.tiered_memory import TieredMemory
+
+NUM_USERS = 5
+NUM_ITEMS = 8
+
+
+@pytest.fixture
+def memory():
+    memory = TieredMemory(ItemsLoader(), max_hot_users=2)
+    yield memory
+    memory.close()
+
+
+def _run(memory, rnd, steps):
+    for _ in range(steps):
+        apply_random_operation([memory], rnd, NUM_USERS, NUM_ITEMS)
+
+
+def test_only_the_recent_users_are_in_ram(memory):
+    _run(memory, random.Random(0), 100)
+    get_state(memory, NUM_USERS, NUM_ITEMS)
+    assert len(memory._hot_users) == 2
+    assert len(memory.user_to_seen_films) <= 2
+    (num_cold_users,) = memory._db.execute("SELECT COUNT(*) FROM users").fetchone()
+    assert num_cold_users >= NUM_USERS - 2
+
+
+def test_savepoints_are_released_when_the_snapshots_are_dropped(memory):
+    rnd = random.Random(1)
+    _run(memory, rnd, 20)
+    outer = memory.snapshot()
+    _run(memory, rnd, 20)
+    inner = memory.snapshot()
+    del outer
+    gc.collect()
+    _run(memory, rnd, 20)
+    memory.snapshot()
+    gc.collect()
+    memory.clear()
+    # the savepoint of the outer snapshot is kept as long as the inner one is needed
+    assert len(memory._savepoints) == 2
+    del inner
+    gc.collect()
+    memory.clear()
+    assert memory._savepoints == []
+    assert not memory._db.in_transaction
+
+
+def test_restoring_an_older_snapshot_invalidates_the_newer_ones(memory):
+    rnd = random.Random(2)
+    older = memory.snapshot()
+    _run(memory, rnd, 20)
+    newer = memory.snapshot()
+    _run(memory, rnd, 20)
+    memory.restore(older)
+    with pytest.raises(ValueError):
+        memory.restore(newer)
+
+
+def test_clear_reuses_the_database(memory):
+    rnd = random.Random(3)
+    _run(memory, rnd, 50)
+    path = memory.path
+    memory.clear()
+    assert memory.path == path
+    assert all(memory.get_num_items_interact(u) == 0 for u in range(NUM_USERS))
+    assert memory._db.execute("SELECT COUNT(*) FROM users").fetchone() == (0,)
+
+
+def test_snapshot_is_restored_after_clear(memory):
+    rnd = random.Random(4)
+    _run(memory, rnd, 50)
+    snapshot = memory.snapshot()
+    expected = get_state(memory, NUM_USERS, NUM_ITEMS)
+    memory.clear()
+    _run(memory, rnd, 50)
+    memory.restore(snapshot)
+    assert get_state(memory, NUM_USERS, NUM_ITEMS) == expected
+
+
+def test_close_deletes_the_temporary_database():
+    memory = TieredMemory(ItemsLoader(), max_hot_users=1)
+    _run(memory, random.Random(5), 20)
+    path = memory.path
+    memory.close()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize("keep_memory", [False, True])
+def test_env_keeps_the_histories_only_with_keep_memory(keep_memory):
+    env = make_env(
+        memory_factory=functools.partial(TieredMemory, max_hot_users=2),
+        keep_memory=keep_memory,
+    )
+    memory = env.memory
+    env.reset(seed=0, user_id=1)
+    for action in range(3):
+        env.step(action)
+    env.reset(user_id=2)
+    # the memory is emptied in place or kept, never replaced
+    assert env.memory is memory
+    assert memory.get_num_items_interact(1) == (3 if keep_memory else 0)
+    env.close()
+    memory.close()
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from env_helpers import FakeLLM, make_env
+
+from environment.timing import StageTimer
+
+STAGES = {
+    "load_items",
+    "memory",
+    "retrieval",
+    "llm",
+    "selection",
+    "perturbation",
+    "reward_shaping",
+    "step",
+}
+
+
+def test_step_reports_the_time_of_every_stage(tmp_path):
+    env = make_env(FakeLLM(delay=0.02), timing_info=True)
+    env.reset(seed=0)
+    for action in range(3):
+        timings = env.step(action)[4]["timings"]
+        assert set(timings) == STAGES
+        assert timings["llm"] >= 0.02
+        assert timings["step"] >= sum(
+            duration for stage, duration in timings.items() if stage != "step"
+        )
+    summary = env.timer.summary()
+    assert summary["llm"]["count"] == 3
+    assert summary["llm"]["p50_ms"] >= 20
+    path = tmp_path / "timings.json"
+    env.timer.dump(str(path))
+    assert json.loads(path.read_text()) == summary
+
+
+def test_timing_is_disabled_by_default():
+    env = make_env(FakeLLM())
+    env.reset(seed=0)
+    assert "timings" not in env.step(0)[4]
+    assert env.timer.summary() == {}
+
+
+def test_percentiles_over_the_rolling_window():
+    timer = StageTimer(window=4)
+    for duration in [10.0, 1.0, 2.0, 3.0, 4.0]:
+        timer.begin_step()
+        timer.add("stage", duration)
+        timer.end_step()
+    summary = timer.summary()["stage"]
+    # the first step has left the window
+    assert summary["count"] == 5
+    assert summary["mean_ms"] == pytest.approx(2500)
+    assert summary["p50_ms"] == pytest.approx(2500)
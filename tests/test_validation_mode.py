@@ -0,0 +1,40 @@
+import numpy as np
+from env_helpers import NUM_ITEMS, FakeLLM, make_env
+from stable_baselines3.common.env_checker import check_env
+
+from algorithms.wrappers import StableBaselineWrapperNum
+
+
+def _run(env, actions) -> list:
+    trace = []
+    for action in actions:
+        observation, reward, terminated, truncated, info = env.step(action)
+        trace.append(
+            (
+                {key: np.asarray(value).tolist() for key, value in observation.items()},
+                reward,
+                info["LLM_rating"],
+            )
+        )
+        if terminated or truncated:
+            env.reset()
+    return trace
+
+
+def test_check_env_does_not_query_the_llm_nor_change_the_state():
+    actions = np.random.RandomState(0).randint(NUM_ITEMS, size=30)
+    expected = make_env(FakeLLM())
+    expected.reset(seed=0)
+    _run(expected, actions[:5])
+
+    llm = FakeLLM()
+    env = make_env(llm)
+    env.reset(seed=0)
+    _run(env, actions[:5])
+    num_requests = llm.num_requests()
+    rater, timing = env.rating_prompt, env.timer.enabled
+    with env.validation_mode():
+        check_env(StableBaselineWrapperNum(env))
+    assert llm.num_requests() == num_requests
+    assert env.rating_prompt is rater and env.timer.enabled == timing
+    assert _run(env, actions[5:]) == _run(expected, actions[5:])
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from env_helpers import NUM_ITEMS, FakeLLM, FakeRater, make_env
+
+from environment.vector_env import BatchedSimulatio4RecSys
+
+NUM_ENVS = 3
+
+
+def _make_vector_env(rater, **kwargs) -> BatchedSimulatio4RecSys:
+    return BatchedSimulatio4RecSys(
+        [lambda: make_env(llm_rater=rater, **kwargs) for _ in range(NUM_ENVS)]
+    )
+
+
+@pytest.mark.parametrize("step_deadline_ms", [None, 10000])
+def test_one_llm_request_per_step(step_deadline_ms):
+    llm = FakeLLM()
+    env = _make_vector_env(FakeRater(llm), step_deadline_ms=step_deadline_ms)
+    env.reset(seed=0)
+    for step in range(1, 4):
+        env.step(np.arange(NUM_ENVS) + step)
+        assert llm.requests == [("request_rating_0_9_batch", NUM_ENVS, True)] * step
+    env.close()
+
+
+def test_batched_steps_match_sequential_steps_with_greedy_llm():
+    """
+    With a sampling LLM the batch depends on the seed of the first session, with greedy decoding
+    the batched steps are the steps of every session on its own
+    """
+    actions = np.random.RandomState(0).randint(NUM_ITEMS, size=(10, NUM_ENVS))
+    vector_env = _make_vector_env(FakeRater(FakeLLM(sample=False)))
+    vector_env.reset(seed=0)
+    batched = [vector_env.step(step_actions)[1].tolist() for step_actions in actions]
+    vector_env.close()
+
+    sequential = np.zeros(actions.shape)
+    rater = FakeRater(FakeLLM(sample=False))
+    for i in range(NUM_ENVS):
+        env = make_env(llm_rater=rater)
+        env.reset(seed=i)
+        for step, action in enumerate(actions[:, i]):
+            _, sequential[step, i], terminated, truncated, _ = env.step(action)
+            if terminated or truncated:
+                env.reset()
+        env.close()
+    assert batched == sequential.tolist()